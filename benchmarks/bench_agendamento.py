@@ -0,0 +1,119 @@
+# benchmarks/bench_agendamento.py
+"""
+Carga no agendamento: vários processos (como workers do uvicorn) disparando
+processar_agendamento em paralelo contra o mesmo Redis, disputando poucos
+horários. Verifica que não há dupla reserva e mede a vazão.
+
+Uso: python -m benchmarks.bench_agendamento [processos] [pedidos_por_processo]
+Sem Redis acessível em REDIS_URL, roda em um processo só com fakeredis.
+Com Redis, use uma instância de desenvolvimento: cada rodada usa uma segunda-feira
+sorteada num futuro distante e deixa as chaves slots:* dela no Redis.
+"""
+
+import asyncio
+import datetime
+import multiprocessing
+import random
+import sys
+import time
+
+import core.sessions as sessions
+import services.scheduler as scheduler
+import services.slot_inventory as inventario
+
+
+async def _pacote_ok(lead_id: str) -> bool:
+    return True
+
+
+def _preparar(data: str):
+    scheduler.validar_pacote_obrigatorio = _pacote_ok
+    scheduler.slots[data] = [f"{h:02d}:{m:02d}" for h in range(8, 18) for m in (0, 30)]
+
+
+async def _disparar(data: str, pedidos: int, prefixo: str) -> list[dict]:
+    _preparar(data)
+    agenda = scheduler.slots[data]
+    return await asyncio.gather(*(
+        scheduler.processar_agendamento(f"{prefixo}-{n}", data, random.choice(agenda), distancia_km=0)
+        for n in range(pedidos)
+    ))
+
+
+def _processo(data: str, pedidos: int, prefixo: str, saida):
+    resultados = asyncio.run(_disparar(data, pedidos, prefixo))
+    saida.put([(r["status"], r.get("horario")) for r in resultados])
+
+
+async def _medir_busca(data: str, repeticoes: int = 200) -> float:
+    """
+    Latência média (ms) de "próximos 3 livres" a partir do dia lotado, varrendo o calendário.
+    """
+    await scheduler.proximos_slots(data, quantidade=3)  # carrega o horizonte
+    inicio = time.perf_counter()
+    for _ in range(repeticoes):
+        await scheduler.proximos_slots(data, quantidade=3)
+    return (time.perf_counter() - inicio) / repeticoes * 1000
+
+
+async def _no_redis(chamada):
+    """
+    Executa a chamada e desconecta o pool: cada asyncio.run tem seu próprio loop
+    (e os processos filhos não herdam conexões abertas).
+    """
+    try:
+        return await chamada
+    finally:
+        await sessions.redis_client.connection_pool.disconnect()
+
+
+def _redis_acessivel() -> bool:
+    try:
+        return bool(asyncio.run(_no_redis(sessions.redis_client.ping())))
+    except Exception:
+        return False
+
+
+def main():
+    processos = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    pedidos = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    segunda = datetime.date(random.randint(2100, 9000), 1, 1)
+    data = (segunda + datetime.timedelta(days=-segunda.weekday() % 7)).isoformat()
+    _preparar(data)
+
+    if _redis_acessivel():
+        modo = f"Redis ({processos} processos)"
+        fila = multiprocessing.Queue()
+        filhos = [
+            multiprocessing.Process(target=_processo, args=(data, pedidos, f"p{i}", fila))
+            for i in range(processos)
+        ]
+        inicio = time.perf_counter()
+        for p in filhos:
+            p.start()
+        resultados = [r for _ in filhos for r in fila.get()]
+        for p in filhos:
+            p.join()
+    else:
+        import fakeredis
+
+        modo = "fakeredis (1 processo)"
+        processos = 1
+        sessions.redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True, max_connections=10_000)
+        inicio = time.perf_counter()
+        resultados = [(r["status"], r.get("horario")) for r in asyncio.run(_disparar(data, pedidos, "p0"))]
+    duracao = time.perf_counter() - inicio
+
+    estado = asyncio.run(_no_redis(inventario.estado_dia(data, scheduler.agenda_do_dia)))
+    busca_ms = asyncio.run(_no_redis(_medir_busca(data)))
+    reservados = [h for status, h in resultados if status == "preliminar"]
+    print(f"Modo: {modo}, {len(resultados)} pedidos para {len(scheduler.slots[data])} horários")
+    print(f"vazão: {len(resultados) / duracao:.0f} agendamentos/s ({duracao:.2f}s)")
+    print(f"reservas preliminares: {len(reservados)} (horários distintos: {len(set(reservados))})")
+    print(f"donos distintos no Redis: {len(set(estado['reservados'].values()))}")
+    print(f"duplas reservas: {len(reservados) - len(set(reservados))}")
+    print(f"busca dos próximos 3 livres ({scheduler.AGENDA_HORIZONTE_DIAS} dias de agenda): {busca_ms:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
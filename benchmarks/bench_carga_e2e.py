@@ -0,0 +1,230 @@
+# benchmarks/bench_carga_e2e.py
+"""
+Carga ponta a ponta no webhook: sobe o main.app (lifespan incluso) com substitutos
+locais de todos os serviços externos e reproduz milhares de conversas sintéticas
+em paralelo, medindo o que o lead sente.
+- Ollama falso em outro processo (latência até o primeiro token e tokens/s configuráveis),
+  falando o protocolo HTTP real
+- fakeredis, Supabase em memória e Z-API falsa (tests/fakes/ambiente.py)
+- Conversas: saudação, pergunta de preço, dúvida livre e agendamento completo
+  (pede data → informa data/horário → reserva), com reenvios da Z-API no meio
+
+Relata latência do webhook (p50/p95/p99), vazão, mensagens entregues na Z-API falsa,
+RSS do processo e o tempo médio de cada etapa (utils/metrics). Com --p95-max-ms,
+termina com código 1 se o p95 passar do limite (para barrar regressões antes do deploy).
+
+Uso: python -m benchmarks.bench_carga_e2e [--conversas 2000] [--concorrencia 200]
+         [--llm-latencia-ms 50] [--llm-tokens-s 400] [--zapi-latencia-ms 20]
+         [--supabase-latencia-ms 15] [--p95-max-ms N]
+Os modos do app continuam vindo do ambiente (ZAPI_INGESTAO=fila, LLM_STREAMING=1,
+COALESCER_JANELA_MS...). Os logs vão para /dev/null: o custo de registrá-los
+continua medido, a saída não inunda o terminal.
+"""
+
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+import utils.logger as logger
+from main import app
+from services.scheduler import AGENDA_SEMANAL
+from tests.fakes.ambiente import AmbienteLocal
+from tests.fakes.supabase import fake_supabase_leads
+from tests.fakes.zapi import FakeZapi
+from utils.metrics import ETAPAS, LLM_TOKENS_S, limpar_metricas
+
+PERGUNTAS_LIVRES = [
+    "Oi, boa tarde!",
+    "Vocês atendem por convênio?",
+    "Meu marido fez um espermograma e o resultado veio alterado, o que isso significa?",
+    "Estou tentando engravidar há um ano, a consulta é online?",
+    "Qual a diferença entre os pacotes?",
+]
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _subir_ollama(latencia_ms: float, tokens_s: float) -> tuple[subprocess.Popen, str]:
+    """
+    Ollama falso em outro processo: a CPU e a memória dele ficam fora da medição.
+    """
+    porta = _porta_livre()
+    processo = subprocess.Popen([
+        sys.executable, "-m", "tests.fakes.ollama", "--porta", str(porta),
+        "--latencia", str(latencia_ms / 1000), "--tokens-por-segundo", str(tokens_s),
+    ])
+    url = f"http://127.0.0.1:{porta}"
+    limite = time.monotonic() + 15
+    while time.monotonic() < limite:
+        try:
+            httpx.get(f"{url}/api/tags", timeout=0.5)
+            return processo, url
+        except httpx.TransportError:
+            time.sleep(0.05)
+    processo.kill()
+    raise RuntimeError("[ERRO] Ollama falso não subiu")
+
+
+def _datas_de_atendimento(quantidade: int = 8) -> list[str]:
+    dia = datetime.date.today() + datetime.timedelta(days=1)
+    datas = []
+    while len(datas) < quantidade:
+        if dia.weekday() in AGENDA_SEMANAL:
+            datas.append(dia.isoformat())
+        dia += datetime.timedelta(days=1)
+    return datas
+
+
+def _roteiro(rng: random.Random, datas: list[str]) -> list[str]:
+    """
+    Mensagens de uma conversa sintética.
+    """
+    tipo = rng.choices(["livre", "preco", "agendamento"], weights=[4, 3, 3])[0]
+    if tipo == "preco":
+        return ["Olá!", "Quanto custa uma consulta?", rng.choice(PERGUNTAS_LIVRES)]
+    if tipo == "agendamento":
+        data = rng.choice(datas)
+        horario = rng.choice(AGENDA_SEMANAL[datetime.date.fromisoformat(data).weekday()])
+        return ["Quero agendar uma consulta", f"{data} {horario}", "Quero agendar"]
+    return rng.sample(PERGUNTAS_LIVRES, 2)
+
+
+def _payload(numero: str, texto: str, message_id: str) -> dict:
+    return {
+        "type": "ReceivedCallback",
+        "fromMe": False,
+        "isGroup": False,
+        "phone": numero,
+        "messageId": message_id,
+        "momment": int(time.time() * 1000),
+        "senderName": "Lead",
+        "text": {"message": texto},
+    }
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return 0.0
+
+
+def _pico_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def _conversar(cliente, numero, mensagens, vagas, latencias, falhas, rng, reenvios):
+    async with vagas:
+        for n, texto in enumerate(mensagens):
+            payload = _payload(numero, texto, f"bench-{numero}-{n}")
+            inicio = time.perf_counter()
+            resposta = await cliente.post("/zapi/webhook", json=payload)
+            latencias.append(time.perf_counter() - inicio)
+            if resposta.status_code != 200 or not resposta.json().get("ok"):
+                falhas.append(resposta.status_code)
+            if rng.random() < reenvios:
+                # A Z-API reenvia quando a resposta demora: deve ser descartado pelo dedup
+                await cliente.post("/zapi/webhook", json=payload)
+
+
+async def _rodar(args, datas: list[str], leads: list[str]) -> tuple[list[float], list[int], float]:
+    rng = random.Random(args.semente)
+    conversas = [(numero, _roteiro(rng, datas)) for numero in leads]
+    vagas = asyncio.Semaphore(args.concorrencia)
+    latencias: list[float] = []
+    falhas: list[int] = []
+    transporte = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transporte, base_url="http://nora", timeout=None) as cliente:
+            inicio = time.perf_counter()
+            await asyncio.gather(*(
+                _conversar(cliente, numero, mensagens, vagas, latencias, falhas, rng, args.reenvios)
+                for numero, mensagens in conversas
+            ))
+            duracao = time.perf_counter() - inicio
+    return latencias, falhas, duracao
+
+
+def _etapas() -> list[str]:
+    linhas = []
+    for (etapa, operacao), serie in sorted(ETAPAS.series.items(), key=lambda i: -i[1][-1]):
+        chamadas = sum(serie[:-1])
+        linhas.append(f"  {etapa + '/' + operacao:<28} {chamadas:>7} chamadas  {serie[-1] / chamadas * 1000:8.2f} ms em média")
+    return linhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga ponta a ponta no webhook com serviços locais")
+    parser.add_argument("--conversas", type=int, default=2000)
+    parser.add_argument("--concorrencia", type=int, default=200, help="conversas simultâneas")
+    parser.add_argument("--llm-latencia-ms", type=float, default=50, help="até o primeiro token")
+    parser.add_argument("--llm-tokens-s", type=float, default=400, help="ritmo de geração (0 = instantâneo)")
+    parser.add_argument("--zapi-latencia-ms", type=float, default=20)
+    parser.add_argument("--supabase-latencia-ms", type=float, default=15)
+    parser.add_argument("--reenvios", type=float, default=0.02, help="fração de mensagens reenviadas pela Z-API")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--p95-max-ms", type=float, default=None, help="falha (código 1) acima deste p95")
+    args = parser.parse_args()
+
+    logger._saida.setStream(open(os.devnull, "w"))
+    ollama, url = _subir_ollama(args.llm_latencia_ms, args.llm_tokens_s)
+    supabase = fake_supabase_leads()
+    supabase.latencia = args.supabase_latencia_ms / 1000
+    zapi = FakeZapi(latencia=args.zapi_latencia_ms / 1000)
+    leads = [f"55419{n:08d}" for n in range(args.conversas)]
+    # Metade dos leads já comprou um pacote (agendamento segue até a reserva)
+    supabase.tabelas["leads"] = [
+        {"numero": numero, "nome": "Lead", "produto_escolhido": "pacote_completo" if n % 2 else ""}
+        for n, numero in enumerate(leads)
+    ]
+    datas = _datas_de_atendimento()
+
+    limpar_metricas()
+    rss_inicial = _rss_mb()
+    try:
+        with AmbienteLocal(url, zapi, supabase):
+            latencias, falhas, duracao = asyncio.run(_rodar(args, datas, leads))
+    finally:
+        ollama.terminate()
+        ollama.wait()
+    logger.descarregar_logs()
+
+    q = statistics.quantiles(latencias, n=100)
+    print(
+        f"Conversas: {args.conversas} ({args.concorrencia} simultâneas), {len(latencias)} mensagens, "
+        f"LLM {args.llm_latencia_ms:.0f} ms + {args.llm_tokens_s:.0f} tokens/s, "
+        f"Z-API {args.zapi_latencia_ms:.0f} ms, Supabase {args.supabase_latencia_ms:.0f} ms"
+    )
+    print(f"latência do webhook: p50 {q[49] * 1000:.1f} ms | p95 {q[94] * 1000:.1f} ms | p99 {q[98] * 1000:.1f} ms | máx {max(latencias) * 1000:.1f} ms")
+    print(f"vazão: {len(latencias) / duracao:.0f} mensagens/s ({duracao:.2f}s)")
+    print(f"falhas: {len(falhas)} | mensagens entregues na Z-API falsa: {len(zapi.mensagens)}")
+    print(f"RSS: {rss_inicial:.0f} MB no início, {_rss_mb():.0f} MB no fim, pico {_pico_rss_mb():.0f} MB")
+    velocidades = [s for s in LLM_TOKENS_S.series.values()]
+    geracoes = sum(sum(s[:-1]) for s in velocidades)
+    if geracoes:
+        print(f"LLM: {geracoes} gerações, {sum(s[-1] for s in velocidades) / geracoes:.0f} tokens/s em média")
+    print("\nEtapas (utils/metrics):")
+    print("\n".join(_etapas()))
+
+    if args.p95_max_ms is not None and q[94] * 1000 > args.p95_max_ms:
+        print(f"\n❌ p95 {q[94] * 1000:.1f} ms acima do limite de {args.p95_max_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
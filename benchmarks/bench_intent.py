@@ -0,0 +1,53 @@
+# benchmarks/bench_intent.py
+"""
+Custo por mensagem da detecção de intenção: laço legado (uma regex por keyword)
+vs. regex única pré-compilada de services/intent.
+
+Uso: python -m benchmarks.bench_intent
+"""
+
+import re
+import timeit
+
+from benchmarks.corpus import MENSAGENS
+from services.intent import INTENT_KEYWORDS, detectar_intencao, detectar_intencoes
+
+
+def detectar_intencao_legado(mensagem: str) -> str:
+    # Implementação anterior, mantida apenas para comparação
+    texto = mensagem.lower()
+    for intent, keywords in INTENT_KEYWORDS.items():
+        for kw in keywords:
+            if re.search(r"\b" + re.escape(kw) + r"\b", texto):
+                return intent
+    return "nenhuma"
+
+
+def medir(funcao, repeticoes: int = 200) -> float:
+    """
+    Retorna o custo médio por mensagem em microssegundos.
+    """
+    total = min(timeit.repeat(lambda: [funcao(m) for m in MENSAGENS], number=repeticoes, repeat=5))
+    return total / (repeticoes * len(MENSAGENS)) * 1e6
+
+
+def main():
+    print(f"Corpus: {len(MENSAGENS)} mensagens, {sum(len(v) for v in INTENT_KEYWORDS.values())} keywords")
+    legado = medir(detectar_intencao_legado)
+    compilado = medir(detectar_intencao)
+    pontuado = medir(detectar_intencoes)
+    print(f"legado (regex por keyword):   {legado:8.2f} µs/mensagem")
+    print(f"compilado (detectar_intencao): {compilado:8.2f} µs/mensagem  ({legado / compilado:.1f}x)")
+    print(f"compilado (scores completos):  {pontuado:8.2f} µs/mensagem")
+
+    divergentes = [
+        (m, detectar_intencao_legado(m), detectar_intencao(m))
+        for m in MENSAGENS if detectar_intencao_legado(m) != detectar_intencao(m)
+    ]
+    print(f"\nMensagens com intenção diferente do legado: {len(divergentes)}")
+    for mensagem, antes, depois in divergentes:
+        print(f"  {antes:>9} → {depois:<9} {mensagem}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# benchmarks/bench_payload_zapi.py
+"""
+Leitura do webhook da Z-API nos callbacks gravados (tests/fixtures/zapi_callbacks.jsonl):
+o caminho antigo (corpo decodificado duas vezes, como Body(dict) + request.json(),
+e .get encadeados) contra o evento tipado lido uma vez dos bytes crus.
+Mostra também quantos callbacks são descartados antes de Redis/LLM.
+
+Uso: python -m benchmarks.bench_payload_zapi [repeticoes]
+"""
+
+import json
+import os
+import sys
+import timeit
+from collections import Counter
+
+from models.input import parse_evento_zapi
+
+CALLBACKS = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures", "zapi_callbacks.jsonl")
+
+
+def _caminho_antigo(corpo: bytes):
+    json.loads(corpo)  # body: dict = Body(...)
+    payload = json.loads(corpo)  # await request.json()
+    numero = None
+    texto = None
+    msgs = payload.get("messages")
+    if isinstance(msgs, list) and len(msgs) > 0:
+        msg = msgs[0]
+        numero = msg.get("from")
+        texto = msg.get("text", {}).get("body")
+    if not numero or not texto:
+        numero = payload.get("phone") or numero
+        texto = payload.get("text", {}).get("message") or texto
+    return numero, texto
+
+
+def _caminho_tipado(corpo: bytes):
+    evento = parse_evento_zapi(corpo)
+    return evento.descarte() or evento.entrada()
+
+
+def medir(funcao, corpos: list[bytes], repeticoes: int) -> float:
+    """
+    Custo médio por callback em microssegundos.
+    """
+    def rodar():
+        for corpo in corpos:
+            funcao(corpo)
+
+    total = min(timeit.repeat(rodar, number=repeticoes, repeat=5))
+    return total / (repeticoes * len(corpos)) * 1e6
+
+
+def main():
+    repeticoes = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with open(CALLBACKS, encoding="utf-8") as f:
+        corpos = [json.dumps(json.loads(linha)["payload"]).encode() for linha in f]
+
+    descartes = Counter(parse_evento_zapi(c).descarte() or "atendida" for c in corpos)
+    antigo_aceitos = sum(1 for c in corpos if all(_caminho_antigo(c)))
+    print(f"Callbacks gravados: {len(corpos)} ({sum(len(c) for c in corpos) // len(corpos)} bytes em média)")
+    print(f"caminho antigo seguiria com {antigo_aceitos} (inclui mensagens próprias e de grupo; perde legendas de mídia)")
+    print("tipado: " + ", ".join(f"{motivo}={n}" for motivo, n in descartes.most_common()))
+
+    antigo = medir(_caminho_antigo, corpos, repeticoes)
+    tipado = medir(_caminho_tipado, corpos, repeticoes)
+    print(f"caminho antigo: {antigo:.2f} µs/callback")
+    print(f"evento tipado:  {tipado:.2f} µs/callback ({antigo / tipado:.1f}x)")
+
+    print("\nPor tipo de callback (tipado):")
+    por_tipo: dict[str, list[bytes]] = {}
+    for corpo in corpos:
+        por_tipo.setdefault(type(parse_evento_zapi(corpo)).__name__, []).append(corpo)
+    for tipo, grupo in sorted(por_tipo.items()):
+        print(f"  {tipo:<20} {medir(_caminho_tipado, grupo, repeticoes):.2f} µs")
+
+
+if __name__ == "__main__":
+    main()
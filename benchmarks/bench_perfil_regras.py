@@ -0,0 +1,71 @@
+# benchmarks/bench_perfil_regras.py
+"""
+Caminho rápido do perfil: quantas chamadas ao LLM as regras evitam na amostra
+rotulada, se os perfis resolvidos sem LLM acertam as flags, e o custo por mensagem.
+
+Uso: python -m benchmarks.bench_perfil_regras [confianca_minima]
+"""
+
+import sys
+import timeit
+
+from benchmarks.perfil_rotulado import AMOSTRA
+from services.perfil_regras import (
+    PERFIL_REGRAS_CONFIANCA_MIN,
+    _extrair,
+    extrair_perfil_por_regras,
+    perfil_suficiente,
+)
+
+
+def avaliar(minimo: float) -> dict:
+    resolvidas, acertos, erros = 0, 0, []
+    for mensagem, esperado in AMOSTRA:
+        perfil = extrair_perfil_por_regras(mensagem)
+        if not perfil_suficiente(perfil, minimo):
+            continue
+        resolvidas += 1
+        if set(perfil["flags"]) == esperado:
+            acertos += 1
+        else:
+            erros.append((mensagem, sorted(esperado), sorted(perfil["flags"]), perfil["confianca"]))
+    return {"resolvidas": resolvidas, "acertos": acertos, "erros": erros}
+
+
+def medir(repeticoes: int = 200) -> float:
+    """
+    Custo médio por mensagem em microssegundos (sem o cache do extrator).
+    """
+    def rodar():
+        _extrair.cache_clear()
+        for mensagem, _ in AMOSTRA:
+            extrair_perfil_por_regras(mensagem)
+
+    total = min(timeit.repeat(rodar, number=repeticoes, repeat=5))
+    return total / (repeticoes * len(AMOSTRA)) * 1e6
+
+
+def main():
+    minimo = float(sys.argv[1]) if len(sys.argv) > 1 else PERFIL_REGRAS_CONFIANCA_MIN
+    com_flag = sum(1 for _, esperado in AMOSTRA if esperado)
+    print(f"Amostra: {len(AMOSTRA)} mensagens ({com_flag} com alguma flag), confiança mínima {minimo}")
+
+    r = avaliar(minimo)
+    print(f"chamadas ao LLM evitadas: {r['resolvidas']}/{len(AMOSTRA)} ({r['resolvidas'] / len(AMOSTRA):.0%})")
+    if r["resolvidas"]:
+        print(f"flags corretas nas resolvidas: {r['acertos']}/{r['resolvidas']} ({r['acertos'] / r['resolvidas']:.0%})")
+    print(f"custo das regras: {medir():.1f} µs/mensagem")
+
+    print("\nPor confiança mínima:")
+    for limiar in (0.6, 0.7, 0.75, 0.8, 0.9):
+        s = avaliar(limiar)
+        print(f"  {limiar:.2f}: evitadas {s['resolvidas']:2d}, erradas {len(s['erros'])}")
+
+    if r["erros"]:
+        print("\nResolvidas com flags erradas:")
+        for mensagem, esperado, obtido, confianca in r["erros"]:
+            print(f"  {confianca:.2f} esperado={esperado} obtido={obtido}  {mensagem}")
+
+
+if __name__ == "__main__":
+    main()
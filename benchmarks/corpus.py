@@ -0,0 +1,47 @@
+# benchmarks/corpus.py
+"""
+Mensagens realistas de pacientes no WhatsApp, usadas pelos benchmarks.
+"""
+
+MENSAGENS = [
+    "Oi, boa tarde!",
+    "oi",
+    "tudo bem?",
+    "Quero agendar uma consulta",
+    "quero marcar",
+    "Vocês têm horário para sexta-feira?",
+    "tem horario amanha de manha?",
+    "Quanto custa a consulta?",
+    "qual o valor da consulta online?",
+    "Queria saber o preço do pacote gestacional",
+    "Preciso cancelar minha consulta de terça",
+    "nao posso ir amanha, consigo desmarcar?",
+    "Estou grávida de 20 semanas e queria acompanhamento",
+    "Meu marido fez um espermograma e o resultado veio ruim",
+    "Estamos tentando engravidar há mais de um ano",
+    "Estou na menopausa e sinto muito calor à noite",
+    "Minha filha tem 8 anos, vocês atendem criança?",
+    "Pronto, respondi o formulário",
+    "já preenchi",
+    "Obrigada! 🙏",
+    "Qual o endereço da clínica?",
+    "Vocês atendem por convênio?",
+    "A consulta é presencial ou online?",
+    "Como funciona o pacote de 3 consultas?",
+    "Posso pagar no pix?",
+    "2025-07-01 09:00",
+    "Pode ser dia 2025-07-04 às 14:00?",
+    "Bom dia, gostaria de informações sobre o acompanhamento nutricional na gestação",
+    "Boa noite, vi o anúncio no instagram e fiquei interessada",
+    "Qual o horário de atendimento de vocês?",
+    "quanto fica o orçamento completo?",
+    "quero remarcar para outra data",
+    "Tenho SOP e estou tentando engravidar, vocês podem me ajudar?",
+    "Fiz FIV e não deu certo, estou muito triste",
+    "É urgente, preciso de uma consulta essa semana",
+    "vcs tem disponibilidade segunda?",
+    "ok",
+    "entendi, vou pensar",
+    "Tem desconto pra pagamento à vista?",
+    "Gostaria de desistir do pacote e pedir cancelamento",
+]
@@ -0,0 +1,48 @@
+# benchmarks/perfil_rotulado.py
+"""
+Amostra rotulada à mão para o terminal de perfil: mensagem → flags esperadas
+(as mesmas consumidas por services/choose_product.escolher_produto).
+"""
+
+AMOSTRA = [
+    ("Estou grávida de 20 semanas e queria fazer o pré-natal com vocês", {"is_gest"}),
+    ("oi! descobri que to grávida, como funciona?", {"is_gest"}),
+    ("Sou gestante de 12 semanas, preciso de acompanhamento", {"is_gest"}),
+    ("estamos esperando um bebê e queremos um acompanhamento especial", {"is_gest"}),
+    ("Quero agendar o pré natal o quanto antes", {"is_gest"}),
+    ("Estou tentando engravidar há 2 anos", {"is_ttc"}),
+    ("a gente não consegue engravidar, o que fazer?", {"is_ttc"}),
+    ("sou tentante e queria uma orientação", {"is_ttc"}),
+    ("Temos dificuldade para engravidar, já fizemos vários exames", {"is_ttc"}),
+    ("Queremos engravidar no ano que vem, sem pressa", {"is_ttc"}),
+    ("Meu espermograma deu ruim, e agora?", {"bad_sperm"}),
+    ("espermograma alterado do meu marido, precisamos de ajuda", {"bad_sperm"}),
+    ("o médico disse que é oligospermia", {"bad_sperm"}),
+    ("baixa contagem de espermatozoides no exame", {"bad_sperm"}),
+    ("Meu marido tem azoospermia, tem tratamento?", {"bad_sperm"}),
+    ("Minha filha de 8 anos precisa de avaliação", {"is_child8"}),
+    ("meu filho tem 8 anos e está com dificuldades", {"is_child8"}),
+    ("Consulta para criança com 8 anos, vocês atendem?", {"is_child8"}),
+    ("Estou na menopausa e com muitos fogachos", {"menopausa"}),
+    ("climatério está acabando comigo, ondas de calor o dia todo", {"menopausa"}),
+    ("Entrei na menopausa, quero saber de reposição hormonal", {"menopausa"}),
+    ("Não estou grávida, mas queria um check-up", set()),
+    ("oi, tudo bem?", set()),
+    ("Qual o valor da consulta?", set()),
+    ("vocês atendem sábado?", set()),
+    ("quero marcar uma consulta", set()),
+    ("Bom dia, vi o anúncio no instagram", set()),
+    ("qual o endereço da clínica?", set()),
+    ("Minha esposa está grávida e eu fiz espermograma antes, tudo normal", {"is_gest"}),
+    ("Consegui engravidar! Estou grávida de 6 semanas", {"is_gest"}),
+    ("tenho 45 anos, parei de menstruar e tenho ondas de calor", {"menopausa"}),
+    ("Faz 8 anos que tento engravidar", {"is_ttc"}),
+    ("nunca pensei em engravidar, só quero um acompanhamento", set()),
+    ("preciso de um pediatra pro meu filho", {"is_child8"}),
+    ("FIV ou inseminação, qual vocês recomendam?", {"is_ttc"}),
+    ("estou com sangramento na gravidez, é urgente", {"is_gest"}),
+    ("só pesquisando valores por enquanto", set()),
+    ("tô grávida de gêmeos!!", {"is_gest"}),
+    ("Meu exame de espermograma chegou, podem avaliar?", set()),
+    ("queria entender os planos de vocês", set()),
+]
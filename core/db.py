@@ -0,0 +1,93 @@
+# core/db.py
+
+import asyncio
+import os
+from typing import Optional
+
+import httpx
+from supabase import AsyncClient, AsyncClientOptions, acreate_client
+
+# ————— Configuração Supabase —————
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+# ————— Pool HTTP do PostgREST —————
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))            # segundos por requisição
+SUPABASE_TIMEOUT_CONEXAO = float(os.getenv("SUPABASE_TIMEOUT_CONEXAO", "3"))
+SUPABASE_MAX_CONEXOES = int(os.getenv("SUPABASE_MAX_CONEXOES", "20"))
+
+_cliente: Optional[AsyncClient] = None
+_cliente_loop: Optional[asyncio.AbstractEventLoop] = None
+_http: Optional[httpx.AsyncClient] = None
+_travas: dict[asyncio.AbstractEventLoop, asyncio.Lock] = {}
+# Cliente fixo (ex.: Supabase em memória nos testes); ignora o pool
+_cliente_fixo = None
+
+
+def usar_cliente_supabase(cliente):
+    """
+    Define um cliente alternativo (ex.: Supabase falso nos testes).
+    None volta ao cliente real, recriado na próxima consulta.
+    """
+    global _cliente_fixo, _cliente, _cliente_loop, _http
+    _cliente_fixo = cliente
+    _cliente = None
+    _cliente_loop = None
+    _http = None
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(SUPABASE_TIMEOUT, connect=SUPABASE_TIMEOUT_CONEXAO)
+
+
+async def get_supabase() -> AsyncClient:
+    """
+    Retorna o cliente Supabase assíncrono compartilhado do loop atual
+    (um pool keep-alive para todas as consultas do processo).
+    """
+    global _cliente, _cliente_loop, _http
+    if _cliente_fixo is not None:
+        return _cliente_fixo
+    loop = asyncio.get_running_loop()
+    if _cliente is not None and _cliente_loop is loop:
+        return _cliente
+
+    trava = _travas.setdefault(loop, asyncio.Lock())
+    async with trava:
+        if _cliente is not None and _cliente_loop is loop:
+            return _cliente
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            raise EnvironmentError(
+                f"[ERRO] Variáveis de ambiente inválidas: SUPABASE_URL={SUPABASE_URL}, SUPABASE_KEY={'set' if SUPABASE_KEY else 'missing'}"
+            )
+        _http = httpx.AsyncClient(
+            http2=True,
+            timeout=_timeout(),
+            limits=httpx.Limits(
+                max_connections=SUPABASE_MAX_CONEXOES,
+                max_keepalive_connections=SUPABASE_MAX_CONEXOES,
+            ),
+        )
+        _cliente = await acreate_client(
+            SUPABASE_URL,
+            SUPABASE_KEY,
+            options=AsyncClientOptions(httpx_client=_http, postgrest_client_timeout=_timeout()),
+        )
+        _cliente_loop = loop
+    for outro in list(_travas):
+        if outro is not loop:
+            del _travas[outro]  # travas de loops antigos (ex.: asyncio.run nos testes)
+    return _cliente
+
+
+async def fechar_supabase():
+    """
+    Fecha o pool HTTP do Supabase (shutdown do app).
+    """
+    global _cliente, _cliente_loop, _http
+    http = _http
+    _cliente = None
+    _cliente_loop = None
+    _http = None
+    if http is not None and not http.is_closed:
+        await http.aclose()
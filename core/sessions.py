@@ -2,53 +2,147 @@
 
 import os
 import json
-import redis
-from datetime import datetime, timedelta
+import redis.asyncio as aioredis
+from datetime import datetime
+from typing import Optional
+
+from utils.metrics import cronometrar
 
 # Configuração do Redis usando URL completa
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")  # fallback para dev local
-redis_client = redis.from_url(REDIS_URL, decode_responses=True)
+redis_client = aioredis.from_url(REDIS_URL, decode_responses=True)
 
 SESSION_TTL = 60 * 60  # Tempo de expiração: 1 hora
+SESSION_MAX_HISTORY = int(os.getenv("SESSION_MAX_HISTORY", "200"))  # mensagens mantidas por sessão
+
+# Estrutura no Redis:
+#   session:{phone}:meta     → hash com os metadados (valores em JSON)
+#   session:{phone}:history  → lista com as mensagens (cada item em JSON)
+#   session:{phone}          → formato antigo (JSON inteiro), migrado no load_session
+
 
 def get_session_key(phone_number: str) -> str:
     """
-    Retorna a chave única de sessão para cada lead baseado no telefone.
+    Retorna a chave única de sessão (hash de metadados) para cada lead baseado no telefone.
+    """
+    return f"session:{phone_number}:meta"
+
+
+def get_history_key(phone_number: str) -> str:
+    """
+    Retorna a chave da lista de mensagens da sessão.
     """
+    return f"session:{phone_number}:history"
+
+
+def get_legacy_key(phone_number: str) -> str:
     return f"session:{phone_number}"
 
-async def load_session(phone_number: str) -> dict:
+
+async def _migrar_sessao_legada(phone_number: str, antiga: str):
     """
-    Carrega a sessão do Redis. Se não existir, retorna um dicionário vazio.
+    Converte uma sessão no formato antigo (JSON inteiro em uma string) para hash + lista.
     """
+    session = json.loads(antiga)
+    history = session.pop("history", [])
     key = get_session_key(phone_number)
-    session_data = redis_client.get(key)
-    if session_data:
-        return json.loads(session_data)
-    return {"history": [], "created_at": datetime.utcnow().isoformat()}
+    history_key = get_history_key(phone_number)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        if session:
+            pipe.hset(key, mapping={k: json.dumps(v) for k, v in session.items()})
+        if history:
+            pipe.lpush(history_key, *(json.dumps(m) for m in reversed(history[-SESSION_MAX_HISTORY:])))
+            pipe.ltrim(history_key, -SESSION_MAX_HISTORY, -1)
+        pipe.expire(key, SESSION_TTL)
+        pipe.expire(history_key, SESSION_TTL)
+        await pipe.execute()
+
+
+@cronometrar("redis")
+async def load_session(phone_number: str, history_limit: Optional[int] = None) -> dict:
+    """
+    Carrega a sessão do Redis (metadados + histórico) em uma única ida ao servidor.
+    - history_limit=None → histórico completo
+    - history_limit=N    → só as últimas N mensagens (0 = nenhuma)
+    Se não existir, retorna uma sessão vazia.
+    """
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hgetall(get_session_key(phone_number))
+        if history_limit == 0:
+            pipe.exists(get_history_key(phone_number))
+        else:
+            pipe.lrange(get_history_key(phone_number), -history_limit if history_limit else 0, -1)
+        pipe.getdel(get_legacy_key(phone_number))  # só um leitor recebe a sessão antiga para migrar
+        meta, history, antiga = await pipe.execute()
 
+    if antiga:
+        await _migrar_sessao_legada(phone_number, antiga)
+        return await load_session(phone_number, history_limit)
+
+    if not meta and not history:
+        return {"history": [], "created_at": datetime.utcnow().isoformat()}
+    session = {k: json.loads(v) for k, v in meta.items()}
+    session["history"] = [json.loads(m) for m in history] if history_limit != 0 else []
+    return session
+
+
+@cronometrar("redis")
+async def get_history(phone_number: str, limit: Optional[int] = None) -> list:
+    """
+    Retorna só o histórico (ou as últimas `limit` mensagens), sem os metadados.
+    """
+    inicio = -limit if limit else 0
+    history = await redis_client.lrange(get_history_key(phone_number), inicio, -1)
+    return [json.loads(m) for m in history]
+
+
+@cronometrar("redis")
 async def save_session(phone_number: str, session: dict):
     """
-    Salva/atualiza a sessão no Redis com TTL.
+    Salva/atualiza os metadados da sessão no Redis com TTL.
+    - Os campos informados são mesclados no hash (campos ausentes não são apagados)
+    - O histórico NÃO é regravado: mensagens entram apenas via append_message
     """
     key = get_session_key(phone_number)
-    redis_client.setex(key, SESSION_TTL, json.dumps(session))
+    campos = {k: json.dumps(v) for k, v in session.items() if k != "history"}
 
+    async with redis_client.pipeline(transaction=True) as pipe:
+        if campos:
+            pipe.hset(key, mapping=campos)
+        pipe.expire(key, SESSION_TTL)
+        pipe.expire(get_history_key(phone_number), SESSION_TTL)
+        await pipe.execute()
+
+
+@cronometrar("redis")
 async def append_message(phone_number: str, role: str, content: str):
     """
-    Adiciona uma mensagem ao histórico da sessão.
+    Adiciona uma mensagem ao histórico da sessão de forma atômica
+    (RPUSH + LTRIM + EXPIRE em um único MULTI), sem reler a sessão.
     """
-    session = await load_session(phone_number)
-    session["history"].append({
+    key = get_session_key(phone_number)
+    history_key = get_history_key(phone_number)
+    agora = datetime.utcnow().isoformat()
+    mensagem = json.dumps({
         "role": role,          # "user" ou "assistant"
         "content": content,
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": agora
     })
-    await save_session(phone_number, session)
 
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.rpush(history_key, mensagem)
+        pipe.ltrim(history_key, -SESSION_MAX_HISTORY, -1)
+        pipe.hsetnx(key, "created_at", json.dumps(agora))
+        pipe.expire(history_key, SESSION_TTL)
+        pipe.expire(key, SESSION_TTL)
+        await pipe.execute()
+
+
+@cronometrar("redis")
 async def clear_session(phone_number: str):
     """
     Remove a sessão do Redis (ex.: após lead finalizado).
     """
-    key = get_session_key(phone_number)
-    redis_client.delete(key)
+    await redis_client.delete(
+        get_session_key(phone_number), get_history_key(phone_number), get_legacy_key(phone_number)
+    )
@@ -0,0 +1,536 @@
+# core/write_behind.py
+
+import asyncio
+import copy
+import fcntl
+import glob
+import json
+import os
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+from core.db import get_supabase
+from utils.logger import log_event
+from utils.metrics import medir
+
+# ————— Configuração —————
+# Janela de acúmulo: escritas ficam no buffer por até X ms e saem em lote. 0 desliga
+# (cada update_lead vai direto ao Supabase, como antes).
+WRITE_BEHIND_JANELA = float(os.getenv("WRITE_BEHIND_JANELA_MS", "0")) / 1000
+# Descarrega antes da janela se o buffer passar deste número de linhas pendentes
+WRITE_BEHIND_MAX_PENDENTES = int(os.getenv("WRITE_BEHIND_MAX_PENDENTES", "500"))
+# Journal local: toda escrita aceita é registrada antes de ir ao Supabase.
+# Cada processo (worker) grava no seu: write_behind.jsonl → write_behind.<pid>.jsonl
+WRITE_BEHIND_JOURNAL = os.getenv("WRITE_BEHIND_JOURNAL", "write_behind.jsonl")
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "1") == "1"
+
+# Formato do journal (uma operação por linha):
+#   {"op": "inserir",   "tabela": ..., "coluna": ..., "dados": {...}}
+#   {"op": "atualizar", "tabela": ..., "coluna": ..., "chave": ..., "dados": {...}}
+#   {"op": "registrar", "tabela": ..., "dados": {...}}
+# Após cada descarga o journal é reescrito só com o que continua pendente.
+# O processo mantém flock no seu journal: um journal sem trava é de um processo
+# que caiu e é reaplicado (e apagado) pelo próximo que iniciar.
+
+# tabela → callbacks chamados com cada linha confirmada pelo Supabase
+_ouvintes: dict[str, list[Callable[[dict], None]]] = {}
+
+
+def ao_gravar(tabela: str, callback: Callable[[dict], None]):
+    """
+    Registra um callback para as linhas gravadas em `tabela` (ex.: atualizar cache).
+    """
+    _ouvintes.setdefault(tabela, []).append(callback)
+
+
+def _falha_permanente(e: Exception) -> bool:
+    """
+    Erros de dados/esquema (PGRST*, classes SQLSTATE 22, 23 e 42) não se resolvem
+    com nova tentativa; rede, timeout e 5xx sim.
+    """
+    codigo = str(getattr(e, "code", None) or str(e).split(":")[0]).strip()
+    return codigo.startswith(("PGRST", "22", "23", "42"))
+
+
+def journal_do_processo(journal: str, pid: Optional[int] = None) -> str:
+    """
+    write_behind.jsonl → write_behind.<pid>.jsonl
+    """
+    raiz, extensao = os.path.splitext(journal)
+    return f"{raiz}.{pid or os.getpid()}{extensao}"
+
+
+def _journals(journal: str) -> list[str]:
+    """
+    Journals de todos os processos, do mais antigo para o mais recente
+    (inclui o journal único de versões anteriores, sem o PID no nome).
+    """
+    raiz, extensao = os.path.splitext(journal)
+    caminhos = [
+        c for c in glob.glob(f"{glob.escape(raiz)}.*{glob.escape(extensao)}")
+        if c[len(raiz) + 1:len(c) - len(extensao)].isdigit()
+    ]
+    if os.path.exists(journal):
+        caminhos.append(journal)
+    return sorted(caminhos, key=lambda c: os.stat(c).st_mtime if os.path.exists(c) else 0)
+
+
+def _travar_orfao(caminho: str):
+    """
+    Abre e trava o journal de outro processo. Retorna None se o dono ainda está
+    vivo (trava ocupada) ou se outro processo já o reaplicou e apagou.
+    """
+    try:
+        arquivo = open(caminho, "r+", encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    try:
+        fcntl.flock(arquivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if os.fstat(arquivo.fileno()).st_ino != os.stat(caminho).st_ino:
+            raise FileNotFoundError(caminho)  # apagado e recriado enquanto esperávamos a trava
+    except (BlockingIOError, FileNotFoundError):
+        arquivo.close()
+        return None
+    return arquivo
+
+
+class _Journal:
+    """
+    Journal deste processo, gravado por uma thread própria: o event loop só
+    enfileira linhas já serializadas; a thread grava tudo o que acumulou desde a
+    última passada e faz um único fsync para o lote (group commit).
+    """
+
+    def __init__(self, caminho: str, fsync: bool, arquivo=None):
+        self.caminho = caminho
+        self.fsync = fsync
+        self._arquivo = arquivo or open(caminho, "a", encoding="utf-8")
+        if arquivo is None:
+            try:
+                fcntl.flock(self._arquivo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._arquivo.close()
+                raise RuntimeError(f"[ERRO] Journal {caminho} em uso por outro buffer de escrita")
+        self._fila: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._gravar, name="write-behind-journal", daemon=True)
+        self._thread.start()
+
+    def acrescentar(self, linhas: list[str]):
+        self._fila.put(("acrescentar", linhas))
+
+    def reescrever(self, linhas: list[str]):
+        self._fila.put(("reescrever", linhas))
+
+    def sincronizar(self):
+        """
+        Bloqueia até tudo o que foi enfileirado estar no disco.
+        """
+        gravado = threading.Event()
+        self._fila.put(("sincronizar", gravado))
+        gravado.wait()
+
+    def fechar(self, remover: bool = False):
+        """
+        Grava o que falta e fecha (solta a trava). Com `remover`, apaga o arquivo antes.
+        """
+        self._fila.put(("fechar", remover))
+        self._thread.join()
+
+    def _gravar(self):
+        while True:
+            lote = [self._fila.get()]
+            while not self._fila.empty():
+                lote.append(self._fila.get_nowait())
+            # Só a última reescrita do lote importa, mais o que foi acrescentado depois dela
+            ultima = max((i for i, (tipo, _) in enumerate(lote) if tipo == "reescrever"), default=-1)
+            try:
+                if ultima >= 0:
+                    self._arquivo.seek(0)
+                    self._arquivo.truncate()
+                for tipo, linhas in lote[max(ultima, 0):]:
+                    if tipo in ("acrescentar", "reescrever"):
+                        self._arquivo.writelines(linhas)
+                self._arquivo.flush()
+                if self.fsync:
+                    os.fsync(self._arquivo.fileno())
+            except OSError as e:
+                log_event("❌ Falha ao gravar o journal", {"journal": self.caminho, "error": str(e)})
+            fechar = False
+            for tipo, valor in lote:
+                if tipo == "sincronizar":
+                    valor.set()
+                elif tipo == "fechar":
+                    fechar = True
+                    if valor:
+                        os.remove(self.caminho)  # ainda com a trava: ninguém o reaplica no meio
+            if fechar:
+                self._arquivo.close()
+                return
+
+
+def _linhas(ops: list[dict]) -> list[str]:
+    return [json.dumps(op, ensure_ascii=False, default=str) + "\n" for op in ops]
+
+
+@dataclass
+class Pendente:
+    coluna: str
+    nova: Optional[dict] = None                       # linha ainda não inserida
+    campos: dict = field(default_factory=dict)        # alterações coalescidas (valem também
+                                                      # se a linha já existia)
+
+
+class BufferEscrita:
+    """
+    Buffer write-behind para o Supabase:
+    - várias alterações da mesma linha viram um único PATCH (último valor vence)
+    - linhas novas da mesma tabela saem em um único upsert em lote que ignora
+      as que já existem (nunca sobrescreve uma linha gravada por outro caminho);
+      alterações feitas em torno da inserção entram na própria linha, ou viram
+      PATCH se a linha já existia
+    - eventos (só inserção) saem em um único insert em lote por tabela
+    - cada operação vai para o journal do processo (gravado numa thread, com um
+      fsync por lote: o event loop não espera o disco); no início os journals
+      de processos que caíram são reaplicados, então nada se perde se o processo
+      cair antes da descarga, fora os últimos milissegundos ainda na fila da
+      thread (entrega pelo menos uma vez: upsert/PATCH repetidos são inofensivos)
+    - falhas transitórias voltam para o buffer e são tentadas na próxima descarga;
+      erros de dados/esquema são registrados e descartados
+    """
+
+    def __init__(
+        self,
+        janela: float = WRITE_BEHIND_JANELA,
+        max_pendentes: int = WRITE_BEHIND_MAX_PENDENTES,
+        journal: Optional[str] = WRITE_BEHIND_JOURNAL,
+        fsync: bool = WRITE_BEHIND_FSYNC,
+    ):
+        self.janela = janela
+        self.max_pendentes = max_pendentes
+        self.journal = journal_do_processo(journal) if journal else None
+        self._journal_base = journal
+        self.fsync = fsync
+        self._journal: Optional[_Journal] = None
+        self._pendentes: dict[tuple[str, str], Pendente] = {}
+        self._eventos: dict[str, list[dict]] = {}
+        self._upsert_indisponivel: set[str] = set()
+        self._trava: Optional[asyncio.Lock] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self._tarefas: set[asyncio.Task] = set()
+        self.metricas = {"operacoes": 0, "requisicoes": 0, "descargas": 0, "falhas": 0}
+
+    # ——— escrita no buffer ———
+    def inserir(self, tabela: str, coluna: str, linha: dict):
+        self._aplicar({"op": "inserir", "tabela": tabela, "coluna": coluna, "dados": linha})
+
+    def atualizar(self, tabela: str, coluna: str, chave: str, campos: dict):
+        self._aplicar({"op": "atualizar", "tabela": tabela, "coluna": coluna, "chave": chave, "dados": campos})
+
+    def registrar(self, tabela: str, linha: dict):
+        self._aplicar({"op": "registrar", "tabela": tabela, "dados": linha})
+
+    def _aplicar(self, op: dict):
+        if self.journal:
+            self._abrir_journal().acrescentar(_linhas([op]))
+        self._mesclar(op)
+        self.metricas["operacoes"] += 1
+        if self.quantidade() >= self.max_pendentes and not self._tarefas:
+            self._descarregar_em_segundo_plano()
+
+    def _mesclar(self, op: dict):
+        dados = copy.deepcopy(op["dados"])
+        if op["op"] == "registrar":
+            self._eventos.setdefault(op["tabela"], []).append(dados)
+            return
+        chave = op["chave"] if op["op"] == "atualizar" else str(dados[op["coluna"]])
+        pendente = self._pendentes.setdefault((op["tabela"], chave), Pendente(coluna=op["coluna"]))
+        if op["op"] == "inserir":
+            pendente.nova = dados if pendente.nova is None else {**pendente.nova, **dados}
+        else:
+            pendente.campos.update(dados)
+
+    def pendente(self, tabela: str, chave: str) -> Optional[Pendente]:
+        """
+        O que ainda não foi gravado para a linha (para leituras verem as próprias escritas).
+        """
+        return self._pendentes.get((tabela, chave))
+
+    def quantidade(self) -> int:
+        return len(self._pendentes) + sum(len(e) for e in self._eventos.values())
+
+    # ——— journal ———
+    def _abrir_journal(self, arquivo=None) -> _Journal:
+        if self._journal is None:
+            self._journal = _Journal(self.journal, self.fsync, arquivo)
+        return self._journal
+
+    async def sincronizar_journal(self):
+        """
+        Espera o journal chegar ao disco (o que foi aceito até aqui).
+        """
+        if self._journal is not None:
+            await asyncio.to_thread(self._journal.sincronizar)
+
+    def _ops_pendentes(self) -> list[dict]:
+        ops = []
+        for (tabela, chave), p in self._pendentes.items():
+            if p.nova is not None:
+                ops.append({"op": "inserir", "tabela": tabela, "coluna": p.coluna, "dados": p.nova})
+            if p.campos:
+                ops.append({"op": "atualizar", "tabela": tabela, "coluna": p.coluna, "chave": chave, "dados": p.campos})
+        for tabela, eventos in self._eventos.items():
+            ops.extend({"op": "registrar", "tabela": tabela, "dados": e} for e in eventos)
+        return ops
+
+    def recuperar(self) -> int:
+        """
+        Reaplica no buffer as operações dos journals órfãos (escritas não
+        confirmadas por processos que já pararam ou caíram). Retorna quantas
+        foram recuperadas. Os órfãos só são apagados depois que as operações
+        estão no journal deste processo.
+        """
+        if not self.journal:
+            return 0
+        orfaos = [(c, a) for c in _journals(self._journal_base) if (a := _travar_orfao(c)) is not None]
+        recuperadas = 0
+        for _, arquivo in orfaos:
+            for linha in arquivo:
+                try:
+                    op = json.loads(linha)
+                except json.JSONDecodeError:
+                    continue  # última linha truncada por uma queda no meio da escrita
+                self._mesclar(op)
+                recuperadas += 1
+        # Journal de um processo antigo com o mesmo PID: vira o deste, já travado
+        herdado = next((a for c, a in orfaos if c == self.journal), None)
+        journal = self._abrir_journal(herdado)
+        journal.reescrever(_linhas(self._ops_pendentes()))
+        journal.sincronizar()
+        for caminho, arquivo in orfaos:
+            if arquivo is not herdado:
+                os.remove(caminho)
+                arquivo.close()
+        if recuperadas:
+            log_event("📒 Escritas recuperadas do journal", {"operacoes": recuperadas, "journals": len(orfaos)})
+        return recuperadas
+
+    # ——— descarga ———
+    def _get_trava(self) -> asyncio.Lock:
+        if self._trava is None:
+            self._trava = asyncio.Lock()
+        return self._trava
+
+    def _descarregar_em_segundo_plano(self):
+        task = asyncio.create_task(self.descarregar())
+        self._tarefas.add(task)
+        task.add_done_callback(self._tarefas.discard)
+
+    async def descarregar(self) -> int:
+        """
+        Envia tudo o que está pendente. Retorna o número de requisições feitas.
+        """
+        async with self._get_trava():
+            if not self._pendentes and not self._eventos:
+                return 0
+            pendentes, self._pendentes = self._pendentes, {}
+            eventos, self._eventos = self._eventos, {}
+            requisicoes_antes = self.metricas["requisicoes"]
+
+            novas: dict[tuple[str, str], dict[str, Pendente]] = {}
+            for (tabela, chave), p in pendentes.items():
+                if p.nova is not None:
+                    novas.setdefault((tabela, p.coluna), {})[chave] = p
+            alteracoes = [
+                (tabela, chave, p) for (tabela, chave), p in pendentes.items() if p.nova is None and p.campos
+            ]
+
+            grupos_novas = list(novas.items())
+            grupos_eventos = list(eventos.items())
+            resultados = await asyncio.gather(
+                *(self._gravar_novas(tabela, coluna, linhas) for (tabela, coluna), linhas in grupos_novas),
+                *(self._gravar_alteracao(tabela, chave, p) for tabela, chave, p in alteracoes),
+                *(self._gravar_eventos(tabela, linhas) for tabela, linhas in grupos_eventos),
+            )
+            ok_novas = resultados[:len(grupos_novas)]
+            ok_alteracoes = resultados[len(grupos_novas):len(grupos_novas) + len(alteracoes)]
+            ok_eventos = resultados[len(grupos_novas) + len(alteracoes):]
+
+            # Falhas voltam para o buffer por baixo do que chegou durante a descarga
+            for ((tabela, _), grupo), ok in zip(grupos_novas, ok_novas):
+                if not ok:
+                    for chave, p in grupo.items():
+                        self._devolver(tabela, chave, p)
+            for (tabela, chave, p), ok in zip(alteracoes, ok_alteracoes):
+                if not ok:
+                    self._devolver(tabela, chave, Pendente(coluna=p.coluna, campos=p.campos))
+            for (tabela, linhas), ok in zip(grupos_eventos, ok_eventos):
+                if not ok:
+                    self._eventos[tabela] = linhas + self._eventos.get(tabela, [])
+
+            if self.journal:
+                self._abrir_journal().reescrever(_linhas(self._ops_pendentes()))
+            self.metricas["descargas"] += 1
+            return self.metricas["requisicoes"] - requisicoes_antes
+
+    def _devolver(self, tabela: str, chave: str, antigo: Pendente):
+        self.metricas["falhas"] += 1
+        atual = self._pendentes.get((tabela, chave))
+        if atual is None:
+            self._pendentes[(tabela, chave)] = antigo
+            return
+        if antigo.nova is not None:
+            atual.nova = antigo.nova if atual.nova is None else {**antigo.nova, **atual.nova}
+        atual.campos = {**antigo.campos, **atual.campos}
+
+    async def _executar(self, consulta, operacao: str):
+        self.metricas["requisicoes"] += 1
+        with medir("supabase", operacao):
+            return await consulta.execute()
+
+    def _notificar(self, tabela: str, linhas):
+        for linha in linhas or []:
+            for callback in _ouvintes.get(tabela, []):
+                callback(linha)
+
+    # Os _gravar_* retornam False só quando vale tentar de novo
+
+    async def _gravar_novas(self, tabela: str, coluna: str, pendentes: dict[str, Pendente]) -> bool:
+        cliente = await get_supabase()
+        linhas = [{**p.nova, **p.campos} for p in pendentes.values()]
+        try:
+            resposta = None
+            if tabela not in self._upsert_indisponivel:
+                try:
+                    # default_to_null=False: coluna ausente numa linha do lote fica com o default
+                    # da tabela, e não NULL só porque outra linha do lote a trouxe
+                    resposta = await self._executar(
+                        cliente.table(tabela).upsert(
+                            linhas, on_conflict=coluna, ignore_duplicates=True, default_to_null=False
+                        ),
+                        "lote_upsert",
+                    )
+                except Exception as e:
+                    # 42P10: sem restrição única na coluna → insert simples daqui em diante
+                    if "42P10" not in str(e) and "conflict" not in str(e).lower():
+                        raise
+                    self._upsert_indisponivel.add(tabela)
+            if resposta is None:
+                resposta = await self._executar(
+                    cliente.table(tabela).insert(linhas, default_to_null=False), "lote_insert"
+                )
+        except Exception as e:
+            log_event("❌ Falha ao gravar lote de inserções", {"tabela": tabela, "linhas": len(linhas), "error": str(e)})
+            return _falha_permanente(e)
+        self._notificar(tabela, resposta.data)
+        gravadas = {str(linha.get(coluna)) for linha in resposta.data or []}
+        existentes = {chave: p for chave, p in pendentes.items() if chave not in gravadas}
+        if existentes:
+            await self._completar_existentes(tabela, coluna, existentes)
+        return True
+
+    async def _completar_existentes(self, tabela: str, coluna: str, existentes: dict[str, Pendente]):
+        """
+        Linhas do lote que já existiam ficaram como estavam: aplica só as alterações
+        pendentes (PATCH) e relê as demais, para os ouvintes verem a linha real.
+        """
+        com_alteracoes = [(chave, p) for chave, p in existentes.items() if p.campos]
+        resultados = await asyncio.gather(
+            *(self._gravar_alteracao(tabela, chave, Pendente(coluna=coluna, campos=p.campos)) for chave, p in com_alteracoes)
+        )
+        for (chave, p), ok in zip(com_alteracoes, resultados):
+            if not ok:
+                self._devolver(tabela, chave, Pendente(coluna=coluna, campos=p.campos))
+        sem_alteracoes = [chave for chave, p in existentes.items() if not p.campos]
+        if not sem_alteracoes:
+            return
+        cliente = await get_supabase()
+        try:
+            resposta = await self._executar(cliente.table(tabela).select("*").in_(coluna, sem_alteracoes), "lote_select")
+        except Exception as e:
+            log_event("❌ Falha ao reler linhas existentes", {"tabela": tabela, "linhas": len(sem_alteracoes), "error": str(e)})
+            return
+        self._notificar(tabela, resposta.data)
+
+    async def _gravar_alteracao(self, tabela: str, chave: str, p: Pendente) -> bool:
+        cliente = await get_supabase()
+        try:
+            resposta = await self._executar(cliente.table(tabela).update(p.campos).eq(p.coluna, chave), "lote_update")
+        except Exception as e:
+            log_event("❌ Falha ao gravar alterações", {"tabela": tabela, "chave": chave, "error": str(e)})
+            return _falha_permanente(e)
+        if not resposta.data:
+            # Linha inexistente: tentar de novo não resolve
+            log_event("❌ Alterações descartadas: linha não encontrada", {"tabela": tabela, "chave": chave})
+        self._notificar(tabela, resposta.data)
+        return True
+
+    async def _gravar_eventos(self, tabela: str, linhas: list[dict]) -> bool:
+        cliente = await get_supabase()
+        try:
+            await self._executar(cliente.table(tabela).insert(linhas), "lote_insert")
+        except Exception as e:
+            log_event("❌ Falha ao gravar eventos", {"tabela": tabela, "linhas": len(linhas), "error": str(e)})
+            return _falha_permanente(e)
+        return True
+
+    # ——— ciclo de vida ———
+    async def _executar_periodicamente(self):
+        while True:
+            await asyncio.sleep(self.janela)
+            try:
+                await self.descarregar()
+            except Exception as e:
+                log_event("❌ Erro na descarga do buffer de escrita", {"error": str(e)})
+
+    async def iniciar(self):
+        """
+        Reaplica os journals órfãos, descarrega o que havia ficado pendente e liga o relógio.
+        """
+        if await asyncio.to_thread(self.recuperar):
+            await self.descarregar()
+        self._loop_task = asyncio.create_task(self._executar_periodicamente())
+
+    async def parar(self):
+        """
+        Para o relógio e descarrega tudo. O que falhar continua no journal
+        e é reenviado no próximo início.
+        """
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        if self._tarefas:
+            await asyncio.gather(*list(self._tarefas), return_exceptions=True)
+        await self.descarregar()
+        if self.quantidade():
+            log_event("⚠️ Escritas pendentes mantidas no journal", {"operacoes": self.quantidade(), "journal": self.journal})
+        if self._journal is not None:
+            # Sem pendências o journal é apagado; com elas fica sem trava e o próximo início o reaplica
+            await asyncio.to_thread(self._journal.fechar, not self.quantidade())
+            self._journal = None
+
+
+_buffer: Optional[BufferEscrita] = None
+
+
+async def iniciar_buffer_escrita(**opcoes) -> BufferEscrita:
+    global _buffer
+    _buffer = BufferEscrita(**opcoes)
+    await _buffer.iniciar()
+    return _buffer
+
+
+async def parar_buffer_escrita():
+    global _buffer
+    if _buffer is not None:
+        await _buffer.parar()
+    _buffer = None
+
+
+def get_buffer_escrita() -> Optional[BufferEscrita]:
+    """
+    Retorna o buffer ativo, ou None quando as escritas vão direto ao Supabase.
+    """
+    return _buffer
@@ -0,0 +1,43 @@
+# jobs/reclassificar_sessoes.py
+"""
+Reprocessa as sessões salvas no Redis e conta as intenções das mensagens dos
+usuários, usando o mesmo classificador (e cache) do webhook.
+
+Uso: python -m jobs.reclassificar_sessoes
+"""
+
+import asyncio
+from collections import Counter
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from core.sessions import get_history, redis_client
+from services.intent import detectar_intencoes_em_lote, estatisticas_cache_intencao
+
+LOTE = 500
+
+
+async def main():
+    contagem: Counter = Counter()
+    lote: list[str] = []
+    sessoes = 0
+
+    async for key in redis_client.scan_iter(match="session:*:history", count=LOTE):
+        sessoes += 1
+        history = await get_history(key.split(":")[1])
+        lote += [m["content"] for m in history if m.get("role") == "user"]
+        if len(lote) >= LOTE:
+            contagem.update(detectar_intencoes_em_lote(lote))
+            lote = []
+    contagem.update(detectar_intencoes_em_lote(lote))
+
+    print(f"Sessões: {sessoes} | Mensagens: {sum(contagem.values())}")
+    for intent, total in contagem.most_common():
+        print(f"  {intent:<10} {total}")
+    print(f"Cache: {estatisticas_cache_intencao()}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
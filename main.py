@@ -1,6 +1,8 @@
 # main.py
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from dotenv import load_dotenv
 import os
 
@@ -9,18 +11,143 @@ dotenv_path = os.path.join(os.path.dirname(__file__), ".env")
 load_dotenv(dotenv_path)
 
 from routers.zapi_webhook import router as zapi_router  # Import relativo como antes
+from routers.pagamento_webhook import router as pagamento_router
+from core.db import fechar_supabase
+from core.write_behind import WRITE_BEHIND_JANELA, get_buffer_escrita, iniciar_buffer_escrita, parar_buffer_escrita
+from models.lead import estatisticas_leads
+from services.coalescer import COALESCER_JANELA, get_coalescedor, iniciar_coalescedor, parar_coalescedor
+from services.dedup import get_deduplicador
+from services.dialog_engine import responder_mensagem_da_fila, responder_turno_agrupado
+from services.hold_sweeper import (
+    SLOT_VARREDURA, get_varredor_reservas, iniciar_varredor_reservas, parar_varredor_reservas,
+)
+from services.llm import estatisticas_llm
+from services.memory import (
+    MEMORY_SPILL_REDIS, estatisticas_memoria, iniciar_descarga_memorias, parar_descarga_memorias,
+)
+from services.message_queue import FILA_ATIVA, get_fila, iniciar_fila, parar_fila
+from services.scheduler import reserva_expirada
+from utils.logger import estatisticas_logger
+from utils.metrics import CONTENT_TYPE, coletado, exportar_metricas
+from utils.zapi import aguardar_envios_pendentes, fechar_cliente_zapi
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup: buffer de escrita no Supabase (WRITE_BEHIND_JANELA_MS > 0; reaplica o journal),
+    # agrupamento de rajadas (COALESCER_JANELA_MS > 0), workers da fila (ZAPI_INGESTAO=fila)
+    # varredor de reservas preliminares não pagas (SLOT_VARREDURA_MS > 0) e descarga
+    # das memórias despejadas no Redis (MEMORY_SPILL_REDIS=1)
+    if WRITE_BEHIND_JANELA > 0:
+        await iniciar_buffer_escrita()
+    if COALESCER_JANELA > 0:
+        iniciar_coalescedor(responder_turno_agrupado)
+    if FILA_ATIVA:
+        await iniciar_fila(responder_mensagem_da_fila)
+    if SLOT_VARREDURA > 0:
+        iniciar_varredor_reservas(reserva_expirada)
+    if MEMORY_SPILL_REDIS:
+        iniciar_descarga_memorias()
+    yield
+    await parar_descarga_memorias()
+    await parar_varredor_reservas()
+    await parar_fila()
+    await parar_coalescedor()
+    # Shutdown: conclui envios em andamento e fecha o pool HTTP da Z-API
+    await aguardar_envios_pendentes()
+    await fechar_cliente_zapi()
+    # Descarrega as escritas pendentes (o que falhar fica no journal) e fecha o pool do Supabase
+    await parar_buffer_escrita()
+    await fechar_supabase()
+
 
 # Instância principal do app
 app = FastAPI(
     title="N.O.R.A. API",
     version="1.0.0",
-    description="Inteligência Estratégica N.O.R.A. conectada ao WhatsApp via Z-API"
+    description="Inteligência Estratégica N.O.R.A. conectada ao WhatsApp via Z-API",
+    lifespan=lifespan,
 )
 
-# Inclui rotas da Z-API
+# Inclui rotas da Z-API e do webhook de pagamentos
 app.include_router(zapi_router)
+app.include_router(pagamento_router)
 
 # Health check
 @app.get("/")
 async def health_check():
     return {"status": "N.O.R.A. está ativa e saudável 🚀"}
+
+
+# ————— Métricas —————
+# Latência por etapa e tokens/s do LLM são medidos onde acontecem (utils/metrics);
+# profundidades de fila e contadores dos componentes são lidos na hora da coleta.
+async def _profundidade_fila():
+    if not FILA_ATIVA:
+        return None
+    try:
+        return sum(await get_fila().backend.profundidade())
+    except RuntimeError:
+        return None  # fila ainda não iniciada
+
+
+def _erros_fila():
+    if not FILA_ATIVA:
+        return None
+    try:
+        metricas = get_fila().metricas
+    except RuntimeError:
+        return None
+    return {"handler": metricas.falhas, "backend": metricas.erros_backend}
+
+
+def _registrar_coletores():
+    coletado("nora_fila_profundidade", "Mensagens aguardando os workers da fila", _profundidade_fila)
+    coletado("nora_fila_erros_total", "Erros dos workers da fila", _erros_fila, tipo="counter", rotulo="origem")
+    coletado(
+        "nora_write_behind_pendentes", "Escritas aguardando a descarga no Supabase",
+        lambda: (b := get_buffer_escrita()) and b.quantidade(),
+    )
+    coletado(
+        "nora_coalescer_pendentes", "Números com mensagens aguardando a janela de agrupamento",
+        lambda: (c := get_coalescedor()) and c.pendentes(),
+    )
+    coletado(
+        "nora_llm_vagas", "Gerações do LLM em andamento e aguardando vaga",
+        lambda: {k: v for k, v in estatisticas_llm().items() if k in ("em_voo", "aguardando")}, rotulo="estado",
+    )
+    coletado("nora_llm_geracoes_total", "Gerações do LLM iniciadas", lambda: estatisticas_llm()["geracoes"], tipo="counter")
+    coletado("nora_supabase_idas_total", "Idas ao Supabase feitas pelo cache de leads", lambda: estatisticas_leads()["idas"], tipo="counter")
+    coletado("nora_log_fila", "Registros de log aguardando escrita", lambda: estatisticas_logger()["fila"])
+    coletado(
+        "nora_log_perdidos_total", "Registros de log não escritos (fila cheia ou amostragem)",
+        lambda: {k: v for k, v in estatisticas_logger().items() if k != "fila"}, tipo="counter", rotulo="motivo",
+    )
+    coletado(
+        "nora_dedup_total", "Entregas do webhook vistas pelo dedup",
+        lambda: (d := get_deduplicador()) and d.metricas, tipo="counter", rotulo="resultado",
+    )
+    coletado(
+        "nora_reservas_expiradas_total", "Reservas preliminares vencidas devolvidas ao estoque",
+        lambda: (v := get_varredor_reservas()) and v.metricas["expiradas"], tipo="counter",
+    )
+    coletado(
+        "nora_memoria", "Memória de conversas neste processo",
+        lambda: {k: v for k, v in estatisticas_memoria().items()
+                 if k in ("usuarios", "mensagens", "bytes_conteudo", "spill_pendente", "rss_max_kb")},
+        rotulo="medida",
+    )
+    coletado(
+        "nora_memoria_despejos_total", "Memórias de conversa despejadas ou descartadas",
+        lambda: {k: v for k, v in estatisticas_memoria().items()
+                 if k in ("despejos_lru", "despejos_ttl", "spill_descartados")},
+        tipo="counter", rotulo="motivo",
+    )
+
+
+_registrar_coletores()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(await exportar_metricas(), media_type=CONTENT_TYPE)
@@ -0,0 +1,214 @@
+# models/input.py
+
+from typing import Annotated, Any, Literal, Optional, Union
+
+from pydantic import BaseModel, ConfigDict, Discriminator, Field, Tag, TypeAdapter
+
+# ————— Eventos recebidos da Z-API —————
+# Callbacks que chegam no webhook, distinguidos pelo campo "type":
+#   ReceivedCallback      → mensagem recebida (texto, mídia, de grupo, enviada por nós...)
+#   MessageStatusCallback → recibo de status (enviada, entregue, lida)
+#   DeliveryCallback      → confirmação de envio de uma mensagem nossa
+#   PresenceChatCallback  → "digitando...", online/offline
+#   Connected/DisconnectedCallback → estado da instância
+# Formatos sem "type": o legado { "phone", "text": { "message" } } é uma mensagem
+# recebida; { "messages": [ { "from", "text": { "body" } } ] } é o formato em lote.
+# Só mensagens de texto (ou mídia com legenda) de contatos individuais viram entrada;
+# o resto é descartado antes de qualquer acesso ao Redis ou ao LLM.
+
+
+class MensagemEntrada(BaseModel):
+    """
+    Mensagem normalizada que segue para o atendimento (fila, agrupamento, diálogo).
+    """
+
+    numero: str
+    texto: str
+    message_id: Optional[str] = None
+    momento: Union[int, str, None] = None
+    nome: Optional[str] = None
+
+
+class _Evento(BaseModel):
+    model_config = ConfigDict(extra="ignore", populate_by_name=True)
+
+    def descarte(self) -> Optional[str]:
+        """
+        Motivo para ignorar o evento, ou None se ele é uma mensagem a atender.
+        """
+        return "evento"
+
+    def entrada(self) -> Optional[MensagemEntrada]:
+        return None
+
+
+class TextoZapi(BaseModel):
+    message: str = ""
+
+
+class MidiaZapi(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+
+    caption: Optional[str] = None
+    mime_type: Optional[str] = Field(None, alias="mimeType")
+
+
+class MensagemRecebida(_Evento):
+    type: Literal["ReceivedCallback"] = "ReceivedCallback"
+    phone: str = ""
+    message_id: Optional[str] = Field(None, alias="messageId")
+    momment: Optional[int] = None
+    from_me: bool = Field(False, alias="fromMe")
+    is_group: bool = Field(False, alias="isGroup")
+    is_newsletter: bool = Field(False, alias="isNewsletter")
+    broadcast: bool = False
+    sender_name: Optional[str] = Field(None, alias="senderName")
+    text: Optional[TextoZapi] = None
+    image: Optional[MidiaZapi] = None
+    video: Optional[MidiaZapi] = None
+    document: Optional[MidiaZapi] = None
+    audio: Optional[dict] = None
+    sticker: Optional[dict] = None
+
+    def _texto(self) -> str:
+        if self.text is not None:
+            return self.text.message.strip()
+        # Mídia com legenda: a legenda é o que o lead escreveu
+        for midia in (self.image, self.video, self.document):
+            if midia is not None and midia.caption:
+                return midia.caption.strip()
+        return ""
+
+    def descarte(self) -> Optional[str]:
+        if self.from_me:
+            return "propria"
+        if self.is_group or self.is_newsletter or self.broadcast or self.phone.endswith("-group"):
+            return "grupo"
+        if not self.phone or not self._texto():
+            return "sem_texto"
+        return None
+
+    def entrada(self) -> Optional[MensagemEntrada]:
+        if self.descarte():
+            return None
+        return MensagemEntrada(
+            numero=self.phone, texto=self._texto(), message_id=self.message_id,
+            momento=self.momment, nome=self.sender_name,
+        )
+
+
+class _TextoLote(BaseModel):
+    body: str = ""
+
+
+class _MensagemLote(BaseModel):
+    model_config = ConfigDict(extra="ignore", populate_by_name=True)
+
+    id: Optional[str] = None
+    from_: str = Field("", alias="from")
+    timestamp: Union[int, str, None] = None
+    text: Optional[_TextoLote] = None
+
+
+class MensagensLote(_Evento):
+    messages: list[_MensagemLote]
+
+    def _primeira(self) -> Optional[_MensagemLote]:
+        return self.messages[0] if self.messages else None
+
+    def descarte(self) -> Optional[str]:
+        msg = self._primeira()
+        if msg is None or not msg.from_ or msg.text is None or not msg.text.body.strip():
+            return "sem_texto"
+        return None
+
+    def entrada(self) -> Optional[MensagemEntrada]:
+        if self.descarte():
+            return None
+        msg = self._primeira()
+        return MensagemEntrada(numero=msg.from_, texto=msg.text.body.strip(), message_id=msg.id, momento=msg.timestamp)
+
+
+class StatusMensagem(_Evento):
+    type: Literal["MessageStatusCallback"]
+    status: Optional[str] = None
+    ids: list[str] = []
+    phone: Optional[str] = None
+
+    def descarte(self) -> Optional[str]:
+        return "status"
+
+
+class EntregaMensagem(_Evento):
+    type: Literal["DeliveryCallback"]
+    message_id: Optional[str] = Field(None, alias="messageId")
+    phone: Optional[str] = None
+
+    def descarte(self) -> Optional[str]:
+        return "entrega"
+
+
+class PresencaChat(_Evento):
+    type: Literal["PresenceChatCallback"]
+    phone: Optional[str] = None
+    status: Optional[str] = None
+
+    def descarte(self) -> Optional[str]:
+        return "presenca"
+
+
+class EstadoInstancia(_Evento):
+    type: Literal["ConnectedCallback", "DisconnectedCallback"]
+
+    def descarte(self) -> Optional[str]:
+        return "conexao"
+
+
+class EventoDesconhecido(_Evento):
+    type: str
+
+    def descarte(self) -> Optional[str]:
+        return "tipo_desconhecido"
+
+
+_TAGS = {
+    "ReceivedCallback": "mensagem",
+    "MessageStatusCallback": "status",
+    "DeliveryCallback": "entrega",
+    "PresenceChatCallback": "presenca",
+    "ConnectedCallback": "conexao",
+    "DisconnectedCallback": "conexao",
+}
+
+
+def _tag_evento(valor: Any) -> str:
+    if not isinstance(valor, dict):
+        return _TAGS.get(getattr(valor, "type", None), "desconhecido")
+    tipo = valor.get("type")
+    if tipo is None:
+        return "lote" if "messages" in valor else "mensagem"
+    return _TAGS.get(tipo, "desconhecido")
+
+
+EventoZapi = Annotated[
+    Union[
+        Annotated[MensagemRecebida, Tag("mensagem")],
+        Annotated[MensagensLote, Tag("lote")],
+        Annotated[StatusMensagem, Tag("status")],
+        Annotated[EntregaMensagem, Tag("entrega")],
+        Annotated[PresencaChat, Tag("presenca")],
+        Annotated[EstadoInstancia, Tag("conexao")],
+        Annotated[EventoDesconhecido, Tag("desconhecido")],
+    ],
+    Discriminator(_tag_evento),
+]
+
+_adaptador = TypeAdapter(EventoZapi)
+
+
+def parse_evento_zapi(corpo: bytes | str) -> _Evento:
+    """
+    Lê o corpo cru do webhook (uma só passada: JSON → modelo).
+    Levanta pydantic.ValidationError para JSON inválido ou campos com tipo errado.
+    """
+    return _adaptador.validate_json(corpo)
@@ -1,44 +1,176 @@
 # models/lead.py
 from typing import Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import copy
 import os
 import json
-from supabase import create_client, Client
+import time
 from datetime import datetime
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Captura variáveis de ambiente
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+from core.db import get_supabase
+from core.write_behind import ao_gravar, get_buffer_escrita
+from utils.logger import log_event
+from utils.metrics import medir
 
-# Validação explícita das variáveis
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise EnvironmentError(
-        f"[ERRO] Variáveis de ambiente inválidas: SUPABASE_URL={SUPABASE_URL}, SUPABASE_KEY={'set' if SUPABASE_KEY else 'missing'}"
-    )
+TABELA_LEADS = "leads"
+# Eventos do funil (lead criado, formulário enviado, ...). Vazio desliga o registro.
+LEAD_EVENTOS_TABELA = os.getenv("LEAD_EVENTOS_TABELA", "")
 
-# Criação do cliente Supabase
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# ————— Cache de leads (read-through, invalidado/atualizado a cada escrita) —————
+LEAD_CACHE_TTL = float(os.getenv("LEAD_CACHE_TTL", "60"))      # segundos; 0 desliga o cache
+LEAD_CACHE_MAX = int(os.getenv("LEAD_CACHE_MAX", "5000"))      # leads mantidos (LRU)
 
+# numero → (linha do lead, momento em que foi lida)
+_cache: "OrderedDict[str, tuple[dict, float]]" = OrderedDict()
+# Colunas da tabela, descobertas uma vez por processo
+_colunas: Optional[frozenset] = None
+# Cai para insert se a tabela não tiver restrição única em "numero"
+_upsert_disponivel = True
+_stats = {"hits": 0, "misses": 0, "idas": 0}
+# Contadores de idas ao Supabase abertos no contexto atual (ver contar_idas)
+_idas_requisicao: ContextVar[tuple] = ContextVar("idas_supabase", default=())
 
-def get_lead(phone: str) -> Optional[dict]:
+
+def _agora() -> float:
+    return time.monotonic()
+
+
+async def _tabela():
+    return (await get_supabase()).table(TABELA_LEADS)
+
+
+async def _executar(consulta, operacao: str):
+    """
+    Executa uma consulta no Supabase contabilizando a ida (processo e requisição)
+    e a latência da operação.
+    """
+    _stats["idas"] += 1
+    for contador in _idas_requisicao.get():
+        contador["idas"] += 1
+    with medir("supabase", operacao):
+        return await consulta.execute()
+
+
+@contextmanager
+def contar_idas():
+    """
+    Conta as idas ao Supabase feitas dentro do bloco (inclusive em tasks filhas
+    e em blocos aninhados):
+
+        with contar_idas() as idas:
+            ...
+        idas["idas"]
+    """
+    contador = {"idas": 0}
+    token = _idas_requisicao.set(_idas_requisicao.get() + (contador,))
+    try:
+        yield contador
+    finally:
+        _idas_requisicao.reset(token)
+
+
+def _guardar(lead: dict, completa: bool = True):
+    global _colunas
+    if _colunas is None and completa:
+        _colunas = frozenset(lead)  # toda linha lida traz todas as colunas
+    if LEAD_CACHE_TTL <= 0:
+        return
+    _cache[lead["numero"]] = (copy.deepcopy(lead), _agora())
+    _cache.move_to_end(lead["numero"])
+    while len(_cache) > LEAD_CACHE_MAX:
+        _cache.popitem(last=False)
+
+
+def _do_cache(phone: str) -> Optional[dict]:
+    item = _cache.get(phone)
+    if item is None:
+        return None
+    lead, lido_em = item
+    if _agora() - lido_em > LEAD_CACHE_TTL:
+        del _cache[phone]
+        return None
+    _cache.move_to_end(phone)
+    return lead
+
+
+def _com_pendentes(phone: str, lead: Optional[dict]) -> Optional[dict]:
+    """
+    Aplica sobre o lead lido as escritas ainda no buffer (write-behind).
+    """
+    buffer = get_buffer_escrita()
+    pendente = buffer.pendente(TABELA_LEADS, phone) if buffer is not None else None
+    if pendente is None:
+        return lead
+    if lead is None and pendente.nova is None:
+        return None
+    # A inserção pendente é ignorada se o lead já existe (não sobrescreve): a linha lida vence
+    return {**copy.deepcopy(pendente.nova or {}), **(lead or {}), **copy.deepcopy(pendente.campos)}
+
+
+def _ao_gravar_lead(lead: dict):
+    _guardar(_com_pendentes(lead["numero"], lead))
+
+
+ao_gravar(TABELA_LEADS, _ao_gravar_lead)
+
+
+async def get_colunas_leads() -> frozenset:
+    """
+    Colunas válidas da tabela de leads. Uma ida ao Supabase por processo
+    (ou nenhuma, se algum lead já tiver sido lido).
+    """
+    global _colunas
+    if _colunas is None:
+        response = await _executar((await _tabela()).select("*").limit(1), "colunas")
+        buffer = get_buffer_escrita()
+        if not response.data and buffer is not None and buffer.quantidade():
+            # Tabela vazia com leads novos no buffer: grava o lote e aprende as colunas com ele
+            await buffer.descarregar()
+        if _colunas is None:
+            if not response.data:
+                raise ValueError("[ERRO] Tabela de leads vazia: não foi possível descobrir as colunas.")
+            _colunas = frozenset(response.data[0])
+    return _colunas
+
+
+async def get_lead(phone: str) -> Optional[dict]:
     """
     Busca o lead no Supabase pelo número de telefone.
-    Se não encontrar, retorna None.
+    Se não encontrar, retorna None. Erros de leitura são propagados: tratá-los
+    como "não encontrado" levaria o chamador a criar o lead por cima do existente.
+    Leads lidos há menos de LEAD_CACHE_TTL segundos vêm do cache local.
     """
+    lead = _do_cache(phone)
+    if lead is not None:
+        _stats["hits"] += 1
+        return copy.deepcopy(lead)
+    _stats["misses"] += 1
     try:
-        response = supabase.table("leads").select("*").eq("numero", phone).single().execute()
-        return response.data if response.data else None
+        response = await _executar((await _tabela()).select("*").eq("numero", phone).limit(1), "select")
     except Exception as e:
-        print(f"[DEBUG] Lead não encontrado para {phone} ou erro ao buscar: {e}")
+        log_event("❌ Erro ao buscar lead", {"numero": phone, "error": str(e)})
+        raise
+    lead = _com_pendentes(phone, response.data[0] if response.data else None)
+    if lead is None:
         return None
+    _guardar(lead, completa=bool(response.data))
+    return lead
 
 
-def create_lead(phone: str) -> dict:
+async def create_lead(phone: str) -> dict:
     """
     Cria um novo lead no Supabase com estrutura padrão.
+    Usa upsert em "numero" ignorando duplicatas: duas mensagens simultâneas de um
+    número novo não geram leads duplicados, e um lead que já existe nunca é
+    sobrescrito pela estrutura padrão (é relido e devolvido como está).
+    Com o buffer de escrita ativo, a inserção sai no próximo lote.
     """
+    global _upsert_disponivel
     novo_lead = {
         "numero": phone,
         "nome": "",
@@ -50,43 +182,130 @@ def create_lead(phone: str) -> dict:
         "historico": "",
         "updated_at": datetime.utcnow().isoformat()
     }
-    response = supabase.table("leads").insert(novo_lead).execute()
+    buffer = get_buffer_escrita()
+    if buffer is not None:
+        buffer.inserir(TABELA_LEADS, "numero", novo_lead)
+        _guardar(novo_lead, completa=False)
+        return copy.deepcopy(novo_lead)
+
+    response = None
+    if _upsert_disponivel:
+        try:
+            response = await _executar(
+                (await _tabela()).upsert(novo_lead, on_conflict="numero", ignore_duplicates=True), "upsert"
+            )
+        except Exception as e:
+            # 42P10: sem restrição única em "numero" → insert simples daqui em diante
+            if "42P10" not in str(e) and "conflict" not in str(e).lower():
+                raise
+            _upsert_disponivel = False
+    if response is None:
+        response = await _executar((await _tabela()).insert(novo_lead), "insert")
+    if not response.data:
+        # Já existia (outra mensagem criou antes): a linha atual vale
+        response = await _executar((await _tabela()).select("*").eq("numero", phone).limit(1), "select")
     if response.data:
+        _guardar(response.data[0])
         return response.data[0]
     else:
         raise RuntimeError(f"[ERRO] Falha ao criar lead no Supabase: {response}")
 
 
-def update_lead(phone: str, updates: dict) -> dict:
+async def update_lead(phone: str, updates: dict) -> dict:
     """
     Atualiza um lead existente no Supabase de forma segura.
     - Converte dicionários em JSON
-    - Filtra apenas colunas existentes
+    - Filtra apenas colunas existentes (esquema em cache, sem select prévio)
+    - Um único PATCH, cuja resposta atualiza o cache. Nada é omitido por comparação
+      com o cache: com vários workers, a cópia local pode estar desatualizada e a
+      escrita "repetida" seria justamente a que desfaz a alteração de outro worker
+    - Com o buffer de escrita ativo, as alterações de leads conhecidos se juntam
+      às pendentes e saem em um só PATCH no próximo lote
     """
-    updates["updated_at"] = datetime.utcnow().isoformat()
-
-    # 1) Busca uma linha existente para pegar as colunas válidas
-    response = supabase.table("leads").select("*").eq("numero", phone).limit(1).execute()
-    if not response.data:
-        raise ValueError(f"Lead com telefone {phone} não encontrado.")
-
-    existing_columns = set(response.data[0].keys())
+    colunas = await get_colunas_leads()
 
-    # 2) Filtra updates para apenas colunas existentes e converte dicts em JSON
+    # 1) Filtra updates para apenas colunas existentes e converte dicts em JSON
     safe_updates = {}
     for k, v in updates.items():
-        if k in existing_columns:
+        if k in colunas and k != "updated_at":
             safe_updates[k] = json.dumps(v) if isinstance(v, dict) else v
 
     if not safe_updates:
         raise ValueError(f"Nenhuma coluna válida para atualizar para o lead {phone}.")
 
-    # 3) Atualiza a tabela
+    safe_updates["updated_at"] = datetime.utcnow().isoformat()
+    updates["updated_at"] = safe_updates["updated_at"]
+
+    buffer = get_buffer_escrita()
+    atual = _do_cache(phone)
+    if buffer is not None and (atual is not None or buffer.pendente(TABELA_LEADS, phone)):
+        buffer.atualizar(TABELA_LEADS, "numero", phone, safe_updates)
+        lead = _com_pendentes(phone, atual)
+        if lead is None:
+            # Fora do cache e só com alterações pendentes: devolve o que se sabe
+            return {"numero": phone, **copy.deepcopy(buffer.pendente(TABELA_LEADS, phone).campos)}
+        _guardar(lead, completa=False)
+        return copy.deepcopy(lead)
+
+    # 2) Atualiza a tabela
     try:
-        response = supabase.table("leads").update(safe_updates).eq("numero", phone).execute()
-        if response.data:
-            return response.data[0]
-        else:
-            raise ValueError(f"Falha na atualização do lead {phone}: {response}")
+        response = await _executar((await _tabela()).update(safe_updates).eq("numero", phone), "update")
     except Exception as e:
+        _cache.pop(phone, None)
         raise ValueError(f"Erro ao atualizar lead {phone}: {str(e)}")
+    if not response.data:
+        _cache.pop(phone, None)
+        raise ValueError(f"Lead com telefone {phone} não encontrado.")
+    _guardar(response.data[0])
+    return response.data[0]
+
+
+async def registrar_evento_lead(phone: str, tipo: str, dados: Optional[dict] = None):
+    """
+    Registra um evento do funil em LEAD_EVENTOS_TABELA (em lote, se o buffer
+    de escrita estiver ativo). Falhas não interrompem o atendimento.
+    """
+    if not LEAD_EVENTOS_TABELA:
+        return
+    evento = {
+        "numero": phone,
+        "tipo": tipo,
+        "dados": dados or {},
+        "criado_em": datetime.utcnow().isoformat(),
+    }
+    buffer = get_buffer_escrita()
+    if buffer is not None:
+        buffer.registrar(LEAD_EVENTOS_TABELA, evento)
+        return
+    try:
+        await _executar((await get_supabase()).table(LEAD_EVENTOS_TABELA).insert(evento), "evento")
+    except Exception as e:
+        log_event("❌ Erro ao registrar evento do lead", {"numero": phone, "tipo": tipo, "error": str(e)})
+
+
+def invalidar_lead(phone: str):
+    """
+    Remove o lead do cache (ex.: alterado por fora, no painel do Supabase).
+    """
+    _cache.pop(phone, None)
+
+
+def estatisticas_leads() -> dict:
+    """
+    Cache de leads (acertos/faltas) e idas ao Supabase neste processo.
+    """
+    consultas = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "em_cache": len(_cache),
+        "taxa_acerto": (_stats["hits"] / consultas) if consultas else 0.0,
+    }
+
+
+def limpar_cache_leads():
+    global _colunas, _upsert_disponivel
+    _cache.clear()
+    _colunas = None
+    _upsert_disponivel = True
+    for chave in _stats:
+        _stats[chave] = 0
@@ -0,0 +1,22 @@
+# models/output.py
+
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class RespostaWebhook(BaseModel):
+    """
+    Resposta do webhook da Z-API (campos vazios são omitidos no JSON).
+    - ok=False + motivo: corpo inválido
+    - ignorado: evento que não é mensagem a atender (status, própria, grupo, sem texto...)
+    - duplicada: reenvio de uma mensagem já recebida
+    - enfileirado / mensagem_enviada: modo fila / modo síncrono
+    """
+
+    ok: bool
+    motivo: Optional[str] = None
+    ignorado: Optional[str] = None
+    duplicada: Optional[bool] = None
+    enfileirado: Optional[bool] = None
+    mensagem_enviada: Optional[str] = None
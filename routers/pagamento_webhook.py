@@ -0,0 +1,30 @@
+# routers/pagamento_webhook.py
+
+import hmac
+
+from fastapi import APIRouter, Body, Header, HTTPException
+from services import payment
+from services.scheduler import confirmar_pagamento
+from utils.logger import log_event, nova_correlacao
+
+router = APIRouter(tags=["Pagamentos"], prefix="/pagamentos")
+
+
+@router.post("/webhook")
+async def receber_evento_pagamento(
+    body: dict = Body(...), x_webhook_token: str = Header(default="")
+):
+    # 0) Só aceita eventos do gateway (token compartilhado, quando configurado)
+    if payment.PAGAMENTO_WEBHOOK_TOKEN and not hmac.compare_digest(
+        x_webhook_token, payment.PAGAMENTO_WEBHOOK_TOKEN
+    ):
+        raise HTTPException(status_code=401, detail="Token inválido")
+    nova_correlacao()
+    log_event("💳 Evento de pagamento", body)
+
+    # 1) Confirma/cancela a reserva e avisa o lead (eventos repetidos são ignorados)
+    try:
+        resultado = await confirmar_pagamento(body)
+    except ValueError as e:
+        return {"ok": False, "motivo": str(e)}
+    return {"ok": True, "status": resultado["status"]}
@@ -1,69 +1,89 @@
 # routers/zapi_webhook.py
 
-import os
-import requests
-from fastapi import APIRouter, Request, Body
-from services.dialog_engine import handle_message
-from utils.logger import log_event
-
-# Carrega variáveis de ambiente Z-API
-ZAPI_INSTANCE = os.getenv("ZAPI_INSTANCE", "")
-ZAPI_TOKEN = os.getenv("ZAPI_TOKEN", "")
-ZAPI_BASE_URL = f"https://api.z-api.io/instances/{ZAPI_INSTANCE}/token/{ZAPI_TOKEN}"
-MOCK_ZAPI = os.getenv("MOCK_ZAPI", "1") == "1"
+from fastapi import APIRouter, Request
+from pydantic import ValidationError
+from models.input import parse_evento_zapi
+from models.output import RespostaWebhook
+from services.coalescer import get_coalescedor
+from services.dedup import chave_mensagem, get_deduplicador
+from services.dialog_engine import responder_mensagem
+from services.message_queue import FILA_ATIVA, get_fila
+from utils.logger import log_event, nova_correlacao
+from utils.metrics import cronometrar
 
 router = APIRouter(tags=["Z-API"], prefix="/zapi")
 
 
-@router.post("/webhook")
-async def receber_mensagem_zapi(request: Request, body: dict = Body(...)):
-    # 0) Recebe e loga o payload cru
-    payload = await request.json()
-    log_event("📩 PAYLOAD BRUTO ZAPI", payload)
-
-    # 1) Extrai número e texto, suportando ambos formatos
-    numero = None
-    texto = None
+@router.post("/webhook", response_model=RespostaWebhook, response_model_exclude_none=True)
+@cronometrar("webhook", "zapi")
+async def receber_mensagem_zapi(request: Request) -> RespostaWebhook:
+    # 0) Lê o corpo cru uma vez só: JSON → evento tipado (texto, mídia, status, grupo...)
+    corpo = await request.body()
+    try:
+        evento = parse_evento_zapi(corpo)
+    except ValidationError as e:
+        log_event("❌ Payload inválido Z-API", {
+            "erro": str(e.errors(include_url=False)[:3]), "corpo": corpo[:500].decode(errors="replace"),
+        })
+        return RespostaWebhook(ok=False, motivo="Payload inválido")
 
-    # → Novo formato Z-API: { "messages": [ { "from": "...", "text": { "body": "..." } } ] }
-    msgs = payload.get("messages")
-    if isinstance(msgs, list) and len(msgs) > 0:
-        msg = msgs[0]
-        numero = msg.get("from")
-        texto = msg.get("text", {}).get("body")
+    # 1) Recibos de status, mensagens nossas, grupos e mídia sem texto param aqui,
+    #    antes de qualquer acesso ao Redis ou ao LLM
+    motivo = evento.descarte()
+    if motivo:
+        return RespostaWebhook(ok=True, ignorado=motivo)
+    entrada = evento.entrada()
+    numero, texto = entrada.numero, entrada.texto
+    # ID de correlação: acompanha a mensagem por fila, diálogo, agenda e envio
+    correlacao = nova_correlacao(entrada.message_id)
+    payload = {**entrada.model_dump(), "correlacao": correlacao}
+    log_event("🔹 Mensagem recebida", {"numero": numero, "message_id": entrada.message_id, "caracteres": len(texto)})
 
-    # → Fallback legado: { "phone": "...", "text": { "message": "..." } }
-    if not numero or not texto:
-        numero = payload.get("phone") or numero
-        texto = payload.get("text", {}).get("message") or texto
+    # 2) Reenvio da Z-API (nossa resposta demorou): a mesma mensagem não é processada
+    #    de novo (nem gera outra resposta, outro registro no histórico ou outra reserva)
+    dedup = get_deduplicador()
+    chave = chave_mensagem(entrada)
+    if dedup is not None and not await dedup.nova(chave):
+        return RespostaWebhook(ok=True, duplicada=True)
 
-    # Se ainda faltar algo, rejeita
-    if not numero or not texto:
-        return {"ok": False, "motivo": "Payload inválido"}
+    try:
+        # 3) Modo fila: só enfileira e responde 200 na hora; os workers fazem o resto
+        if FILA_ATIVA:
+            await get_fila().enfileirar(numero, texto, payload)
+            return RespostaWebhook(ok=True, enfileirado=True)
 
-    log_event(f"🔹 Mensagem recebida de {numero}", texto)
+        # 4) Modo síncrono: processa (NLP, intents, scheduler etc.) e envia em segundo plano.
+        #    Com agrupamento ligado, aguarda a janela e recebe a resposta do turno agrupado.
+        coalescedor = get_coalescedor()
+        if coalescedor is not None:
+            conteudo = await coalescedor.adicionar(numero, texto, payload)
+        else:
+            conteudo = await responder_mensagem(numero, texto, payload)
+    except Exception:
+        # Falhou antes de concluir: o reenvio da Z-API deve ser processado
+        if dedup is not None:
+            await dedup.esquecer(chave)
+        raise
 
-    # 2) Processa a mensagem (NLP, intents, scheduler etc.)
-    resposta = await handle_message(numero, texto, payload)
+    return RespostaWebhook(ok=True, mensagem_enviada=conteudo)
 
-    # 3) Normaliza o conteúdo a enviar
-    if isinstance(resposta, dict):
-        conteudo = resposta.get("mensagem", "")
-    else:
-        conteudo = str(resposta)
 
-    # 4) Envia via Z-API ou mock
-    body = {"phone": numero, "message": conteudo}
+@router.get("/fila")
+async def metricas_fila():
+    """
+    Profundidade da fila e tempos de espera (apenas com ZAPI_INGESTAO=fila).
+    """
+    if not FILA_ATIVA:
+        return {"ativa": False}
+    return {"ativa": True, **await get_fila().snapshot()}
 
-    if MOCK_ZAPI:
-        log_event("📤 MOCK Mensagem enviada Z-API", {"body": body})
-    else:
-        send_url = f"{ZAPI_BASE_URL}/send-messages"
-        try:
-            resp = requests.post(send_url, json=body, timeout=10)
-            resp.raise_for_status()
-            log_event("📤 Mensagem enviada Z-API", {"body": body, "response": resp.json()})
-        except Exception as e:
-            log_event("❌ Erro ao enviar Z-API", {"error": str(e), "body": body})
 
-    return {"ok": True, "mensagem_enviada": conteudo}
+@router.get("/dedup")
+async def metricas_dedup():
+    """
+    Entregas recebidas e repetidas descartadas pelo dedup do webhook.
+    """
+    dedup = get_deduplicador()
+    if dedup is None:
+        return {"ativo": False}
+    return {"ativo": True, "backend": type(dedup.backend).__name__, **dedup.metricas}
@@ -0,0 +1,171 @@
+# services/coalescer.py
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+from utils.logger import log_event
+
+# ————— Configuração —————
+# Janela de silêncio: a mensagem só é processada depois de X ms sem novas mensagens
+# do mesmo número. 0 desliga o agrupamento.
+COALESCER_JANELA = float(os.getenv("COALESCER_JANELA_MS", "0")) / 1000
+# Teto de espera desde a primeira mensagem do grupo (evita adiar para sempre)
+COALESCER_ESPERA_MAX = float(os.getenv("COALESCER_ESPERA_MAX_MS", "8000")) / 1000
+COALESCER_TICK = float(os.getenv("COALESCER_TICK_MS", "50")) / 1000
+
+Handler = Callable[[str, str, dict], Awaitable[object]]
+
+
+@dataclass
+class _Grupo:
+    primeira: float
+    ultima: float
+    textos: list[str] = field(default_factory=list)
+    payload: dict = field(default_factory=dict)
+    futuros: list[asyncio.Future] = field(default_factory=list)
+
+
+class CoalescedorMensagens:
+    """
+    Agrupa rajadas de mensagens do mesmo número ("oi", "tudo bem?", "quero marcar")
+    em um único turno: um só handle_message, uma só geração e uma só resposta.
+    - `adicionar` devolve um Future resolvido com a resposta do grupo
+    - `descarregar_vencidos` processa os grupos cuja janela de silêncio expirou
+    - grupos do mesmo número nunca são processados em paralelo
+    O relógio é injetável para testes determinísticos.
+    """
+
+    def __init__(
+        self,
+        handler: Handler,
+        janela: float = COALESCER_JANELA,
+        espera_max: float = COALESCER_ESPERA_MAX,
+        relogio: Callable[[], float] = time.monotonic,
+    ):
+        self.handler = handler
+        self.janela = janela
+        self.espera_max = espera_max
+        self.relogio = relogio
+        self._grupos: dict[str, _Grupo] = {}
+        self._travas: dict[str, tuple[asyncio.Lock, int]] = {}  # trava por número + usos
+        self._tarefas: set[asyncio.Task] = set()
+        self._loop_task: Optional[asyncio.Task] = None
+        self.metricas = {"mensagens": 0, "turnos": 0}
+
+    def adicionar(self, numero: str, texto: str, payload: dict) -> asyncio.Future:
+        agora = self.relogio()
+        grupo = self._grupos.get(numero)
+        if grupo is None:
+            grupo = self._grupos[numero] = _Grupo(primeira=agora, ultima=agora)
+        grupo.ultima = agora
+        grupo.textos.append(texto)
+        grupo.payload = payload
+        futuro = asyncio.get_running_loop().create_future()
+        # Quem não aguarda o futuro (workers da fila) não deve gerar aviso de exceção perdida
+        futuro.add_done_callback(lambda f: f.cancelled() or f.exception())
+        grupo.futuros.append(futuro)
+        self.metricas["mensagens"] += 1
+        return futuro
+
+    def pendentes(self) -> int:
+        """
+        Números com mensagens aguardando a janela de silêncio.
+        """
+        return len(self._grupos)
+
+    def vencidos(self, agora: float) -> list[str]:
+        return [
+            numero for numero, g in self._grupos.items()
+            if agora - g.ultima >= self.janela or agora - g.primeira >= self.espera_max
+        ]
+
+    def descarregar_vencidos(self, todos: bool = False) -> list[asyncio.Task]:
+        """
+        Dispara o processamento dos grupos vencidos (ou de todos, no shutdown).
+        """
+        numeros = list(self._grupos) if todos else self.vencidos(self.relogio())
+        tarefas = []
+        for numero in numeros:
+            grupo = self._grupos.pop(numero)
+            task = asyncio.create_task(self._processar(numero, grupo))
+            self._tarefas.add(task)
+            task.add_done_callback(self._tarefas.discard)
+            tarefas.append(task)
+        return tarefas
+
+    async def _processar(self, numero: str, grupo: _Grupo):
+        trava, usos = self._travas.get(numero) or (asyncio.Lock(), 0)
+        self._travas[numero] = (trava, usos + 1)
+        try:
+            await self._processar_em_ordem(numero, grupo, trava)
+        finally:
+            trava, usos = self._travas[numero]
+            if usos <= 1:
+                del self._travas[numero]
+            else:
+                self._travas[numero] = (trava, usos - 1)
+
+    async def _processar_em_ordem(self, numero: str, grupo: _Grupo, trava: asyncio.Lock):
+        async with trava:
+            texto = "\n".join(grupo.textos)
+            self.metricas["turnos"] += 1
+            if len(grupo.textos) > 1:
+                log_event("🧩 Mensagens agrupadas", {"numero": numero, "quantidade": len(grupo.textos)})
+            try:
+                resultado = await self.handler(numero, texto, grupo.payload)
+            except Exception as e:
+                log_event("❌ Erro ao processar grupo de mensagens", {"numero": numero, "error": str(e)})
+                for futuro in grupo.futuros:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                return
+            for futuro in grupo.futuros:
+                if not futuro.done():
+                    futuro.set_result(resultado)
+
+    async def _executar(self):
+        while True:
+            await asyncio.sleep(COALESCER_TICK)
+            self.descarregar_vencidos()
+
+    def iniciar(self):
+        self._loop_task = asyncio.create_task(self._executar())
+
+    async def parar(self):
+        """
+        Para o relógio e processa imediatamente o que ainda estiver agrupado.
+        """
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+        self.descarregar_vencidos(todos=True)
+        if self._tarefas:
+            await asyncio.gather(*list(self._tarefas), return_exceptions=True)
+
+
+_coalescedor: Optional[CoalescedorMensagens] = None
+
+
+def iniciar_coalescedor(handler: Handler) -> CoalescedorMensagens:
+    global _coalescedor
+    _coalescedor = CoalescedorMensagens(handler)
+    _coalescedor.iniciar()
+    return _coalescedor
+
+
+async def parar_coalescedor():
+    global _coalescedor
+    if _coalescedor is not None:
+        await _coalescedor.parar()
+    _coalescedor = None
+
+
+def get_coalescedor() -> Optional[CoalescedorMensagens]:
+    """
+    Retorna o coalescedor ativo, ou None quando o agrupamento está desligado.
+    """
+    return _coalescedor
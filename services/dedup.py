@@ -0,0 +1,153 @@
+# services/dedup.py
+
+import hashlib
+import os
+import time
+from typing import Callable, Optional
+
+from core import sessions
+from models.input import MensagemEntrada
+from utils.logger import log_event
+
+# ————— Configuração —————
+# A Z-API reenvia o webhook quando a resposta demora; cada entrega repetida é descartada
+# se a mesma mensagem já foi vista dentro da janela.
+DEDUP_ATIVO = os.getenv("DEDUP_ATIVO", "1") == "1"
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", "redis")  # redis (vários workers) | memoria (nó único)
+DEDUP_JANELA = int(os.getenv("DEDUP_JANELA_S", "900"))
+DEDUP_MEMORIA_MAX = int(os.getenv("DEDUP_MEMORIA_MAX", "200000"))  # chaves guardadas no backend memoria
+DEDUP_PREFIXO = "dedup:zapi:"
+
+
+def chave_mensagem(entrada: MensagemEntrada) -> Optional[str]:
+    """
+    Identidade da mensagem: o ID do provedor (messageId / messages[0].id); sem ele,
+    hash de telefone + texto + momento do envio. None quando não há como distinguir
+    um reenvio de uma mensagem nova igual (ex.: dois "ok" seguidos), e aí não há dedup.
+    """
+    if entrada.message_id:
+        return f"id:{entrada.message_id}"
+    if not entrada.momento:
+        return None
+    return "h:" + hashlib.sha1(f"{entrada.numero}|{entrada.texto}|{entrada.momento}".encode()).hexdigest()
+
+
+# ————— Backends —————
+class DedupRedis:
+    """
+    SET NX com TTL: a primeira entrega cria a chave, as repetidas encontram a chave
+    e são descartadas, em qualquer worker.
+    """
+
+    def __init__(self, redis=None, janela: int = DEDUP_JANELA, prefixo: str = DEDUP_PREFIXO):
+        self.redis = redis
+        self.janela = janela
+        self.prefixo = prefixo
+
+    async def marcar(self, chave: str) -> bool:
+        redis = self.redis or sessions.redis_client
+        return bool(await redis.set(self.prefixo + chave, "1", nx=True, ex=self.janela))
+
+    async def esquecer(self, chave: str):
+        await (self.redis or sessions.redis_client).delete(self.prefixo + chave)
+
+
+class DedupMemoria:
+    """
+    Chaves vistas por este processo nos últimos `janela` segundos (nó único).
+    Guarda só um hash de 8 bytes por chave, em ordem de chegada: expirar é retirar
+    do início. Não é um filtro de Bloom porque um falso positivo descartaria uma
+    mensagem legítima sem aviso.
+    """
+
+    def __init__(
+        self,
+        janela: int = DEDUP_JANELA,
+        maximo: int = DEDUP_MEMORIA_MAX,
+        relogio: Callable[[], float] = time.monotonic,
+    ):
+        self.janela = janela
+        self.maximo = maximo
+        self.relogio = relogio
+        self._vistas: dict[int, float] = {}  # hash → expiração
+
+    @staticmethod
+    def _hash(chave: str) -> int:
+        return int.from_bytes(hashlib.blake2b(chave.encode(), digest_size=8).digest(), "big")
+
+    def _expirar(self, agora: float):
+        while self._vistas:
+            h, expira = next(iter(self._vistas.items()))
+            if expira > agora and len(self._vistas) <= self.maximo:
+                break
+            del self._vistas[h]
+
+    async def marcar(self, chave: str) -> bool:
+        agora = self.relogio()
+        self._expirar(agora)
+        h = self._hash(chave)
+        if h in self._vistas:
+            return False
+        self._vistas[h] = agora + self.janela
+        return True
+
+    async def esquecer(self, chave: str):
+        self._vistas.pop(self._hash(chave), None)
+
+    def __len__(self) -> int:
+        return len(self._vistas)
+
+
+class DeduplicadorMensagens:
+    """
+    Filtro de entregas repetidas do webhook.
+    - `nova` marca a chave e diz se é a primeira entrega
+    - `esquecer` desfaz a marca quando o processamento falha, para o reenvio do
+      provedor ser processado
+    - Se o backend falhar (Redis fora), a mensagem segue: melhor responder duas
+      vezes que perder uma mensagem
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.metricas = {"recebidas": 0, "duplicadas": 0, "sem_chave": 0, "falhas": 0}
+
+    async def nova(self, chave: Optional[str]) -> bool:
+        self.metricas["recebidas"] += 1
+        if chave is None:
+            self.metricas["sem_chave"] += 1
+            return True
+        try:
+            if await self.backend.marcar(chave):
+                return True
+        except Exception as e:
+            self.metricas["falhas"] += 1
+            log_event("❌ Erro no dedup do webhook", {"chave": chave, "error": str(e)})
+            return True
+        self.metricas["duplicadas"] += 1
+        log_event("🔁 Entrega repetida descartada", {"chave": chave})
+        return False
+
+    async def esquecer(self, chave: Optional[str]):
+        if chave is None:
+            return
+        try:
+            await self.backend.esquecer(chave)
+        except Exception as e:
+            log_event("❌ Erro no dedup do webhook", {"chave": chave, "error": str(e)})
+
+
+def criar_backend_dedup():
+    if DEDUP_BACKEND == "memoria":
+        return DedupMemoria()
+    return DedupRedis()
+
+
+_deduplicador = DeduplicadorMensagens(criar_backend_dedup())
+
+
+def get_deduplicador() -> Optional[DeduplicadorMensagens]:
+    """
+    Deduplicador global do processo, ou None quando desligado (DEDUP_ATIVO=0).
+    """
+    return _deduplicador if DEDUP_ATIVO else None
@@ -1,13 +1,25 @@
 import os
 import re
+import time
+from typing import Optional
 
 from core.sessions import load_session, append_message, save_session
 from services.intent import detectar_intencao
 from services.scheduler import processar_agendamento
-from services.llm import get_ollama_llm
+from services.llm import ainvoke, astream
+from services.prompt_builder import (
+    PROMPT_TURNOS_RECENTES,
+    SYSTEM_PROMPT,
+    agendar_atualizacao_resumo,
+    montar_prompt,
+)
 from services.memory import get_memory_for_user
+from services.response_cache import contexto_vazio, get_cache_respostas
 from langchain.schema import HumanMessage
-from services.scheduler import processar_agendamento
+from services.coalescer import get_coalescedor
+from services.streaming import LLM_STREAMING, STREAM_DIGITANDO_S, Enviar, tentar_enviar, transmitir_resposta
+from utils.zapi import agendar_envio_zapi, enviar_mensagem_zapi
+from utils.logger import log_event, nova_correlacao
 
 MOCK_OPENAI = os.getenv("MOCK_OPENAI", "0") == "1"
 
@@ -19,11 +31,7 @@ def build_multi_turn_prompt(session_history: list) -> list:
     messages = [
         {
             "role": "system",
-            "content": (
-                "Você é a NORA, uma assistente empática e precisa. "
-                "Ajude os leads no processo de agendamento, escolha de produtos e esclarecimento de dúvidas, "
-                "sempre mantendo um tom humano, acolhedor e objetivo."
-            )
+            "content": SYSTEM_PROMPT
         }
     ]
 
@@ -37,11 +45,17 @@ def build_multi_turn_prompt(session_history: list) -> list:
     return messages
 
 
-async def gerar_resposta_fallback(phone_number: str, user_message: str) -> str:
+async def gerar_resposta_fallback(
+    phone_number: str, user_message: str, enviar_fragmento: Optional[Enviar] = None
+) -> str:
     """
     Gera uma resposta fallback usando LLaMA local.
-    - Carrega histórico da sessão do Supabase
-    - Atualiza histórico com a mensagem do usuário
+    - Com `enviar_fragmento`, transmite a resposta em fragmentos (frases/parágrafos)
+      à medida que o modelo gera
+    - Carrega resumo + turnos recentes da sessão no Redis
+    - Responde do cache quando a pergunta (ou uma muito parecida) já foi respondida
+      e a conversa ainda não tem contexto (resumo ou turnos anteriores)
+    - Monta o prompt dentro do orçamento de tokens (services/prompt_builder)
     - Gera resposta com LLaMA
     - Salva resposta no histórico
     - Suporta MOCK_OPENAI=1 para testes
@@ -52,43 +66,53 @@ async def gerar_resposta_fallback(phone_number: str, user_message: str) -> str:
         await append_message(phone_number, "assistant", mock_response)
         return mock_response
 
-    # 2) Carrega sessão/histórico
-    session = await load_session(phone_number)
+    # 2) Carrega metadados (com o resumo) e só a janela recente do histórico
+    session = await load_session(phone_number, history_limit=PROMPT_TURNOS_RECENTES * 3)
     session_history = session.get("history", [])
 
-    # 3) Inicializa o LLaMA local
-    llm = get_ollama_llm()
-
-    # 4) Monta o prompt a partir do histórico + nova mensagem
-    # Aqui você pode adaptar conforme o que LLaMA espera
-    # Exemplo: lista de mensagens concatenadas
-    prompt = ""
-    for msg in session_history:
-        role = msg.get("role", "user")
-        content = msg.get("content", "")
-        prompt += f"{role}: {content}\n"
-    prompt += f"user: {user_message}\nassistant:"
-
-    # 5) Gera resposta com LLaMA (chamada síncrona)
-    # Se estiver usando a versão async, adapte removendo await
-    resposta = llm.invoke(prompt)  # invoke retorna str
-
-    # 6) Atualiza histórico no Supabase
+    # 3) Perguntas frequentes: reaproveita a resposta do cache sem chamar o LLM
+    #    (só sem resumo nem turnos anteriores: a resposta não depende de quem pergunta)
+    cache = get_cache_respostas()
+    if cache is not None and not contexto_vazio(session, session_history, user_message):
+        cache = None
+    resposta = cache.buscar(user_message, session) if cache is not None else None
+    if resposta is not None:
+        if enviar_fragmento is not None:
+            await tentar_enviar(enviar_fragmento, phone_number, resposta)
+        await append_message(phone_number, "assistant", resposta)
+        return resposta
+
+    # 4) Monta o prompt dentro do orçamento de tokens: sistema + resumo + últimos turnos + mensagem
+    prompt = montar_prompt(session, session_history, user_message)
+
+    # 5) Gera resposta com LLaMA via gateway (assíncrono, com limite de gerações simultâneas)
+    inicio = time.monotonic()
+    if enviar_fragmento is not None:
+        resposta = await transmitir_resposta(phone_number, astream(prompt), enviar_fragmento)
+    else:
+        resposta = await ainvoke(prompt)
+    if cache is not None:
+        cache.guardar(user_message, session, resposta, custo_s=time.monotonic() - inicio)
+
+    # 6) Atualiza histórico da sessão e, em segundo plano, o resumo dos turnos antigos
     await append_message(phone_number, "assistant", resposta)
+    agendar_atualizacao_resumo(phone_number, session)
 
     return resposta
 
 
-async def handle_message(phone_number: str, user_message: str, payload: dict) -> dict | str:
+async def handle_message(
+    phone_number: str, user_message: str, payload: dict, enviar_fragmento: Optional[Enviar] = None
+) -> dict | str:
     """
     Roteia mensagens:
     - captura data/horário
     - detecta intenção
     - para 'agendar', chama scheduler
-    - senão, fallback LLaMA
+    - senão, fallback LLaMA (em streaming, se `enviar_fragmento` for informado)
     """
-    # 1️⃣ Carrega e atualiza histórico da sessão
-    session = await load_session(phone_number)
+    # 1️⃣ Carrega os metadados da sessão e grava a mensagem no histórico
+    session = await load_session(phone_number, history_limit=0)
     await append_message(phone_number, "user", user_message)
 
     # 2️⃣ Captura data e horário padrão se presentes
@@ -124,6 +148,67 @@ async def handle_message(phone_number: str, user_message: str, payload: dict) ->
         return resultado
 
     # 5️⃣ Fluxo padrão via LLaMA local
-    resposta_llama = await gerar_resposta_fallback(phone_number, user_message)
+    resposta_llama = await gerar_resposta_fallback(phone_number, user_message, enviar_fragmento)
     return resposta_llama
 
+
+async def responder_mensagem(
+    phone_number: str, user_message: str, payload: dict, aguardar_envio: bool = False
+) -> str:
+    """
+    Processa a mensagem e envia a resposta pela Z-API.
+    - aguardar_envio=False → envio em segundo plano (webhook síncrono)
+    - aguardar_envio=True  → aguarda o envio, preservando a ordem das respostas (workers da fila)
+    Com LLM_STREAMING=1, respostas do LLM saem em fragmentos durante a geração.
+    Retorna o texto enviado.
+    """
+    fragmentos_enviados: list[str] = []
+
+    async def enviar_fragmento(numero: str, texto: str):
+        fragmentos_enviados.append(texto)
+        await enviar_mensagem_zapi(numero, texto, delay_typing=STREAM_DIGITANDO_S)
+
+    resposta = await handle_message(
+        phone_number, user_message, payload, enviar_fragmento if LLM_STREAMING else None
+    )
+
+    if isinstance(resposta, dict):
+        conteudo = resposta.get("mensagem", "")
+    else:
+        conteudo = str(resposta)
+
+    # Já entregue em fragmentos durante o streaming
+    if fragmentos_enviados:
+        return conteudo
+
+    if not aguardar_envio:
+        agendar_envio_zapi(phone_number, conteudo)
+        return conteudo
+
+    try:
+        await enviar_mensagem_zapi(phone_number, conteudo)
+    except Exception as e:
+        log_event("❌ Erro ao enviar Z-API", {"error": str(e), "body": {"phone": phone_number, "message": conteudo}})
+    return conteudo
+
+
+async def responder_turno_agrupado(phone_number: str, user_message: str, payload: dict) -> str:
+    """
+    Handler do coalescedor: recebe as mensagens da rajada já unidas em um turno.
+    """
+    nova_correlacao(payload.get("correlacao"))
+    return await responder_mensagem(phone_number, user_message, payload, aguardar_envio=True)
+
+
+async def responder_mensagem_da_fila(phone_number: str, user_message: str, payload: dict):
+    """
+    Handler dos workers da fila de ingestão.
+    Com o agrupamento ligado, só entrega a mensagem ao coalescedor (sem aguardar a
+    janela, para não segurar o worker).
+    """
+    nova_correlacao(payload.get("correlacao"))
+    coalescedor = get_coalescedor()
+    if coalescedor is not None:
+        coalescedor.adicionar(phone_number, user_message, payload)
+        return
+    await responder_mensagem(phone_number, user_message, payload, aguardar_envio=True)
@@ -0,0 +1,106 @@
+# services/hold_sweeper.py
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Optional
+
+from services import slot_inventory
+from utils.logger import log_event
+
+# ————— Configuração —————
+# Intervalo entre varreduras das reservas preliminares vencidas. 0 desliga o varredor
+# (as vencidas ainda voltam ao estoque na próxima operação, mas ninguém é avisado).
+SLOT_VARREDURA = float(os.getenv("SLOT_VARREDURA_MS", "1000")) / 1000
+# Quantas vencidas cada chamada ao Redis retira (várias chamadas por varredura se preciso)
+SLOT_VARREDURA_LOTE = int(os.getenv("SLOT_VARREDURA_LOTE", "500"))
+
+# (lead, data, horário) → aviso ao lead / cancelamento do link de pagamento
+Notificar = Callable[[str, str, str], Awaitable[object]]
+
+
+class VarredorReservas:
+    """
+    Devolve ao estoque as reservas preliminares não pagas e avisa os leads.
+    - As expirações vivem no Redis (sorted set por vencimento, compartilhado pelos
+      workers): cada varredura lê só o que venceu, então o custo por tick não depende
+      de quantas reservas estão pendentes
+    - Cada vencida é entregue a um único worker, mesmo com vários varrendo
+    - Falha ao notificar um lead não interrompe a varredura
+    """
+
+    def __init__(
+        self,
+        notificar: Notificar,
+        intervalo: float = SLOT_VARREDURA,
+        lote: int = SLOT_VARREDURA_LOTE,
+    ):
+        self.notificar = notificar
+        self.intervalo = intervalo
+        self.lote = lote
+        self._loop_task: Optional[asyncio.Task] = None
+        self.metricas = {"varreduras": 0, "expiradas": 0, "falhas": 0}
+
+    async def varrer(self) -> int:
+        """
+        Processa todas as reservas vencidas até agora. Retorna quantas expiraram.
+        """
+        self.metricas["varreduras"] += 1
+        total = 0
+        while True:
+            vencidas = await slot_inventory.expirar_vencidas(self.lote)
+            resultados = await asyncio.gather(
+                *(self.notificar(lead, data, horario) for data, horario, lead in vencidas),
+                return_exceptions=True,
+            )
+            for (data, horario, lead), resultado in zip(vencidas, resultados):
+                if isinstance(resultado, Exception):
+                    self.metricas["falhas"] += 1
+                    log_event("❌ Erro ao notificar reserva expirada", {
+                        "lead": lead, "data": data, "horario": horario, "error": str(resultado),
+                    })
+            total += len(vencidas)
+            if len(vencidas) < self.lote:
+                break
+        self.metricas["expiradas"] += total
+        return total
+
+    async def _executar(self):
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await self.varrer()
+            except Exception as e:
+                log_event("❌ Erro na varredura de reservas", {"error": str(e)})
+
+    def iniciar(self):
+        self._loop_task = asyncio.create_task(self._executar())
+
+    async def parar(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            await asyncio.gather(self._loop_task, return_exceptions=True)
+            self._loop_task = None
+
+
+_varredor: Optional[VarredorReservas] = None
+
+
+def iniciar_varredor_reservas(notificar: Notificar) -> VarredorReservas:
+    global _varredor
+    _varredor = VarredorReservas(notificar)
+    _varredor.iniciar()
+    return _varredor
+
+
+async def parar_varredor_reservas():
+    global _varredor
+    if _varredor is not None:
+        await _varredor.parar()
+    _varredor = None
+
+
+def get_varredor_reservas() -> Optional[VarredorReservas]:
+    """
+    Retorna o varredor ativo, ou None quando desligado (SLOT_VARREDURA_MS=0).
+    """
+    return _varredor
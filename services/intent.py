@@ -1,4 +1,10 @@
+import os
 import re
+import unicodedata
+from functools import lru_cache
+from typing import Iterable
+
+from utils.metrics import cronometrar
 
 # Mapeamento robusto de intenções para palavras-chave (30+ variações cada)
 INTENT_KEYWORDS = {
@@ -31,18 +37,106 @@ INTENT_KEYWORDS = {
     ]
 }
 
+
+def normalizar_texto(texto: str) -> str:
+    """
+    Minúsculas, sem acentos/diacríticos e com espaços colapsados
+    ("Horário  DISPONÍVEL" → "horario disponivel").
+    """
+    texto = unicodedata.normalize("NFKD", texto.lower())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    return " ".join(texto.split())
+
+
+def _compilar(intent_keywords: dict[str, list[str]]) -> tuple[re.Pattern, dict[str, tuple[str, ...]]]:
+    """
+    Junta todas as keywords (normalizadas) em uma única regex de alternância.
+    As mais longas vêm primeiro, então "cancelar consulta" vence "consulta"
+    na mesma posição. Retorna a regex e o mapa keyword → intenções.
+    """
+    mapa: dict[str, list[str]] = {}
+    for intent, keywords in intent_keywords.items():
+        for kw in keywords:
+            intents = mapa.setdefault(normalizar_texto(kw), [])
+            if intent not in intents:
+                intents.append(intent)
+    termos = sorted(mapa, key=len, reverse=True)
+    padrao = re.compile(r"\b(?:" + "|".join(re.escape(t) for t in termos) + r")\b")
+    return padrao, {kw: tuple(intents) for kw, intents in mapa.items()}
+
+
+_PADRAO, _KEYWORD_INTENTS = _compilar(INTENT_KEYWORDS)
+_ORDEM = {intent: i for i, intent in enumerate(INTENT_KEYWORDS)}
+
+# Mensagens prontas ("quero agendar", "quanto custa") se repetem muito:
+# o resultado é cacheado pelo texto normalizado
+INTENT_CACHE_SIZE = int(os.getenv("INTENT_CACHE_SIZE", "4096"))
+
+
+@lru_cache(maxsize=INTENT_CACHE_SIZE)
+def _classificar(texto_normalizado: str) -> tuple[tuple[str, int], ...]:
+    scores: dict[str, int] = {}
+    for match in _PADRAO.finditer(texto_normalizado):
+        kw = match.group()
+        peso = kw.count(" ") + 1
+        for intent in _KEYWORD_INTENTS[kw]:
+            scores[intent] = scores.get(intent, 0) + peso
+    return tuple(sorted(scores.items(), key=lambda item: (-item[1], _ORDEM[item[0]])))
+
+
+def detectar_intencoes(mensagem: str) -> dict[str, int]:
+    """
+    Pontua todas as intenções em uma única passada sobre a mensagem.
+    Cada keyword encontrada soma o seu número de palavras (frases mais
+    específicas pesam mais). Retorna {intenção: score}, do maior para o menor;
+    vazio se nada for encontrado.
+    """
+    return dict(_classificar(normalizar_texto(mensagem)))
+
+
 # Intenção padrão quando nenhuma keyword for encontrada
+@cronometrar("intencao")
 def detectar_intencao(mensagem: str) -> str:
     """
-    Analisa a mensagem do usuário e retorna a intenção detectada.
+    Analisa a mensagem do usuário e retorna a intenção de maior score.
     Retorna:
         - chave da intenção (ex.: "agendar", "preco", "cancelar")
         - "nenhuma" caso nenhuma intenção seja encontrada
+    Em empate, vale a ordem de INTENT_KEYWORDS.
     """
-    texto = mensagem.lower()
-    # Itera pelas intenções e verifica se alguma keyword aparece na mensagem
-    for intent, keywords in INTENT_KEYWORDS.items():
-        for kw in keywords:
-            if re.search(r"\b" + re.escape(kw) + r"\b", texto):
-                return intent
-    return "nenhuma"
+    scores = detectar_intencoes(mensagem)
+    return next(iter(scores), "nenhuma")
+
+
+def detectar_intencoes_em_lote(mensagens: Iterable[str]) -> list[str]:
+    """
+    Classifica várias mensagens de uma vez (reprocessamento offline de sessões).
+    Usa o mesmo classificador e cache do webhook; textos repetidos no lote
+    são normalizados e classificados uma única vez.
+    """
+    vistos: dict[str, str] = {}
+    resultado = []
+    for mensagem in mensagens:
+        if mensagem not in vistos:
+            vistos[mensagem] = detectar_intencao(mensagem)
+        resultado.append(vistos[mensagem])
+    return resultado
+
+
+def estatisticas_cache_intencao() -> dict:
+    """
+    Acertos, faltas e taxa de acerto do cache de intenções deste processo.
+    """
+    info = _classificar.cache_info()
+    consultas = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "tamanho": info.currsize,
+        "max": info.maxsize,
+        "taxa_acerto": (info.hits / consultas) if consultas else 0.0,
+    }
+
+
+def limpar_cache_intencao():
+    _classificar.cache_clear()
@@ -1,12 +1,109 @@
+# services/llm.py
+
+import asyncio
+import json
 import os
+import time
+from typing import AsyncIterator, Optional
+
 from langchain_ollama import OllamaLLM
 
+from utils.metrics import medir, registrar_geracao
+
+# Máximo de gerações simultâneas no Ollama (as demais aguardam na fila do semáforo)
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "2"))
+
+_clientes: dict[tuple, OllamaLLM] = {}
+_semaforo: Optional[asyncio.Semaphore] = None
+_semaforo_loop: Optional[asyncio.AbstractEventLoop] = None
+_estado = {"em_voo": 0, "aguardando": 0, "geracoes": 0}
+
 
-def get_ollama_llm():
+def get_ollama_llm(model: Optional[str] = None, base_url: Optional[str] = None, **opcoes) -> OllamaLLM:
     '''
-    Retorna uma instância do Ollama com o modelo e URL configurados.
+    Retorna a instância compartilhada do Ollama para o modelo/URL (e opções) informados.
+    Cada instância mantém seu próprio pool de conexões HTTP, reaproveitado entre chamadas.
     '''
-    return OllamaLLM(
-        model=os.getenv("LLM_MODEL", "gemma:2b"),
-        base_url=os.getenv("OLLAMA_URL", "http://localhost:11434"),
-    )
\ No newline at end of file
+    model = model or os.getenv("LLM_MODEL", "gemma:2b")
+    base_url = base_url or os.getenv("OLLAMA_URL", "http://localhost:11434")
+    chave = (model, base_url, json.dumps(opcoes, sort_keys=True, default=str))
+    if chave not in _clientes:
+        _clientes[chave] = OllamaLLM(model=model, base_url=base_url, **opcoes)
+    return _clientes[chave]
+
+
+def _get_semaforo() -> asyncio.Semaphore:
+    global _semaforo, _semaforo_loop
+    loop = asyncio.get_running_loop()
+    if _semaforo is None or _semaforo_loop is not loop:
+        _semaforo = asyncio.Semaphore(LLM_MAX_INFLIGHT)
+        _semaforo_loop = loop
+    return _semaforo
+
+
+class _Vaga:
+    """
+    Ocupa uma das LLM_MAX_INFLIGHT vagas de geração, contabilizando a espera.
+    """
+
+    async def __aenter__(self):
+        self.semaforo = _get_semaforo()
+        _estado["aguardando"] += 1
+        try:
+            await self.semaforo.acquire()
+        finally:
+            _estado["aguardando"] -= 1
+        _estado["em_voo"] += 1
+        _estado["geracoes"] += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        _estado["em_voo"] -= 1
+        self.semaforo.release()
+
+
+async def ainvoke(prompt: str, model: Optional[str] = None, base_url: Optional[str] = None, **opcoes) -> str:
+    """
+    Gera a resposta completa sem bloquear o event loop.
+    """
+    llm = get_ollama_llm(model, base_url, **opcoes)
+    async with _Vaga():
+        inicio = time.perf_counter()
+        with medir("llm", "ainvoke"):
+            resposta = str(await llm.ainvoke(prompt))
+        # Sem stream não há contagem de tokens: estimativa de ~4 caracteres por token
+        registrar_geracao("ainvoke", max(1, len(resposta) // 4), time.perf_counter() - inicio)
+    return resposta
+
+
+async def astream(
+    prompt: str, model: Optional[str] = None, base_url: Optional[str] = None, **opcoes
+) -> AsyncIterator[str]:
+    """
+    Gera a resposta em trechos (tokens) à medida que o modelo produz.
+    A vaga de geração fica ocupada até o fim do stream.
+    """
+    llm = get_ollama_llm(model, base_url, **opcoes)
+    async with _Vaga():
+        inicio = time.perf_counter()
+        trechos = 0
+        with medir("llm", "astream"):
+            async for trecho in llm.astream(prompt):
+                trechos += bool(trecho)
+                yield trecho
+        # O Ollama entrega um token por trecho (o trecho final, de encerramento, vem vazio)
+        registrar_geracao("astream", trechos, time.perf_counter() - inicio)
+
+
+def estatisticas_llm() -> dict:
+    """
+    Gerações em andamento, aguardando vaga e total desde o início do processo.
+    """
+    return {"max_em_voo": LLM_MAX_INFLIGHT, "clientes": len(_clientes), **_estado}
+
+
+def limpar_clientes_llm():
+    """
+    Descarta as instâncias em cache (troca de configuração e testes).
+    """
+    _clientes.clear()
@@ -1,34 +1,227 @@
+# services/memory.py
+
+import asyncio
+import json
+import os
+import resource
+import time
+from collections import OrderedDict
+from typing import Optional
+
 from langchain.memory import ConversationBufferMemory
 from langchain.schema import messages_from_dict, messages_to_dict
 
-_user_memories = {}
+from core import sessions
+from utils.logger import log_event
+
+# ————— Limites da memória em processo —————
+MEMORY_MAX_USERS = int(os.getenv("MEMORY_MAX_USERS", "1000"))        # LRU: usuários mantidos
+MEMORY_TTL = int(os.getenv("MEMORY_TTL", str(60 * 60)))              # segundos sem acesso até expirar
+MEMORY_MAX_MESSAGES = int(os.getenv("MEMORY_MAX_MESSAGES", "20"))    # janela de mensagens por usuário
+# Ao despejar, grava a memória no Redis para restaurar depois (obter_memoria)
+MEMORY_SPILL_REDIS = os.getenv("MEMORY_SPILL_REDIS", "0") == "1"
+MEMORY_SPILL_TTL = int(os.getenv("MEMORY_SPILL_TTL", str(24 * 60 * 60)))
+# Intervalo da descarga periódica para o Redis (iniciada no lifespan do app)
+MEMORY_SPILL_INTERVALO = float(os.getenv("MEMORY_SPILL_INTERVALO_MS", "2000")) / 1000
+# Teto de memórias despejadas aguardando a descarga (acima disso as mais antigas são descartadas)
+MEMORY_SPILL_MAX_PENDENTES = int(os.getenv("MEMORY_SPILL_MAX_PENDENTES", "1000"))
+
+# phone → (memória, último acesso); a ordem do OrderedDict é a ordem de uso (LRU)
+_user_memories: "OrderedDict[str, tuple[ConversationBufferMemory, float]]" = OrderedDict()
+# Memórias despejadas aguardando gravação no Redis (ordem de despejo: a primeira é a mais antiga)
+_spill_pendente: dict[str, list] = {}
+_descarga_task: Optional[asyncio.Task] = None
+_stats = {
+    "hits": 0, "misses": 0, "despejos_lru": 0, "despejos_ttl": 0, "restauradas": 0, "spill_descartados": 0,
+}
+
+
+def _agora() -> float:
+    return time.monotonic()
+
+
+def get_memory_key(phone_number: str) -> str:
+    return f"memory:{phone_number}"
+
+
+def _despejar(phone_number: str, motivo: str):
+    mem, _ = _user_memories.pop(phone_number)
+    _stats[motivo] += 1
+    if MEMORY_SPILL_REDIS and mem.chat_memory.messages:
+        _guardar_spill(phone_number, messages_to_dict(mem.chat_memory.messages))
+
+
+def _guardar_spill(phone_number: str, mensagens: list):
+    _spill_pendente.pop(phone_number, None)
+    _spill_pendente[phone_number] = mensagens
+    while len(_spill_pendente) > MEMORY_SPILL_MAX_PENDENTES:
+        del _spill_pendente[next(iter(_spill_pendente))]
+        _stats["spill_descartados"] += 1
+
+
+def _expirar(agora: float):
+    # Do menos para o mais recente: para no primeiro que ainda está válido
+    while _user_memories:
+        phone_number, (_, ultimo_acesso) = next(iter(_user_memories.items()))
+        if agora - ultimo_acesso < MEMORY_TTL:
+            break
+        _despejar(phone_number, "despejos_ttl")
+
+
+def _aparar(mem: ConversationBufferMemory):
+    mensagens = mem.chat_memory.messages
+    if len(mensagens) > MEMORY_MAX_MESSAGES:
+        mem.chat_memory.messages = mensagens[-MEMORY_MAX_MESSAGES:]
+
 
 def get_memory_for_user(phone_number: str) -> ConversationBufferMemory:
     '''
     Retorna a memória de um usuário, criando uma nova se necessário.
+    - Expira memórias sem acesso há mais de MEMORY_TTL
+    - Mantém no máximo MEMORY_MAX_USERS usuários (despeja o menos usado)
+    - Limita cada memória às últimas MEMORY_MAX_MESSAGES mensagens
     '''
-    if phone_number not in _user_memories:
-        _user_memories[phone_number] = ConversationBufferMemory(
+    agora = _agora()
+    _expirar(agora)
+
+    if phone_number in _user_memories:
+        _stats["hits"] += 1
+        mem, _ = _user_memories[phone_number]
+        _user_memories.move_to_end(phone_number)
+    else:
+        _stats["misses"] += 1
+        mem = ConversationBufferMemory(
             # memory_key="chat_history",
             return_messages=True
         )
-    return _user_memories[phone_number]
+        # Despejada há pouco e ainda não gravada no Redis: volta direto
+        if phone_number in _spill_pendente:
+            mem.chat_memory.messages = messages_from_dict(_spill_pendente.pop(phone_number))
+            _stats["restauradas"] += 1
+        while len(_user_memories) >= MEMORY_MAX_USERS:
+            _despejar(next(iter(_user_memories)), "despejos_lru")
 
-def export_memory(phone_number: str) -> dict:
+    _user_memories[phone_number] = (mem, agora)
+    _aparar(mem)
+    return mem
+
+
+def export_memory(phone_number: str) -> list:
     """
     Exporta a memória de um usuário para JSON.
     """
-    get_mem = _user_memories.get(phone_number)
-    if get_mem:
-        return messages_to_dict(get_mem.messages)
+    item = _user_memories.get(phone_number)
+    if item:
+        return messages_to_dict(item[0].chat_memory.messages)
     return []
 
 
-def import_memory(phone_number: str, memory: dict):
+def import_memory(phone_number: str, memory: list):
     """
     Importa a memória de um usuário a partir de um JSON.
     """
     mem = get_memory_for_user(phone_number)
     mem.chat_memory.messages = messages_from_dict(memory)
-        
-    
\ No newline at end of file
+    _aparar(mem)
+
+
+async def descarregar_memorias():
+    """
+    Grava no Redis (com TTL) as memórias despejadas desde a última chamada.
+    """
+    if not _spill_pendente:
+        return
+    pendentes = dict(_spill_pendente)
+    _spill_pendente.clear()
+    try:
+        async with sessions.redis_client.pipeline(transaction=False) as pipe:
+            for phone_number, mensagens in pendentes.items():
+                pipe.setex(get_memory_key(phone_number), MEMORY_SPILL_TTL, json.dumps(mensagens))
+            await pipe.execute()
+    except Exception:
+        # Volta para a fila (antes das despejadas durante a gravação, que são mais recentes)
+        recentes = dict(_spill_pendente)
+        _spill_pendente.clear()
+        for phone_number, mensagens in pendentes.items():
+            if phone_number not in recentes:
+                _guardar_spill(phone_number, mensagens)
+        for phone_number, mensagens in recentes.items():
+            _guardar_spill(phone_number, mensagens)
+        raise
+
+
+async def _descarregar_periodicamente():
+    while True:
+        await asyncio.sleep(MEMORY_SPILL_INTERVALO)
+        try:
+            await descarregar_memorias()
+        except Exception as e:
+            log_event("❌ Erro ao descarregar memórias no Redis", {"error": str(e)})
+
+
+def iniciar_descarga_memorias():
+    """
+    Inicia a descarga periódica das memórias despejadas (MEMORY_SPILL_REDIS=1).
+    """
+    global _descarga_task
+    _descarga_task = asyncio.create_task(_descarregar_periodicamente())
+
+
+async def parar_descarga_memorias():
+    """
+    Para a descarga periódica e grava o que ainda estiver pendente.
+    """
+    global _descarga_task
+    if _descarga_task is not None:
+        _descarga_task.cancel()
+        await asyncio.gather(_descarga_task, return_exceptions=True)
+        _descarga_task = None
+    try:
+        await descarregar_memorias()
+    except Exception as e:
+        log_event("❌ Erro ao descarregar memórias no Redis", {"error": str(e)})
+
+
+async def obter_memoria(phone_number: str) -> ConversationBufferMemory:
+    """
+    Versão assíncrona de get_memory_for_user com spill para o Redis:
+    restaura a memória gravada se o usuário não estiver em memória e
+    grava as memórias despejadas pendentes.
+    """
+    if MEMORY_SPILL_REDIS and phone_number not in _user_memories and phone_number not in _spill_pendente:
+        salva = await sessions.redis_client.get(get_memory_key(phone_number))
+        if salva:
+            import_memory(phone_number, json.loads(salva))
+            _stats["restauradas"] += 1
+    mem = get_memory_for_user(phone_number)
+    if MEMORY_SPILL_REDIS:
+        await descarregar_memorias()
+    return mem
+
+
+def estatisticas_memoria() -> dict:
+    """
+    Uso da memória de conversas neste processo (usuários, mensagens, tamanho
+    aproximado do conteúdo, despejos) e RSS do processo.
+    """
+    mensagens = 0
+    bytes_conteudo = 0
+    for mem, _ in _user_memories.values():
+        mensagens += len(mem.chat_memory.messages)
+        bytes_conteudo += sum(len(str(m.content)) for m in mem.chat_memory.messages)
+    return {
+        "usuarios": len(_user_memories),
+        "max_usuarios": MEMORY_MAX_USERS,
+        "mensagens": mensagens,
+        "bytes_conteudo": bytes_conteudo,
+        "spill_pendente": len(_spill_pendente),
+        "rss_max_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        **_stats,
+    }
+
+
+def limpar_memorias():
+    _user_memories.clear()
+    _spill_pendente.clear()
+    for chave in _stats:
+        _stats[chave] = 0
@@ -0,0 +1,363 @@
+# services/message_queue.py
+
+import asyncio
+import json
+import os
+import socket
+import time
+import zlib
+from dataclasses import dataclass, asdict, field
+from typing import Awaitable, Callable, Optional
+
+from utils.logger import log_event
+
+# ————— Configuração da ingestão —————
+# ZAPI_INGESTAO=sync → webhook processa e responde na mesma requisição (padrão)
+# ZAPI_INGESTAO=fila → webhook só enfileira; workers processam em segundo plano
+FILA_ATIVA = os.getenv("ZAPI_INGESTAO", "sync") == "fila"
+FILA_BACKEND = os.getenv("FILA_BACKEND", "memoria")  # memoria | redis
+FILA_WORKERS = int(os.getenv("FILA_WORKERS", "8"))
+FILA_STREAM = os.getenv("FILA_STREAM", "zapi:entrada")
+FILA_GRUPO = os.getenv("FILA_GRUPO", "nora")
+FILA_BLOQUEIO_MS = int(os.getenv("FILA_BLOQUEIO_MS", "1000"))  # BLOCK do XREADGROUP; 0 = leitura sem bloqueio
+# Posse de cada shard (Redis): um único processo consome o shard por vez; sem renovação
+# (processo caiu) outro assume depois deste prazo
+FILA_POSSE_MS = int(os.getenv("FILA_POSSE_MS", "15000"))
+# Pausa do worker depois de um erro do backend (dobra a cada erro seguido, até o máximo)
+FILA_ERRO_PAUSA_S = float(os.getenv("FILA_ERRO_PAUSA_S", "0.1"))
+FILA_ERRO_PAUSA_MAX_S = float(os.getenv("FILA_ERRO_PAUSA_MAX_S", "5"))
+
+Handler = Callable[[str, str, dict], Awaitable[object]]
+
+
+@dataclass
+class ItemFila:
+    numero: str
+    texto: str
+    payload: dict
+    enfileirado_em: float = field(default_factory=time.time)
+
+
+@dataclass
+class MetricasFila:
+    enfileiradas: int = 0
+    processadas: int = 0
+    falhas: int = 0
+    erros_backend: int = 0
+    espera_total_s: float = 0.0
+    espera_max_s: float = 0.0
+
+    def registrar_espera(self, espera: float):
+        self.processadas += 1
+        self.espera_total_s += espera
+        self.espera_max_s = max(self.espera_max_s, espera)
+
+
+# ————— Backends —————
+class BackendMemoria:
+    """
+    Uma asyncio.Queue por shard. Não sobrevive a restart; ideal para nó único.
+    """
+
+    def __init__(self, shards: int):
+        self._filas = [asyncio.Queue() for _ in range(shards)]
+
+    async def publicar(self, shard: int, item: ItemFila):
+        await self._filas[shard].put(item)
+
+    async def consumir(self, shard: int) -> tuple[ItemFila, object]:
+        return await self._filas[shard].get(), None
+
+    async def confirmar(self, shard: int, token: object):
+        self._filas[shard].task_done()
+
+    async def profundidade(self) -> list[int]:
+        return [f.qsize() for f in self._filas]
+
+
+# Renova a posse só se ela ainda é deste processo
+_RENOVAR_POSSE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# Devolve a posse só se ela ainda é deste processo
+_SOLTAR_POSSE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class BackendRedisStream:
+    """
+    Um Redis Stream por shard, consumido via consumer group.
+    Vários processos (workers do uvicorn) podem rodar a fila: cada shard tem um
+    dono por vez (chave {prefixo}:dono:{shard} com prazo, renovada em segundo
+    plano), e só o dono lê o shard, mantendo a ordem por telefone. Quem assume um
+    shard (dono anterior caiu) reivindica as mensagens que ficaram sem confirmação.
+    """
+
+    def __init__(
+        self,
+        redis,
+        shards: int,
+        prefixo: str = FILA_STREAM,
+        grupo: str = FILA_GRUPO,
+        bloqueio_ms: int = FILA_BLOQUEIO_MS,
+        posse_ms: int = FILA_POSSE_MS,
+    ):
+        self.redis = redis
+        self.shards = shards
+        self.prefixo = prefixo
+        self.grupo = grupo
+        self.bloqueio_ms = bloqueio_ms or None
+        self.posse_ms = posse_ms
+        self.consumidor = f"{socket.gethostname()}-{os.getpid()}"
+        self._pendentes_lidos: set[int] = set()
+        self._meus: set[int] = set()
+        self._renovacao: Optional[asyncio.Task] = None
+
+    def _stream(self, shard: int) -> str:
+        return f"{self.prefixo}:{shard}"
+
+    def _dono(self, shard: int) -> str:
+        return f"{self.prefixo}:dono:{shard}"
+
+    async def preparar(self):
+        for shard in range(self.shards):
+            try:
+                await self.redis.xgroup_create(self._stream(shard), self.grupo, id="0", mkstream=True)
+            except Exception as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+        self._renovacao = asyncio.create_task(self._renovar_posses())
+
+    async def encerrar(self):
+        """
+        Para a renovação e devolve os shards, para outro processo assumir na hora.
+        """
+        if self._renovacao is not None:
+            self._renovacao.cancel()
+            await asyncio.gather(self._renovacao, return_exceptions=True)
+            self._renovacao = None
+        for shard in list(self._meus):
+            try:
+                await self.redis.eval(_SOLTAR_POSSE, 1, self._dono(shard), self.consumidor)
+            except Exception as e:
+                log_event("❌ Erro ao devolver shard da fila", {"shard": shard, "error": str(e)})
+        self._meus.clear()
+
+    async def _renovar_posses(self):
+        while True:
+            await asyncio.sleep(self.posse_ms / 3000)
+            for shard in list(self._meus):
+                try:
+                    renovada = await self.redis.eval(_RENOVAR_POSSE, 1, self._dono(shard), self.consumidor, self.posse_ms)
+                except Exception as e:
+                    log_event("❌ Erro ao renovar posse do shard", {"shard": shard, "error": str(e)})
+                    continue
+                if not renovada:
+                    self._meus.discard(shard)
+                    log_event("⚠️ Posse do shard perdida", {"shard": shard, "consumidor": self.consumidor})
+
+    async def _assumir(self, shard: int) -> bool:
+        """
+        Tenta virar o dono do shard; ao assumir, traz para si o que o dono anterior
+        leu e não confirmou (será relido antes das mensagens novas).
+        """
+        if shard in self._meus:
+            return True
+        if not await self.redis.set(self._dono(shard), self.consumidor, nx=True, px=self.posse_ms):
+            return False
+        inicio = "0-0"
+        while True:
+            inicio, *_ = await self.redis.xautoclaim(
+                self._stream(shard), self.grupo, self.consumidor, 0, start_id=inicio, count=100
+            )
+            if inicio in ("0-0", b"0-0"):
+                break
+        self._meus.add(shard)
+        self._pendentes_lidos.discard(shard)
+        log_event("🧵 Shard da fila assumido", {"shard": shard, "consumidor": self.consumidor})
+        return True
+
+    async def publicar(self, shard: int, item: ItemFila):
+        await self.redis.xadd(self._stream(shard), {"dados": json.dumps(asdict(item))})
+
+    async def consumir(self, shard: int) -> Optional[tuple[ItemFila, object]]:
+        """
+        Uma leitura do consumer group; None quando não chegou nada no BLOCK (ou o
+        shard é de outro processo).
+        """
+        if not await self._assumir(shard):
+            await asyncio.sleep(min(1.0, self.posse_ms / 3000))
+            return None
+        stream = self._stream(shard)
+        # Primeiro drena o que ficou pendente (de antes do restart ou do dono anterior)
+        inicio = ">" if shard in self._pendentes_lidos else "0"
+        resp = await self.redis.xreadgroup(
+            self.grupo, self.consumidor, {stream: inicio}, count=1, block=self.bloqueio_ms
+        )
+        entradas = resp[0][1] if resp else []
+        if not entradas:
+            if inicio == ">":
+                # Timeout do BLOCK (ou leitura sem bloqueio); a pausa evita laço quente
+                await asyncio.sleep(0.01)
+            self._pendentes_lidos.add(shard)
+            return None
+        msg_id, campos = entradas[0]
+        try:
+            return ItemFila(**json.loads(campos["dados"])), msg_id
+        except (KeyError, TypeError, ValueError) as e:
+            # Entrada malformada: descarta, senão seria relida para sempre
+            log_event("❌ Entrada inválida descartada da fila", {"shard": shard, "id": msg_id, "error": str(e)})
+            await self.confirmar(shard, msg_id)
+            return None
+
+    async def confirmar(self, shard: int, token: object):
+        stream = self._stream(shard)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.xack(stream, self.grupo, token)
+            pipe.xdel(stream, token)
+            await pipe.execute()
+
+    async def profundidade(self) -> list[int]:
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for shard in range(self.shards):
+                pipe.xlen(self._stream(shard))
+            return list(await pipe.execute())
+
+
+# ————— Fila com workers —————
+class FilaMensagens:
+    """
+    Distribui as mensagens em shards pelo telefone (crc32) e roda um worker por
+    shard: mensagens de um mesmo número são processadas em ordem, uma por vez,
+    enquanto números diferentes seguem em paralelo.
+    """
+
+    def __init__(self, handler: Handler, backend, workers: int = FILA_WORKERS):
+        self.handler = handler
+        self.backend = backend
+        self.workers = workers
+        self.metricas = MetricasFila()
+        self._tasks: list[asyncio.Task] = []
+        self._ativa = False
+
+    def shard_de(self, numero: str) -> int:
+        return zlib.crc32(numero.encode()) % self.workers
+
+    async def enfileirar(self, numero: str, texto: str, payload: dict):
+        await self.backend.publicar(self.shard_de(numero), ItemFila(numero, texto, payload))
+        self.metricas.enfileiradas += 1
+
+    async def iniciar(self):
+        if hasattr(self.backend, "preparar"):
+            await self.backend.preparar()
+        self._ativa = True
+        self._tasks = [asyncio.create_task(self._worker(shard)) for shard in range(self.workers)]
+
+    async def parar(self):
+        # Além do cancel: o cliente Redis pode engolir o CancelledError de um
+        # comando em andamento, então o worker também confere a flag a cada volta
+        self._ativa = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if hasattr(self.backend, "encerrar"):
+            await self.backend.encerrar()
+
+    async def _worker(self, shard: int):
+        pausa = FILA_ERRO_PAUSA_S
+        while self._ativa:
+            try:
+                recebido = await self.backend.consumir(shard)
+            except Exception as e:
+                # Redis fora, timeout...: o worker do shard não pode morrer (os números
+                # dele parariam de ser atendidos); espera e tenta de novo
+                pausa = await self._erro_backend("consumir", shard, e, pausa)
+                continue
+            pausa = FILA_ERRO_PAUSA_S
+            if recebido is None:
+                continue
+            item, token = recebido
+            self.metricas.registrar_espera(max(0.0, time.time() - item.enfileirado_em))
+            try:
+                await self.handler(item.numero, item.texto, item.payload)
+            except Exception as e:
+                self.metricas.falhas += 1
+                log_event("❌ Erro ao processar mensagem da fila", {"numero": item.numero, "error": str(e)})
+            try:
+                await self.backend.confirmar(shard, token)
+            except Exception as e:
+                # Sem a confirmação a mensagem é reentregue depois (pelo menos uma vez)
+                pausa = await self._erro_backend("confirmar", shard, e, pausa)
+
+    async def _erro_backend(self, operacao: str, shard: int, erro: Exception, pausa: float) -> float:
+        """
+        Registra o erro do backend e espera; retorna a próxima pausa (backoff).
+        """
+        self.metricas.erros_backend += 1
+        log_event("❌ Erro no backend da fila", {"operacao": operacao, "shard": shard, "error": str(erro)})
+        await asyncio.sleep(pausa)
+        return min(pausa * 2, FILA_ERRO_PAUSA_MAX_S)
+
+    async def snapshot(self) -> dict:
+        """
+        Profundidade por shard e tempos de espera (enfileirada → início do processamento).
+        """
+        profundidade = await self.backend.profundidade()
+        m = self.metricas
+        return {
+            "backend": type(self.backend).__name__,
+            "workers": self.workers,
+            "profundidade": sum(profundidade),
+            "profundidade_por_shard": profundidade,
+            "enfileiradas": m.enfileiradas,
+            "processadas": m.processadas,
+            "falhas": m.falhas,
+            "erros_backend": m.erros_backend,
+            "espera_media_s": (m.espera_total_s / m.processadas) if m.processadas else 0.0,
+            "espera_max_s": m.espera_max_s,
+        }
+
+
+_fila: Optional[FilaMensagens] = None
+
+
+def criar_backend(shards: int = FILA_WORKERS):
+    if FILA_BACKEND == "redis":
+        from core.sessions import REDIS_URL
+        import redis.asyncio as aioredis
+
+        return BackendRedisStream(aioredis.from_url(REDIS_URL, decode_responses=True), shards)
+    return BackendMemoria(shards)
+
+
+async def iniciar_fila(handler: Handler, backend=None) -> FilaMensagens:
+    """
+    Cria a fila global e sobe os workers (chamado no startup do app).
+    """
+    global _fila
+    _fila = FilaMensagens(handler, backend or criar_backend())
+    await _fila.iniciar()
+    log_event("🧵 Fila de mensagens iniciada", {"backend": type(_fila.backend).__name__, "workers": _fila.workers})
+    return _fila
+
+
+async def parar_fila():
+    global _fila
+    if _fila is not None:
+        await _fila.parar()
+    _fila = None
+
+
+def get_fila() -> FilaMensagens:
+    if _fila is None:
+        raise RuntimeError("[ERRO] Fila de mensagens não iniciada (ZAPI_INGESTAO=fila).")
+    return _fila
@@ -1,46 +1,95 @@
 # services/nlp.py
 
-import asyncio
 from services.choose_product import escolher_produto
-from services.llm import get_ollama_llm  # sua função que retorna o LlamaLLM configurado
-import json
+from services.llm import ainvoke, astream  # gateway compartilhado do Ollama
+from services.perfil_regras import perfil_sem_llm
+from services.structured_output import PerfilLead, formato_json, interpretar_ou_padrao
+from utils.logger import log_event
+from typing import AsyncIterator, Awaitable, Optional
+import asyncio
+import os
+
+# Terminais rodando ao mesmo tempo por processo (cada um ainda respeita o LLM_MAX_INFLIGHT do gateway)
+TERMINAIS_MAX_CONCORRENCIA = int(os.getenv("TERMINAIS_MAX_CONCORRENCIA", "3"))
+
+PRODUTOS = [
+    "Pacote 3 Consultas",
+    "Plano Infantil",
+    "Pacote Gestacional",
+    "Plano Continuado",
+    "Consulta Avulsa",
+]
+
+_semaforo: Optional[asyncio.Semaphore] = None
+_semaforo_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+# ──────────────────────────────────────────────────────────────────────────────
+# 🎛️ Orquestração dos terminais
+# Roda chamadas independentes em paralelo, com limite de concorrência
+# ──────────────────────────────────────────────────────────────────────────────
+def _get_semaforo() -> asyncio.Semaphore:
+    global _semaforo, _semaforo_loop
+    loop = asyncio.get_running_loop()
+    if _semaforo is None or _semaforo_loop is not loop:
+        _semaforo = asyncio.Semaphore(TERMINAIS_MAX_CONCORRENCIA)
+        _semaforo_loop = loop
+    return _semaforo
+
+
+async def _executar_terminal(nome: str, chamada: Awaitable):
+    async with _get_semaforo():
+        try:
+            return await chamada
+        except Exception as e:
+            log_event("❌ Erro no terminal NORA", {"terminal": nome, "error": str(e)})
+            return None
+
+
+async def executar_terminais(**terminais: Awaitable) -> dict:
+    """
+    Executa terminais independentes ao mesmo tempo e devolve {nome: resultado}.
+    Um terminal que falha vira None no resultado, sem derrubar os demais.
+
+    Ex.: await executar_terminais(copy=gerar_copy(...), decisao=decidir_produto_ia(...))
+    """
+    nomes = list(terminais)
+    resultados = await asyncio.gather(*(_executar_terminal(n, terminais[n]) for n in nomes))
+    return dict(zip(nomes, resultados))
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 🧠 Terminal 1 — NORA_PERFIL
 # Extrai flags, urgência e temperatura emocional
 # ──────────────────────────────────────────────────────────────────────────────
-llm_perfil = get_ollama_llm()
-
 async def analise_perfil(mensagem: str) -> dict:
+    # Caminho rápido: "estou grávida de 20 semanas" não precisa de LLM
+    perfil = perfil_sem_llm(mensagem)
+    if perfil is not None:
+        return perfil
+
     prompt = f"""
 Você é um analista clínico. A partir de mensagens de pacientes, extraia:
 - flags relevantes (tentante, gestante, menopausa, criança 8 anos, espermograma ruim)
 - urgência (score de 0 a 100)
 - temperatura emocional (quente, morno ou frio)
-Responda em JSON com as chaves: flags, urgencia, temperatura.
+Responda somente com um JSON neste formato: {formato_json(PerfilLead)}
 
 Mensagem do paciente: {mensagem}
 """
     try:
-        resposta = await asyncio.to_thread(llm_perfil.invoke, prompt)
-        return json.loads(resposta)
+        resposta = await ainvoke(prompt, format="json")
     except Exception as e:
-        return {
-            "flags": {},
-            "urgencia": 0,
-            "temperatura": "morno",
-            "erro": str(e)
-        }
+        return {**PerfilLead().model_dump(), "erro": str(e)}
+    # Valida e normaliza (flags do escolher_produto, urgência 0–100), reparando o JSON se preciso
+    return interpretar_ou_padrao(resposta, PerfilLead)
 
 
 # ──────────────────────────────────────────────────────────────────────────────
 # 📝 Terminal 2 — NORA_COPY
 # Gera copy emocional com base no produto e perfil
 # ──────────────────────────────────────────────────────────────────────────────
-llm_copy = get_ollama_llm()
-
-async def gerar_copy(produto: str, temperatura: str, nome: str) -> str:
-    prompt = f"""
+def _prompt_copy(produto: str, temperatura: str, nome: str) -> str:
+    return f"""
 Paciente: {nome}
 Temperatura emocional: {temperatura}
 Produto recomendado: {produto}
@@ -48,16 +97,25 @@ Produto recomendado: {produto}
 Gere uma mensagem empática, clara e persuasiva em até 3 parágrafos,
 explicando por que esse produto é ideal. Termine com uma chamada para ação.
 """
-    resposta = await asyncio.to_thread(llm_copy.invoke, prompt)
+
+
+async def gerar_copy(produto: str, temperatura: str, nome: str) -> str:
+    resposta = await ainvoke(_prompt_copy(produto, temperatura, nome))
     return str(resposta).strip()
 
 
+async def gerar_copy_stream(produto: str, temperatura: str, nome: str) -> AsyncIterator[str]:
+    """
+    Mesma copy de gerar_copy, entregue token a token (ver services/streaming).
+    """
+    async for trecho in astream(_prompt_copy(produto, temperatura, nome)):
+        yield trecho
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # 🧮 Terminal 3 — NORA_DECISAO (IA)
 # Decide o produto ideal com base em Llama
 # ──────────────────────────────────────────────────────────────────────────────
-llm_decisao = get_ollama_llm()
-
 async def decidir_produto_ia(score: int, flags: dict, historico: bool) -> str:
     prompt = f"""
 Score de urgência: {score}
@@ -65,16 +123,16 @@ Flags do paciente: {flags}
 Histórico prévio (has_previous_interaction): {historico}
 
 Escolha e retorne apenas o nome de um dos seguintes produtos:
-- Pacote 3 Consultas
-- Plano Infantil
-- Pacote Gestacional
-- Plano Continuado
-- Consulta Avulsa
+{_lista_produtos()}
 """
-    resposta = await asyncio.to_thread(llm_decisao.invoke, prompt)
+    resposta = await ainvoke(prompt)
     return str(resposta).strip()
 
 
+def _lista_produtos() -> str:
+    return "\n".join(f"- {p}" for p in PRODUTOS)
+
+
 # ──────────────────────────────────────────────────────────────────────────────
 # 🎯 Função principal de decisão para o pipeline (regra interna)
 # Avaliar produto usando choose_product.py
@@ -0,0 +1,181 @@
+# services/payment.py
+
+import os
+import time
+import uuid
+from typing import Optional, Protocol
+
+from core import sessions
+from utils.logger import log_event
+
+# ————— Configuração —————
+PAGAMENTO_URL_BASE = os.getenv("PAGAMENTO_URL_BASE", "https://pagamento.gateway")
+# Token esperado no header X-Webhook-Token do gateway (vazio = sem verificação, só em dev)
+PAGAMENTO_WEBHOOK_TOKEN = os.getenv("PAGAMENTO_WEBHOOK_TOKEN", "")
+# Por quanto tempo a cobrança fica no Redis depois de criada (auditoria e webhooks atrasados)
+PAGAMENTO_RETENCAO = int(os.getenv("PAGAMENTO_RETENCAO_DIAS", "30")) * 24 * 60 * 60
+
+# Estrutura no Redis:
+#   pagamento:{id}      → hash lead, data, horario, link, status, expira_em
+#                          (+ evento_pago / evento_recusado: quando cada evento chegou)
+#   pagamentos:abertos  → hash "data horario|lead" → id da cobrança pendente do slot
+#
+# Status: pendente → pago | recusado | expirado; recusado/expirado → pago (nova tentativa
+# no cartão, pagamento atrasado); pago sem horário disponível → reembolso
+CHAVE_ABERTOS = "pagamentos:abertos"
+
+# Status do gateway → status da cobrança
+_STATUS_GATEWAY = {
+    "pago": "pago", "paid": "pago", "approved": "pago", "aprovado": "pago",
+    "recusado": "recusado", "refused": "recusado", "failed": "recusado", "canceled": "recusado",
+}
+
+
+class Gateway(Protocol):
+    async def criar_link(self, cobranca_id: str, descricao: str, expira_em: float) -> str: ...
+
+    async def cancelar_link(self, cobranca_id: str): ...
+
+    def interpretar_evento(self, payload: dict) -> tuple[str, str]: ...
+
+
+class GatewayLocal:
+    """
+    Gateway sem integração externa (desenvolvimento e testes).
+    - Gera links locais e registra os cancelamentos
+    - `evento` monta o payload de webhook que `interpretar_evento` entende
+    Uma integração real (Stripe, Cielo...) implementa os mesmos três métodos.
+    """
+
+    def __init__(self, url_base: str = PAGAMENTO_URL_BASE):
+        self.url_base = url_base
+        self.links: dict[str, str] = {}
+        self.cancelados: list[str] = []
+
+    async def criar_link(self, cobranca_id: str, descricao: str, expira_em: float) -> str:
+        link = f"{self.url_base}/checkout/{cobranca_id}"
+        self.links[cobranca_id] = link
+        return link
+
+    async def cancelar_link(self, cobranca_id: str):
+        self.cancelados.append(cobranca_id)
+
+    def interpretar_evento(self, payload: dict) -> tuple[str, str]:
+        cobranca_id = payload.get("id")
+        status = _STATUS_GATEWAY.get(str(payload.get("status", "")).lower())
+        if not cobranca_id or status is None:
+            raise ValueError(f"[ERRO] Evento de pagamento inválido: {payload}")
+        return cobranca_id, status
+
+    def evento(self, cobranca_id: str, status: str = "pago") -> dict:
+        return {"id": cobranca_id, "status": status}
+
+
+_gateway: Gateway = GatewayLocal()
+
+
+def usar_gateway(gateway: Gateway):
+    """
+    Troca o gateway de pagamentos (integração real ou um novo GatewayLocal nos testes).
+    """
+    global _gateway
+    _gateway = gateway
+
+
+def get_gateway() -> Gateway:
+    return _gateway
+
+
+def _chave(cobranca_id: str) -> str:
+    return f"pagamento:{cobranca_id}"
+
+
+def _chave_slot(lead_id: str, data: str, horario: str) -> str:
+    return f"{data} {horario}|{lead_id}"
+
+
+async def criar_cobranca(lead_id: str, data: str, horario: str, expira_em: float) -> dict:
+    """
+    Cobrança da reserva preliminar: gera o link no gateway e guarda o vínculo
+    cobrança ↔ slot. Se o lead renovar a reserva, reaproveita a cobrança pendente.
+    """
+    r = sessions.redis_client
+    existente = await r.hget(CHAVE_ABERTOS, _chave_slot(lead_id, data, horario))
+    if existente:
+        cobranca = await r.hgetall(_chave(existente))
+        if cobranca.get("status") == "pendente":
+            await r.hset(_chave(existente), "expira_em", expira_em)
+            return {**cobranca, "id": existente, "expira_em": str(expira_em)}
+
+    cobranca_id = uuid.uuid4().hex
+    link = await _gateway.criar_link(cobranca_id, f"Consulta {data} às {horario}", expira_em)
+    cobranca = {
+        "lead": lead_id, "data": data, "horario": horario, "link": link,
+        "status": "pendente", "expira_em": str(expira_em), "criada_em": str(time.time()),
+    }
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(_chave(cobranca_id), mapping=cobranca)
+        pipe.expire(_chave(cobranca_id), PAGAMENTO_RETENCAO)
+        pipe.hset(CHAVE_ABERTOS, _chave_slot(lead_id, data, horario), cobranca_id)
+        await pipe.execute()
+    return {**cobranca, "id": cobranca_id}
+
+
+async def cancelar_cobranca(lead_id: str, data: str, horario: str) -> Optional[dict]:
+    """
+    Reserva expirou sem pagamento: marca a cobrança pendente do slot como expirada
+    e cancela o link no gateway. Retorna a cobrança, ou None se não havia pendente
+    (já paga ou já cancelada).
+    """
+    r = sessions.redis_client
+    chave_slot = _chave_slot(lead_id, data, horario)
+    cobranca_id = await r.hget(CHAVE_ABERTOS, chave_slot)
+    if not cobranca_id or not await r.hdel(CHAVE_ABERTOS, chave_slot):
+        return None
+    cobranca = await r.hgetall(_chave(cobranca_id))
+    if cobranca.get("status") == "pendente":
+        await r.hset(_chave(cobranca_id), "status", "expirado")
+        cobranca["status"] = "expirado"
+        try:
+            await _gateway.cancelar_link(cobranca_id)
+        except Exception as e:
+            log_event("❌ Erro ao cancelar link de pagamento", {"cobranca": cobranca_id, "error": str(e)})
+    return {**cobranca, "id": cobranca_id}
+
+
+async def registrar_pagamento(payload: dict) -> Optional[dict]:
+    """
+    Interpreta o webhook do gateway e grava o resultado na cobrança.
+    Idempotente por (cobrança, status): o gateway pode reenviar o mesmo evento e só
+    o primeiro é processado. Um "pago" depois de um "recusado" (nova tentativa no
+    cartão) é processado; um "recusado" depois do "pago" é ignorado.
+    Eventos ignorados e cobranças desconhecidas retornam None.
+    A cobrança retornada traz `status_anterior` ("expirado"/"recusado" = a reserva
+    já tinha sido liberada).
+    """
+    cobranca_id, status = _gateway.interpretar_evento(payload)
+    r = sessions.redis_client
+    cobranca = await r.hgetall(_chave(cobranca_id))
+    if not cobranca:
+        log_event("❌ Pagamento de cobrança desconhecida", {"cobranca": cobranca_id, "status": status})
+        return None
+    if status == "recusado" and cobranca.get("status") in ("pago", "reembolso"):
+        log_event("🔁 Recusa depois do pagamento ignorada", {"cobranca": cobranca_id})
+        return None
+    if not await r.hsetnx(_chave(cobranca_id), f"evento_{status}", time.time()):
+        log_event("🔁 Evento de pagamento repetido", {"cobranca": cobranca_id, "status": status})
+        return None
+    async with r.pipeline(transaction=True) as pipe:
+        pipe.hset(_chave(cobranca_id), "status", status)
+        pipe.hdel(CHAVE_ABERTOS, _chave_slot(cobranca["lead"], cobranca["data"], cobranca["horario"]))
+        await pipe.execute()
+    return {**cobranca, "id": cobranca_id, "status": status, "status_anterior": cobranca["status"]}
+
+
+async def marcar_cobranca(cobranca_id: str, status: str):
+    await sessions.redis_client.hset(_chave(cobranca_id), "status", status)
+
+
+async def get_cobranca(cobranca_id: str) -> Optional[dict]:
+    cobranca = await sessions.redis_client.hgetall(_chave(cobranca_id))
+    return {**cobranca, "id": cobranca_id} if cobranca else None
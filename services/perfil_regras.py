@@ -0,0 +1,147 @@
+# services/perfil_regras.py
+
+import os
+import re
+from functools import lru_cache
+
+from services.intent import normalizar_texto
+
+# Confiança mínima para dispensar o LLM no terminal de perfil (0 a 1)
+PERFIL_REGRAS_CONFIANCA_MIN = float(os.getenv("PERFIL_REGRAS_CONFIANCA_MIN", "0.75"))
+
+# Padrões por flag do escolher_produto, já em texto normalizado (sem acento, minúsculo).
+# Cada padrão é um trecho de regex com a confiança que ele dá à flag.
+FLAG_PADROES = {
+    "is_gest": [
+        (r"(estou|to|tou|fiquei|estar) gravida", 0.95), (r"gravida de \d+", 0.95), (r"\d+ semanas de gestacao", 0.95),
+        (r"gestante", 0.9), (r"gestacao", 0.8), (r"pre ?natal", 0.85), (r"gravidez", 0.7), (r"gravida", 0.8),
+        (r"esperando (um|uma) (bebe|filho|filha)", 0.9), (r"\d+ semanas", 0.6),
+    ],
+    "is_ttc": [
+        (r"tentando engravidar", 0.95), (r"tentante", 0.9), (r"(quero|queremos|desejo) engravidar", 0.85),
+        (r"nao (consigo|conseguimos) engravidar", 0.95), (r"dificuldade (para|pra) engravidar", 0.95),
+        (r"infertilidade", 0.8), (r"fertilizacao", 0.8), (r"inseminacao", 0.8), (r"\bfiv\b", 0.7),
+        (r"engravidar", 0.7),
+    ],
+    "bad_sperm": [
+        (r"espermograma (ruim|alterado|baixo|com problema)", 0.95), (r"azoospermia", 0.95),
+        (r"oligospermia", 0.95), (r"(baixa|pouca) (contagem|quantidade) de espermatozoides", 0.9),
+        (r"espermatozoides? (fracos?|lentos?|parados?)", 0.9), (r"espermograma", 0.6),
+    ],
+    "is_child8": [
+        (r"(filho|filha|crianca|menino|menina) (de|com|tem) 8 anos", 0.95), (r"8 anos (de idade)?", 0.6),
+        (r"pediatr", 0.6),
+    ],
+    "menopausa": [
+        (r"menopausa", 0.95), (r"climaterio", 0.9), (r"fogach", 0.85), (r"ondas? de calor", 0.75),
+        (r"parou de menstruar", 0.7), (r"reposicao hormonal", 0.7),
+    ],
+}
+
+# Sinais de urgência e de temperatura emocional
+URGENCIA_PADROES = [
+    (r"urgente|urgencia|emergencia", 90), (r"(o )?quanto antes|o mais rapido|hoje ainda|pra ontem", 85),
+    (r"sangramento|sangrando|dor forte|muita dor", 90), (r"desesperad|angustiad|ansios|preocupad", 75),
+    (r"ha (anos|muito tempo)|\d+ anos tentando", 70), (r"esta semana|amanha", 70),
+]
+QUENTE = r"quero (agendar|marcar|fechar|comecar)|como (pago|faco pra pagar)|quanto custa|qual o valor|pode marcar"
+FRIO = r"so (pesquisando|olhando|curiosidade)|talvez|mais pra frente|depois eu vejo|sem pressa|ainda nao sei"
+_NEGACAO = re.compile(r"\b(nao|nunca|nem|sem)\s+(\w+\s+){0,2}$")
+
+# Urgência padrão quando há flag e nenhum sinal explícito
+URGENCIA_POR_FLAG = {"is_gest": 60, "is_ttc": 60, "bad_sperm": 65, "is_child8": 50, "menopausa": 45}
+
+_stats = {"regras": 0, "escalados": 0}
+
+
+def _compilar(padroes: list[tuple[str, object]]) -> re.Pattern:
+    return re.compile("|".join(f"(?P<p{i}>{p})" for i, (p, _) in enumerate(padroes)))
+
+
+_TERMOS_FLAG = [(padrao, (flag, confianca)) for flag, lista in FLAG_PADROES.items() for padrao, confianca in lista]
+_PADRAO_FLAGS = _compilar(_TERMOS_FLAG)
+_PADRAO_URGENCIA = _compilar(URGENCIA_PADROES)
+_PADRAO_QUENTE = re.compile(QUENTE)
+_PADRAO_FRIO = re.compile(FRIO)
+
+
+@lru_cache(maxsize=4096)
+def _extrair(texto: str) -> tuple:
+    confiancas: dict[str, float] = {}
+    evidencias = []
+    for match in _PADRAO_FLAGS.finditer(texto):
+        if _NEGACAO.search(texto[:match.start()]):
+            continue  # "não estou grávida", "nem pensamos em engravidar"
+        flag, confianca = _TERMOS_FLAG[int(match.lastgroup[1:])][1]
+        evidencias.append(match.group())
+        # Duas evidências da mesma flag reforçam a confiança
+        anterior = confiancas.get(flag, 0.0)
+        confiancas[flag] = max(anterior, confianca) if not anterior else min(1.0, max(anterior, confianca) + 0.1)
+
+    urgencias = [URGENCIA_PADROES[int(m.lastgroup[1:])][1] for m in _PADRAO_URGENCIA.finditer(texto)]
+    if urgencias:
+        urgencia = max(urgencias)
+    else:
+        urgencia = max((URGENCIA_POR_FLAG[f] for f in confiancas), default=0)
+
+    if _PADRAO_QUENTE.search(texto) or urgencia >= 80:
+        temperatura = "quente"
+    elif _PADRAO_FRIO.search(texto):
+        temperatura = "frio"
+    else:
+        temperatura = "morno"
+    return tuple(sorted(confiancas.items())), urgencia, temperatura, tuple(evidencias)
+
+
+def extrair_perfil_por_regras(mensagem: str) -> dict:
+    """
+    Extrator determinístico do perfil (flags, urgência, temperatura), sem LLM.
+    Retorna também:
+    - confianca: a menor confiança entre as flags encontradas (0 se nenhuma);
+      abaixo de PERFIL_REGRAS_CONFIANCA_MIN o perfil deve ir para o LLM
+    - confianca_flags e evidencias: o que foi reconhecido, para log/depuração
+    """
+    confiancas, urgencia, temperatura, evidencias = _extrair(normalizar_texto(mensagem))
+    confiancas = dict(confiancas)
+    return {
+        "flags": {flag: True for flag in confiancas},
+        "urgencia": urgencia,
+        "temperatura": temperatura,
+        "confianca": min(confiancas.values(), default=0.0),
+        "confianca_flags": confiancas,
+        "evidencias": list(evidencias),
+    }
+
+
+def perfil_suficiente(perfil: dict, minimo: float | None = None) -> bool:
+    """
+    True quando as regras bastam e a chamada ao LLM pode ser evitada.
+    """
+    minimo = PERFIL_REGRAS_CONFIANCA_MIN if minimo is None else minimo
+    return bool(perfil["flags"]) and perfil["confianca"] >= minimo
+
+
+def perfil_sem_llm(mensagem: str) -> dict | None:
+    """
+    Caminho rápido do terminal de perfil: devolve o perfil (flags, urgencia,
+    temperatura, confianca) quando as regras bastam, ou None para escalar ao LLM.
+    """
+    perfil = extrair_perfil_por_regras(mensagem)
+    if not perfil_suficiente(perfil):
+        _stats["escalados"] += 1
+        return None
+    _stats["regras"] += 1
+    return {chave: perfil[chave] for chave in ("flags", "urgencia", "temperatura", "confianca")}
+
+
+def estatisticas_perfil_regras() -> dict:
+    """
+    Quantos perfis saíram das regras (chamadas ao LLM evitadas) e quantos foram escalados.
+    """
+    total = _stats["regras"] + _stats["escalados"]
+    return {**_stats, "taxa_sem_llm": (_stats["regras"] / total) if total else 0.0}
+
+
+def limpar_estatisticas_perfil_regras():
+    for chave in _stats:
+        _stats[chave] = 0
@@ -1,9 +1,10 @@
 # services/product_pipeline.py
 
-from models.lead import get_lead, create_lead, update_lead
+from models.lead import contar_idas, get_lead, create_lead, registrar_evento_lead, update_lead
 from services.choose_product import escolher_produto
 from services.copy_terminal import enviar_mensagem
-from services.nlp import analise_perfil, avaliar_produto, gerar_copy
+from services.nlp import analise_perfil, avaliar_produto, gerar_copy, gerar_copy_stream
+from services.streaming import LLM_STREAMING, transmitir_resposta
 from utils.logger import log_event
 import random
 
@@ -11,21 +12,31 @@ import random
 RESPONDI_KEYWORDS = ["preenchi", "respondi", "enviei o formulário", "já preenchi"]
 
 async def process_zapi_payload(payload: dict):
+    """
+    Processa uma mensagem do funil de produto, contabilizando as idas ao Supabase.
+    """
+    with contar_idas() as idas:
+        await _processar_mensagem(payload)
+    log_event("🗄️ Idas ao Supabase na mensagem", {"numero": payload.get("phone"), "idas": idas["idas"]})
+
+
+async def _processar_mensagem(payload: dict):
     numero = payload.get("phone")
     texto = payload.get("message", "")
 
     log_event("📩 Mensagem recebida do WhatsApp", {"numero": numero, "texto": texto})
 
     # 1) Carrega ou cria lead
-    lead = get_lead(numero)
+    lead = await get_lead(numero)
     if not lead:
-        lead = create_lead(numero)
+        lead = await create_lead(numero)
         # 🚨 DEBUG: imprime no terminal o que veio do Supabase / do dicionário
         log_event("🚨 DEBUG: Lead criado com dados", lead)
 
         lead["formulario_respondido"] = False
         lead["etapa"] = "inicial"
         log_event("👤 Novo lead criado", {"numero": numero})
+        await registrar_evento_lead(numero, "lead_criado")
 
     etapa = lead.get("etapa", "inicial")
 
@@ -35,8 +46,9 @@ async def process_zapi_payload(payload: dict):
             # Marca como respondido e avança
             lead["formulario_respondido"] = True
             lead["etapa"] = "produto"
-            update_lead(numero, lead)
+            await update_lead(numero, lead)
             log_event("✅ Formulário sinalizado como respondido", {"numero": numero})
+            await registrar_evento_lead(numero, "formulario_respondido")
         else:
             # Ainda não entendeu que preencheu
             enviar_mensagem(
@@ -58,8 +70,9 @@ async def process_zapi_payload(payload: dict):
             f"Perfeito! Antes de continuar, responde esse formulário rapidinho? 💜\n{link}"
         )
         lead["etapa"] = "aguardando_form"
-        update_lead(numero, lead)
+        await update_lead(numero, lead)
         log_event("📮 Formulário enviado", {"numero": numero})
+        await registrar_evento_lead(numero, "formulario_enviado", {"temperatura": lead.get("temperatura")})
         return
 
     # 4) Etapa de produto: já preencheu
@@ -71,18 +84,33 @@ async def process_zapi_payload(payload: dict):
     lead["produto_escolhido"] = produto
     log_event("📦 Produto definido", {"produto": produto})
 
-    # 5) Gera a copy final e envia
-    texto_final = await gerar_copy(
-        produto,
-        lead.get("temperatura", "morno"),
-        lead.get("nome", "")
-    )
-    enviar_mensagem(numero, texto_final)
+    # 5) Gera a copy final e envia (em streaming, parágrafo a parágrafo, se LLM_STREAMING=1)
+    temperatura = lead.get("temperatura", "morno")
+    nome = lead.get("nome", "")
+
+    async def copy_final() -> str:
+        if LLM_STREAMING:
+            async def enviar_fragmento(numero: str, texto: str):
+                enviar_mensagem(numero, texto)
+
+            return await transmitir_resposta(numero, gerar_copy_stream(produto, temperatura, nome), enviar_fragmento)
+        texto = await gerar_copy(produto, temperatura, nome)
+        enviar_mensagem(numero, texto)
+        return texto
+
+    try:
+        texto_final = await copy_final()
+    except Exception as e:
+        # Falha na geração: o lead continua na etapa de produto e tenta de novo na próxima mensagem
+        log_event("❌ Erro ao gerar a copy", {"numero": numero, "error": str(e)})
+        await update_lead(numero, lead)
+        return
     log_event("📤 Resposta enviada", {"texto": texto_final})
 
     # 6) Finaliza o lead
     lead["etapa"] = "finalizado"
-    update_lead(numero, lead)
+    await update_lead(numero, lead)
+    await registrar_evento_lead(numero, "finalizado", {"produto": produto})
 
 
 # 📥 Google Forms (simulado via Webhook)
@@ -90,9 +118,9 @@ async def process_google_form(payload: dict):
     numero = payload.get("phone")
     respostas = payload.get("respostas", {})
 
-    lead = get_lead(numero)
+    lead = await get_lead(numero)
     if not lead:
-        lead = create_lead(numero)
+        lead = await create_lead(numero)
 
     # Salva que o formulário foi respondido e grava respostas
     lead["formulario_respondido"] = True
@@ -112,4 +140,5 @@ async def process_google_form(payload: dict):
     lead["score"] = 80 if "tentante" in lead["flags"] else 40
 
     log_event("📋 Formulário processado", {"numero": numero, "respostas": respostas})
-    update_lead(numero, lead)
+    await update_lead(numero, lead)
+    await registrar_evento_lead(numero, "formulario_processado")
@@ -0,0 +1,148 @@
+# services/prompt_builder.py
+
+import asyncio
+import os
+from typing import Optional
+
+from core.sessions import get_history, save_session
+from services.llm import ainvoke
+from utils.logger import log_event
+
+# ————— Orçamento do prompt —————
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "1500"))
+PROMPT_TURNOS_RECENTES = int(os.getenv("PROMPT_TURNOS_RECENTES", "8"))       # mensagens mantidas na íntegra
+PROMPT_RESUMO_MAX_TOKENS = int(os.getenv("PROMPT_RESUMO_MAX_TOKENS", "300"))
+# Resumo via LLM (mais fiel, custa uma geração extra em segundo plano) ou extrativo (padrão)
+PROMPT_RESUMO_LLM = os.getenv("PROMPT_RESUMO_LLM", "0") == "1"
+
+SYSTEM_PROMPT = (
+    "Você é a NORA, uma assistente empática e precisa. "
+    "Ajude os leads no processo de agendamento, escolha de produtos e esclarecimento de dúvidas, "
+    "sempre mantendo um tom humano, acolhedor e objetivo."
+)
+
+_resumos_em_andamento: dict[str, asyncio.Task] = {}
+
+
+def estimar_tokens(texto: str) -> int:
+    """
+    Estimativa barata (~4 caracteres por token), suficiente para o orçamento.
+    """
+    return len(texto) // 4 + 1
+
+
+def _linha(role: str, content: str) -> str:
+    return f"{role}: {content}\n"
+
+
+def _truncar(texto: str, max_tokens: int) -> str:
+    max_chars = max(0, max_tokens * 4)
+    return texto if len(texto) <= max_chars else "…" + texto[-max_chars:]
+
+
+def montar_prompt(session: dict, history: list, user_message: str, max_tokens: int = PROMPT_MAX_TOKENS) -> str:
+    """
+    Monta o prompt do fallback dentro do orçamento de tokens:
+    instrução do sistema + resumo da conversa + últimos turnos na íntegra + mensagem atual.
+    Turnos antigos que não cabem saem primeiro; a mensagem atual sempre entra.
+    """
+    recentes = [m for m in history if m.get("timestamp", "") > session.get("resumo_ate", "")]
+    recentes = recentes[-PROMPT_TURNOS_RECENTES:]
+    # handle_message já gravou a mensagem atual no histórico; evita duplicar
+    if recentes and recentes[-1].get("role") == "user" and recentes[-1].get("content") == user_message:
+        recentes = recentes[:-1]
+
+    cabecalho = _linha("system", SYSTEM_PROMPT)
+    resumo = session.get("resumo")
+    if resumo:
+        cabecalho += _linha("system", f"Resumo da conversa até aqui: {resumo}")
+    rodape = _linha("user", user_message) + "assistant:"
+
+    restante = max_tokens - estimar_tokens(cabecalho)
+    if estimar_tokens(rodape) > restante:
+        rodape = _linha("user", _truncar(user_message, restante - 4)) + "assistant:"
+    restante -= estimar_tokens(rodape)
+
+    # Do turno mais recente para o mais antigo, enquanto couber
+    linhas: list[str] = []
+    for msg in reversed(recentes):
+        linha = _linha(msg.get("role", "user"), msg.get("content", ""))
+        custo = estimar_tokens(linha)
+        if custo > restante:
+            break
+        linhas.append(linha)
+        restante -= custo
+
+    return cabecalho + "".join(reversed(linhas)) + rodape
+
+
+def resumir_extrativo(resumo_atual: str, mensagens: list, max_tokens: int = PROMPT_RESUMO_MAX_TOKENS) -> str:
+    """
+    Acrescenta uma linha curta por mensagem ao resumo e descarta as linhas
+    mais antigas quando passa do limite. Não chama o LLM.
+    """
+    linhas = [linha for linha in resumo_atual.split(" | ") if linha] if resumo_atual else []
+    for msg in mensagens:
+        content = " ".join(msg.get("content", "").split())
+        linhas.append(f"{msg.get('role', 'user')}: {content[:160]}")
+    while len(linhas) > 1 and estimar_tokens(" | ".join(linhas)) > max_tokens:
+        linhas.pop(0)
+    return _truncar(" | ".join(linhas), max_tokens)
+
+
+async def resumir_com_llm(resumo_atual: str, mensagens: list, max_tokens: int = PROMPT_RESUMO_MAX_TOKENS) -> str:
+    conversa = "".join(_linha(m.get("role", "user"), m.get("content", "")) for m in mensagens)
+    prompt = f"""
+Resumo anterior da conversa entre a NORA e o paciente:
+{resumo_atual or "(vazio)"}
+
+Novas mensagens:
+{conversa}
+Atualize o resumo em no máximo {max_tokens * 3 // 4} palavras, mantendo dados úteis
+(nome, necessidades, datas, produtos citados). Responda só com o resumo.
+"""
+    return _truncar((await ainvoke(prompt)).strip(), max_tokens)
+
+
+async def atualizar_resumo(phone_number: str, session: dict, history: Optional[list] = None) -> Optional[dict]:
+    """
+    Incorpora ao resumo da sessão as mensagens que saíram da janela de turnos
+    recentes e ainda não foram resumidas. Grava `resumo` e `resumo_ate`
+    (timestamp da última mensagem resumida) nos metadados da sessão.
+    """
+    if history is None:
+        history = await get_history(phone_number, limit=PROMPT_TURNOS_RECENTES * 3)
+    resumo_ate = session.get("resumo_ate", "")
+    fora_da_janela = history[:-PROMPT_TURNOS_RECENTES] if len(history) > PROMPT_TURNOS_RECENTES else []
+    novas = [m for m in fora_da_janela if m.get("timestamp", "") > resumo_ate]
+    if not novas:
+        return None
+
+    resumo_atual = session.get("resumo", "")
+    if PROMPT_RESUMO_LLM:
+        resumo = await resumir_com_llm(resumo_atual, novas)
+    else:
+        resumo = resumir_extrativo(resumo_atual, novas)
+    campos = {"resumo": resumo, "resumo_ate": novas[-1].get("timestamp", "")}
+    await save_session(phone_number, campos)
+    session.update(campos)
+    return campos
+
+
+def agendar_atualizacao_resumo(phone_number: str, session: dict):
+    """
+    Atualiza o resumo em segundo plano, sem atrasar a resposta.
+    No máximo uma atualização por número ao mesmo tempo.
+    """
+    if phone_number in _resumos_em_andamento:
+        return
+
+    async def _executar():
+        try:
+            await atualizar_resumo(phone_number, session)
+        except Exception as e:
+            log_event("❌ Erro ao atualizar resumo da sessão", {"numero": phone_number, "error": str(e)})
+        finally:
+            _resumos_em_andamento.pop(phone_number, None)
+
+    _resumos_em_andamento[phone_number] = asyncio.create_task(_executar())
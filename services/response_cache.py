@@ -0,0 +1,202 @@
+# services/response_cache.py
+
+import math
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from services.intent import normalizar_texto
+
+# ————— Configuração —————
+CACHE_RESPOSTAS_ATIVO = os.getenv("CACHE_RESPOSTAS", "1") == "1"
+CACHE_RESPOSTAS_MAX = int(os.getenv("CACHE_RESPOSTAS_MAX", "2000"))
+CACHE_RESPOSTAS_TTL = int(os.getenv("CACHE_RESPOSTAS_TTL", str(6 * 60 * 60)))
+# Similaridade mínima (cosseno TF-IDF) para reaproveitar a resposta de uma pergunta
+# parecida; 0 desliga a busca por vizinho mais próximo (só acerto exato)
+CACHE_RESPOSTAS_SIMILARIDADE = float(os.getenv("CACHE_RESPOSTAS_SIMILARIDADE", "0.85"))
+# Mensagens curtas demais ("ok", "sim") dependem do contexto: não entram no cache
+CACHE_RESPOSTAS_MIN_PALAVRAS = int(os.getenv("CACHE_RESPOSTAS_MIN_PALAVRAS", "3"))
+# Campos da sessão que mudam a resposta (entram na chave)
+CAMPOS_ESTADO = ("data", "horario")
+
+STOPWORDS = {
+    "a", "o", "as", "os", "de", "da", "do", "das", "dos", "e", "em", "no", "na", "nos", "nas",
+    "um", "uma", "para", "pra", "por", "com", "que", "se", "me", "eu", "voce", "voces", "vcs",
+    "oi", "ola", "bom", "boa", "dia", "tarde", "noite", "tudo", "bem", "favor", "gostaria",
+    "queria", "saber", "qual", "quais", "como", "ai", "ao", "aos",
+}
+_PALAVRA = re.compile(r"\w+")
+
+
+def _texto_chave(mensagem: str) -> str:
+    """
+    Mensagem normalizada e sem pontuação ("Qual o horário?" → "qual o horario").
+    """
+    return " ".join(_PALAVRA.findall(normalizar_texto(mensagem)))
+
+
+def contexto_vazio(session: dict, history: list, mensagem: str) -> bool:
+    """
+    True quando o prompt do fallback depende só da mensagem: sem resumo e sem turnos
+    anteriores (o histórico traz no máximo a própria mensagem, já gravada por
+    handle_message). Só nesse caso a resposta pode ser servida a outro lead, ou ao
+    mesmo lead mais tarde: com contexto, ela pode citar o nome ou o histórico de quem
+    perguntou, e isso não entra na chave.
+    """
+    if session.get("resumo"):
+        return False
+    return all(m.get("role") == "user" and m.get("content") == mensagem for m in history)
+
+
+def _tokens(texto_chave: str) -> Counter:
+    return Counter(p for p in texto_chave.split() if p not in STOPWORDS)
+
+
+@dataclass
+class _Entrada:
+    resposta: str
+    criada_em: float
+    custo_s: float
+    tokens: Counter
+    estado: tuple
+
+
+class CacheRespostas:
+    """
+    Cache de respostas do fallback LLM, na frente do gateway (só para conversas
+    sem contexto, ver `contexto_vazio`):
+    - acerto exato: mensagem normalizada + estado relevante da sessão
+    - acerto semântico: vizinho mais próximo por cosseno TF-IDF (mesmo estado),
+      acima de `similaridade`
+    - expiração por TTL e despejo LRU por tamanho
+    """
+
+    def __init__(
+        self,
+        max_entradas: int = CACHE_RESPOSTAS_MAX,
+        ttl: float = CACHE_RESPOSTAS_TTL,
+        similaridade: float = CACHE_RESPOSTAS_SIMILARIDADE,
+        relogio: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.similaridade = similaridade
+        self.relogio = relogio
+        self._entradas: "OrderedDict[tuple, _Entrada]" = OrderedDict()
+        self._indice: dict[str, set[tuple]] = {}  # token → chaves (índice invertido)
+        self._df: Counter = Counter()             # em quantas entradas cada token aparece
+        self.metricas = {
+            "hits_exatos": 0, "hits_semanticos": 0, "misses": 0,
+            "segundos_economizados": 0.0, "despejos": 0,
+        }
+
+    @staticmethod
+    def _estado(session: dict) -> tuple:
+        return tuple(session.get(campo) for campo in CAMPOS_ESTADO)
+
+    def _remover(self, chave: tuple):
+        entrada = self._entradas.pop(chave)
+        for token in entrada.tokens:
+            self._df[token] -= 1
+            if self._df[token] <= 0:
+                del self._df[token]
+            self._indice[token].discard(chave)
+            if not self._indice[token]:
+                del self._indice[token]
+
+    def _idf(self, token: str) -> float:
+        return math.log((len(self._entradas) + 1) / (self._df.get(token, 0) + 1)) + 1
+
+    def _cosseno(self, a: Counter, b: Counter) -> float:
+        pesos_a = {t: f * self._idf(t) for t, f in a.items()}
+        pesos_b = {t: f * self._idf(t) for t, f in b.items()}
+        produto = sum(p * pesos_b.get(t, 0.0) for t, p in pesos_a.items())
+        norma = math.sqrt(sum(p * p for p in pesos_a.values())) * math.sqrt(sum(p * p for p in pesos_b.values()))
+        return produto / norma if norma else 0.0
+
+    def _valida(self, chave: tuple, agora: float) -> Optional[_Entrada]:
+        entrada = self._entradas.get(chave)
+        if entrada is None:
+            return None
+        if agora - entrada.criada_em > self.ttl:
+            self._remover(chave)
+            return None
+        return entrada
+
+    def buscar(self, mensagem: str, session: dict) -> Optional[str]:
+        texto = _texto_chave(mensagem)
+        estado = self._estado(session)
+        agora = self.relogio()
+
+        entrada = self._valida((texto, estado), agora)
+        if entrada is not None:
+            self._entradas.move_to_end((texto, estado))
+            self.metricas["hits_exatos"] += 1
+            self.metricas["segundos_economizados"] += entrada.custo_s
+            return entrada.resposta
+
+        tokens = _tokens(texto)
+        if self.similaridade > 0 and tokens:
+            candidatas = set().union(*(self._indice.get(t, set()) for t in tokens))
+            melhor, melhor_sim = None, 0.0
+            for chave in candidatas:
+                candidata = self._valida(chave, agora)
+                if candidata is None or candidata.estado != estado:
+                    continue
+                sim = self._cosseno(tokens, candidata.tokens)
+                if sim > melhor_sim:
+                    melhor, melhor_sim = chave, sim
+            if melhor is not None and melhor_sim >= self.similaridade:
+                entrada = self._entradas[melhor]
+                self._entradas.move_to_end(melhor)
+                self.metricas["hits_semanticos"] += 1
+                self.metricas["segundos_economizados"] += entrada.custo_s
+                return entrada.resposta
+
+        self.metricas["misses"] += 1
+        return None
+
+    def guardar(self, mensagem: str, session: dict, resposta: str, custo_s: float = 0.0) -> bool:
+        texto = _texto_chave(mensagem)
+        if len(texto.split()) < CACHE_RESPOSTAS_MIN_PALAVRAS or not resposta.strip():
+            return False
+        chave = (texto, self._estado(session))
+        if chave in self._entradas:
+            self._remover(chave)
+        tokens = _tokens(texto)
+        self._entradas[chave] = _Entrada(resposta, self.relogio(), custo_s, tokens, chave[1])
+        for token in tokens:
+            self._df[token] += 1
+            self._indice.setdefault(token, set()).add(chave)
+        while len(self._entradas) > self.max_entradas:
+            self._remover(next(iter(self._entradas)))
+            self.metricas["despejos"] += 1
+        return True
+
+    def estatisticas(self) -> dict:
+        m = self.metricas
+        consultas = m["hits_exatos"] + m["hits_semanticos"] + m["misses"]
+        acertos = m["hits_exatos"] + m["hits_semanticos"]
+        return {
+            "entradas": len(self._entradas),
+            "taxa_acerto": (acertos / consultas) if consultas else 0.0,
+            **m,
+        }
+
+    def limpar(self):
+        self._entradas.clear()
+        self._indice.clear()
+        self._df.clear()
+
+
+_cache = CacheRespostas()
+
+
+def get_cache_respostas() -> Optional[CacheRespostas]:
+    """
+    Cache global do processo, ou None quando desligado (CACHE_RESPOSTAS=0).
+    """
+    return _cache if CACHE_RESPOSTAS_ATIVO else None
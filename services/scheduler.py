@@ -1,69 +1,220 @@
 # services/scheduler.py
 
-import os
 import datetime
+import json
+import os
 from typing import Optional
-from supabase import create_client, Client
-
-# ————— Supabase —————
-SUPABASE_URL: str = os.getenv("SUPABASE_URL", "")
-SUPABASE_KEY: str = os.getenv("SUPABASE_KEY", "")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-# ————— Slots simulados por dia —————
-# Ex.: slots["2025-07-01"] = ["09:00", "10:00", ...]
-slots: dict[str, list[str]] = {
-    "2025-07-01": ["09:00", "10:00", "14:00"],
-    "2025-07-02": ["11:00", "15:00"],
+
+from models.lead import get_lead
+
+from services import payment, slot_inventory
+from utils.logger import log_event
+from utils.zapi import agendar_envio_zapi
+
+# ————— Agenda recorrente da clínica —————
+# Dia da semana (0=segunda ... 6=domingo) → horários de atendimento.
+# Sobrescreva com AGENDA_SEMANAL='{"0": ["09:00", "10:00"], "4": ["14:00"]}'.
+_AGENDA_PADRAO = {
+    0: ["09:00", "10:00", "11:00", "14:00", "15:00", "16:00"],
+    1: ["09:00", "10:00", "11:00", "14:00", "15:00", "16:00"],
+    4: ["09:00", "10:00", "11:00", "14:00", "15:00", "16:00"],
 }
+AGENDA_SEMANAL: dict[int, list[str]] = (
+    {int(dia): horarios for dia, horarios in json.loads(os.environ["AGENDA_SEMANAL"]).items()}
+    if os.getenv("AGENDA_SEMANAL") else _AGENDA_PADRAO
+)
+DIAS_ATENDIMENTO = tuple(sorted(AGENDA_SEMANAL))
+# Presencial só às sextas (e para quem está a até DISTANCIA_PRESENCIAL_KM); online em todos os dias
+MODALIDADES_POR_DIA: dict[int, tuple[str, ...]] = {4: ("presencial", "online")}
+DISTANCIA_PRESENCIAL_KM = float(os.getenv("DISTANCIA_PRESENCIAL_KM", "150"))
+# Até onde a busca de horários olha no calendário e quantas opções são sugeridas
+AGENDA_HORIZONTE_DIAS = int(os.getenv("AGENDA_HORIZONTE_DIAS", "90"))
+AGENDA_SUGESTOES = int(os.getenv("AGENDA_SUGESTOES", "3"))
+
+# Exceções por data (sobrepõem a agenda semanal; lista vazia = dia fechado, ex.: feriado)
+# Ex.: slots["2025-12-26"] = []
+slots: dict[str, list[str]] = {}
+
+_DIAS_SEMANA = ["segundas", "terças", "quartas", "quintas", "sextas", "sábados", "domingos"]
+
+
+def agenda_do_dia(data: str) -> list[tuple[str, tuple[str, ...]]]:
+    """
+    Horários do dia e as modalidades aceitas em cada um (exceção por data ou agenda semanal).
+    O estoque vive no Redis (services/slot_inventory): cada dia é carregado na primeira
+    consulta, recarregado quando os horários mudam, e compartilhado por todos os workers.
+    """
+    dia = datetime.date.fromisoformat(data).weekday()
+    horarios = slots.get(data, AGENDA_SEMANAL.get(dia, []))
+    modalidades = MODALIDADES_POR_DIA.get(dia, ("online",))
+    return [(h, modalidades) for h in horarios]
+
+
+def modalidade_do_slot(data: str, distancia_km: float) -> str:
+    dia = datetime.date.fromisoformat(data).weekday()
+    if "presencial" in MODALIDADES_POR_DIA.get(dia, ()) and distancia_km <= DISTANCIA_PRESENCIAL_KM:
+        return "presencial"
+    return "online"
+
 
 # ————— Validação de pacote obrigatório —————
 async def validar_pacote_obrigatorio(lead_id: str) -> bool:
     """
     Verifica na tabela 'leads' se o lead (campo 'numero') possui
     'produto_escolhido' preenchido (indicando pacote adquirido).
+    Usa o repositório de leads (cliente assíncrono compartilhado + cache).
     """
-    resp = (
-        supabase
-        .table("leads")
-        .select("produto_escolhido")
-        .eq("numero", lead_id)
-        .single()
-        .execute()
-    )
-    if resp.error or resp.data is None:
+    lead = await get_lead(lead_id)
+    if lead is None:
         return False
-    produto = resp.data.get("produto_escolhido", "")
-    return bool(produto and produto.strip())
+    produto = lead.get("produto_escolhido") or ""
+    return bool(produto.strip())
 
 # ————— Disponibilidade e reserva de slots —————
 async def verificar_disponibilidade(data: str, horario: str) -> bool:
-    return horario in slots.get(data, [])
+    return await slot_inventory.disponivel(data, horario, agenda_do_dia)
 
-async def reservar_slot(data: str, horario: str) -> bool:
-    if await verificar_disponibilidade(data, horario):
-        slots[data].remove(horario)
-        return True
-    return False
+async def reservar_slot(data: str, horario: str, lead_id: str = "") -> Optional[float]:
+    """
+    Reserva preliminar atômica (válida até o pagamento, por SLOT_HOLD_TTL_MIN).
+    Retorna a expiração (epoch) ou None se o horário não estiver livre.
+    """
+    return await slot_inventory.reservar(data, horario, lead_id, agenda_do_dia)
+
+async def confirmar_reserva(lead_id: str, data: str, horario: str) -> bool:
+    """
+    Pagamento aprovado: a reserva preliminar vira definitiva.
+    """
+    return await slot_inventory.confirmar(data, horario, lead_id, agenda_do_dia)
 
-async def sugerir_proximo_slot(data: str) -> Optional[str]:
-    disponiveis = slots.get(data, [])
-    return disponiveis[0] if disponiveis else None
+async def cancelar_reserva(lead_id: str, data: str, horario: str) -> bool:
+    """
+    Pagamento recusado/desistência: devolve o horário ao estoque.
+    """
+    return await slot_inventory.liberar(data, horario, lead_id, agenda_do_dia)
 
-# ————— Geração de link de pagamento (stub) —————
+async def proximos_slots(
+    data: str,
+    horario: Optional[str] = None,
+    quantidade: int = AGENDA_SUGESTOES,
+    modalidade: Optional[str] = None,
+) -> list[dict]:
+    """
+    Próximos `quantidade` horários livres a partir de `data` (depois de `horario`,
+    se informado) em qualquer dia de atendimento, até AGENDA_HORIZONTE_DIAS à frente.
+    `modalidade` ("presencial"/"online") restringe aos dias que a aceitam.
+    Consulta indexada no Redis: O(log n) sobre meses de calendário.
+    """
+    livres = await slot_inventory.proximos_livres(
+        data, agenda_do_dia, quantidade, depois_de=horario, modalidade=modalidade,
+        horizonte_dias=AGENDA_HORIZONTE_DIAS,
+    )
+    return [{"data": d, "horario": h} for d, h in livres]
+
+async def sugerir_proximo_slot(data: str, horario: Optional[str] = None) -> Optional[dict]:
+    proximos = await proximos_slots(data, horario, quantidade=1)
+    return proximos[0] if proximos else None
+
+# ————— Pagamento da reserva preliminar —————
 async def gerar_link_pagamento(
-    lead_id: str, data: str, horario: str
+    lead_id: str, data: str, horario: str, expira_em: float
 ) -> str:
     """
-    Stub para integração com Stripe ou Cielo.
-    Substituir por chamada real à API de pagamentos.
+    Link de pagamento da reserva (gateway em services/payment).
+    A cobrança fica vinculada ao slot: expira junto com a reserva.
+    """
+    cobranca = await payment.criar_cobranca(lead_id, data, horario, expira_em)
+    return cobranca["link"]
+
+async def _opcoes(data: str, horario: Optional[str]) -> str:
+    sugestoes = await proximos_slots(data, horario)
+    if not sugestoes:
+        return ""
+    return "\nPróximos horários livres:\n" + "\n".join(f"• {s['data']} às {s['horario']}" for s in sugestoes)
+
+async def reserva_expirada(lead_id: str, data: str, horario: str):
+    """
+    Chamado pelo varredor (services/hold_sweeper) quando a reserva preliminar vence
+    sem pagamento: o horário já voltou ao estoque; cancela o link e avisa o lead.
+    Avisos que ficaram velhos na fila são descartados: o lead reservou o horário de
+    novo ou pagou (pagamento atrasado já confirmado pelo webhook).
     """
-    return (
-        f"https://pagamento.gateway/checkout?"
-        f"lead={lead_id}&data={data}&hora={horario}"
+    if await slot_inventory.situacao(data, horario, lead_id, agenda_do_dia):
+        return
+    if await payment.cancelar_cobranca(lead_id, data, horario) is None:
+        return
+    log_event("⌛ Reserva preliminar expirada", {"lead": lead_id, "data": data, "horario": horario})
+    agendar_envio_zapi(
+        lead_id,
+        f"⌛ Sua reserva preliminar de {data} às {horario} expirou sem pagamento e o horário foi liberado."
+        f"{await _opcoes(data, horario)}\nSe ainda quiser, é só pedir um novo horário.",
     )
 
+async def confirmar_pagamento(evento: dict) -> dict:
+    """
+    Webhook do gateway:
+    - pago dentro do prazo  → reserva vira definitiva
+    - pago após expirar     → retoma o horário se ainda estiver livre; senão, reembolso
+    - recusado              → devolve o horário ao estoque
+    Eventos repetidos ou de cobranças desconhecidas são ignorados.
+    """
+    cobranca = await payment.registrar_pagamento(evento)
+    if cobranca is None:
+        return {"status": "ignorado"}
+    lead_id, data, horario = cobranca["lead"], cobranca["data"], cobranca["horario"]
+
+    if cobranca["status"] == "recusado":
+        await cancelar_reserva(lead_id, data, horario)
+        resultado = {
+            "status": "recusado",
+            "mensagem": f"❌ O pagamento da reserva de {data} às {horario} não foi aprovado e o horário foi liberado.",
+        }
+    elif await confirmar_reserva(lead_id, data, horario) or (
+        await reservar_slot(data, horario, lead_id) and await confirmar_reserva(lead_id, data, horario)
+    ):
+        resultado = {
+            "status": "confirmado",
+            "mensagem": f"🎉 Pagamento confirmado! Sua consulta está marcada para {data} às {horario}.",
+        }
+    else:
+        await payment.marcar_cobranca(cobranca["id"], "reembolso")
+        resultado = {
+            "status": "reembolso",
+            "mensagem": (
+                f"😕 Recebemos seu pagamento, mas a reserva de {data} às {horario} já tinha sido liberada "
+                f"e o horário foi ocupado. Vamos estornar o valor.{await _opcoes(data, horario)}"
+            ),
+        }
+    log_event("💳 Pagamento processado", {"cobranca": cobranca["id"], "lead": lead_id, "status": resultado["status"]})
+    agendar_envio_zapi(lead_id, resultado["mensagem"])
+    return {**resultado, "lead": lead_id, "data": data, "horario": horario}
+
 # ————— Agendamento Inteligente —————
+async def _sugerir(
+    status: str, motivo: str, data: str, horario: Optional[str], distancia_km: float
+) -> dict:
+    """
+    Resposta com os próximos horários livres (em qualquer dia de atendimento),
+    para o lead escolher sem mais uma rodada de "tenta outra data".
+    """
+    sugestoes = await proximos_slots(data, horario)
+    if not sugestoes:
+        return {
+            "status": "indisponivel",
+            "mensagem": (
+                f"{motivo}❌ Não há horários disponíveis nos próximos {AGENDA_HORIZONTE_DIAS} dias. "
+                "Vamos te avisar assim que abrir uma vaga."
+            )
+        }
+    for s in sugestoes:
+        s["modalidade"] = modalidade_do_slot(s["data"], distancia_km)
+    opcoes = "\n".join(f"• {s['data']} às {s['horario']} ({s['modalidade']})" for s in sugestoes)
+    return {
+        "status": status,
+        "sugestoes": sugestoes,
+        "mensagem": f"{motivo}Próximos horários livres:\n{opcoes}\nQual prefere?"
+    }
+
 async def processar_agendamento(
     lead_id: str,
     data: str,
@@ -72,12 +223,12 @@ async def processar_agendamento(
 ) -> dict:
     """
     1) Verifica pacote obrigatório.
-    2) Verifica dia da semana (Seg/Ter/6ª).
-    3) Determina modalidade (online/presencial) conforme distância.
-    4) Tenta reservar slot:
-       - slot livre  → reserva preliminar + gera link de pagamento
-       - ocupado     → sugere próximo horário
-       - sem slots   → informa indisponibilidade da data
+    2) Verifica data e horário (futuros) e dia da semana (dias de atendimento da agenda semanal).
+    3) Determina modalidade (online/presencial) conforme dia e distância.
+    4) Tenta reservar slot (atômico no Redis, sem dupla reserva entre workers):
+       - slot livre  → reserva preliminar (expira sem pagamento) + gera link de pagamento
+       - ocupado     → sugere os próximos horários livres, inclusive em outros dias
+       - sem slots   → informa indisponibilidade no horizonte da agenda
     """
     # 1) Pacote
     if not await validar_pacote_obrigatorio(lead_id):
@@ -89,56 +240,45 @@ async def processar_agendamento(
             )
         }
 
-    # 2) Dia da semana
+    # 2) Data e dia da semana
     try:
-        dia = datetime.datetime.strptime(data, "%Y-%m-%d").weekday()
+        dia = datetime.datetime.strptime(data, "%Y-%m-%d").date()
+        horario = slot_inventory.normalizar_horario(horario)
     except ValueError:
         return {
             "status": "data_invalida",
-            "mensagem": "Formato de data inválido. Use YYYY-MM-DD."
+            "mensagem": "Formato de data/horário inválido. Use AAAA-MM-DD e HH:MM."
         }
 
-    if dia not in (0, 1, 4):  # 0=Segunda,1=Terça,4=Sexta
-        return {
-            "status": "dia_invalido",
-            "mensagem": "Atendemos somente nas segundas, terças e sextas."
-        }
+    hoje = datetime.date.today()
+    if dia < hoje:
+        return await _sugerir("data_passada", "📅 Essa data já passou. ", hoje.isoformat(), None, distancia_km)
+    if slot_inventory.ja_passou(data, horario):
+        return await _sugerir("horario_passado", f"⏰ {horario} de hoje já passou. ", data, None, distancia_km)
+
+    if dia.weekday() not in DIAS_ATENDIMENTO:
+        dias = [_DIAS_SEMANA[d] for d in DIAS_ATENDIMENTO]
+        nomes = ", ".join(dias[:-1]) + " e " + dias[-1] if len(dias) > 1 else dias[0]
+        return await _sugerir("dia_invalido", f"Atendemos somente nas {nomes}. ", data, None, distancia_km)
 
     # 3) Modalidade
-    if dia == 4 and distancia_km <= 150:
-        modalidade = "presencial"
-    else:
-        modalidade = "online"
+    modalidade = modalidade_do_slot(data, distancia_km)
 
     # 4) Reserva / sugestão
-    if await reservar_slot(data, horario):
-        link = await gerar_link_pagamento(lead_id, data, horario)
+    expira_em = await reservar_slot(data, horario, lead_id)
+    if expira_em:
+        link = await gerar_link_pagamento(lead_id, data, horario, expira_em)
         return {
             "status": "preliminar",
             "modalidade": modalidade,
+            "horario": horario,
+            "expira_em": expira_em,
             "mensagem": (
                 f"✅ Reserva preliminar efetuada para {data} às {horario} "
                 f"({modalidade}).\n"
-                f"Para confirmar, efetue o pagamento aqui:\n{link}"
+                f"Para confirmar, efetue o pagamento em até {slot_inventory.SLOT_HOLD_TTL // 60} minutos:\n{link}"
             )
         }
 
-    # horário ocupado
-    proximo = await sugerir_proximo_slot(data)
-    if proximo:
-        return {
-            "status": "sugestao",
-            "mensagem": (
-                f"⏳ {horario} já foi ocupado. "
-                f"Posso agendar para {proximo} ({modalidade})?"
-            )
-        }
-
-    # sem slots na data
-    return {
-        "status": "indisponivel",
-        "mensagem": (
-            f"❌ Não há mais horários disponíveis em {data}. "
-            "Deseja tentar outra data?"
-        )
-    }
+    # horário ocupado (ou dia lotado): próximos livres a partir do horário pedido
+    return await _sugerir("sugestao", f"⏳ {horario} de {data} não está disponível. ", data, horario, distancia_km)
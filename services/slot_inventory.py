@@ -0,0 +1,461 @@
+# services/slot_inventory.py
+
+import asyncio
+import datetime
+import hashlib
+import os
+import re
+import time
+import weakref
+from typing import Callable, Iterable, Optional
+
+from core import sessions
+from utils.metrics import medir
+
+# ————— Configuração —————
+# Quanto tempo uma reserva preliminar segura o horário esperando o pagamento
+SLOT_HOLD_TTL = int(os.getenv("SLOT_HOLD_TTL_MIN", "30")) * 60
+# Até quantas reservas vencidas cada operação devolve ao estoque (latência limitada)
+SLOT_RECUPERAR_MAX = int(os.getenv("SLOT_RECUPERAR_MAX", "100"))
+# Teto da fila de reservas vencidas aguardando aviso ao lead (sem varredor, as mais antigas saem)
+SLOT_EXPIRADOS_MAX = int(os.getenv("SLOT_EXPIRADOS_MAX", "100000"))
+
+# Agenda de um dia: data → [(horário, modalidades aceitas), ...]
+Agenda = Callable[[str], list[tuple[str, tuple[str, ...]]]]
+
+# Estrutura no Redis (um slot é "AAAA-MM-DD HH:MM"; pontuação = minuto absoluto,
+# dia ordinal * 1440 + minuto do dia, então a ordem do índice é a cronológica):
+#   slots:livres:todos         → sorted set com todos os slots livres
+#   slots:livres:{modalidade}  → sorted set com os slots livres que aceitam a modalidade
+#   slots:info                 → hash slot → "pontuação|índices do slot"
+#   slots:holds                → sorted set slot → expiração da reserva preliminar (epoch)
+#   slots:donos                → hash slot → lead da reserva preliminar
+#   slots:confirmados          → hash slot → lead (pagamento confirmado)
+#   slots:carregados           → hash data → versão da agenda carregada (hash dos horários do dia)
+#   slots:expirados            → lista "slot|lead" das reservas vencidas ainda não avisadas
+#
+# Toda operação é um script Lua que primeiro devolve aos índices as reservas vencidas;
+# como o Redis executa cada script de forma atômica, dois workers nunca pegam o mesmo
+# horário. Buscas ("próximos N livres a partir de X") são ZRANGEBYSCORE: O(log n + N).
+CHAVES = [
+    "slots:holds", "slots:donos", "slots:confirmados", "slots:info", "slots:carregados", "slots:expirados",
+]
+
+# ARGV comum: [1]=agora (epoch), [2]=máximo de vencidas a devolver, [3]=teto de slots:expirados;
+# os demais dependem do script
+_PRELUDIO = """
+local holds, donos, confirmados, info, carregados, expirados = KEYS[1], KEYS[2], KEYS[3], KEYS[4], KEYS[5], KEYS[6]
+local agora = tonumber(ARGV[1])
+local function indices(slot)
+  local v = redis.call('HGET', info, slot)
+  if not v then
+    return nil, {}
+  end
+  local sep = string.find(v, '|', 1, true)
+  local chaves = {}
+  for k in string.gmatch(string.sub(v, sep + 1), '[^,]+') do
+    chaves[#chaves + 1] = k
+  end
+  return tonumber(string.sub(v, 1, sep - 1)), chaves
+end
+local function devolver(slot)
+  local pontuacao, chaves = indices(slot)
+  for _, k in ipairs(chaves) do
+    redis.call('ZADD', k, pontuacao, slot)
+  end
+end
+local function retirar(slot)
+  local pontuacao, chaves = indices(slot)
+  if not pontuacao or redis.call('ZREM', chaves[1], slot) == 0 then
+    return false
+  end
+  for i = 2, #chaves do
+    redis.call('ZREM', chaves[i], slot)
+  end
+  return true
+end
+local vencidas = redis.call('ZRANGEBYSCORE', holds, '-inf', agora, 'LIMIT', 0, tonumber(ARGV[2]))
+for _, s in ipairs(vencidas) do
+  local dono = redis.call('HGET', donos, s)
+  redis.call('ZREM', holds, s)
+  redis.call('HDEL', donos, s)
+  devolver(s)
+  if dono then
+    redis.call('RPUSH', expirados, s .. '|' .. dono)
+  end
+end
+if #vencidas > 0 then
+  redis.call('LTRIM', expirados, -tonumber(ARGV[3]), -1)
+end
+"""
+
+_LUA = {
+    # ARGV[4]=pontuação mínima a manter nos índices, ARGV[5]=data de hoje, ARGV[6]=nº de índices,
+    # índices..., depois, por dia: data, versão, nº de slots, "slot|pontuação|índices" ...
+    # Dias passados saem dos índices, de slots:info, slots:carregados e slots:confirmados;
+    # dia com versão diferente da carregada tem os slots refeitos (reservas e confirmados ficam).
+    "carregar": """
+local hoje = ARGV[5]
+local i = 6
+local n_indices = tonumber(ARGV[i])
+for j = 1, n_indices do
+  redis.call('ZREMRANGEBYSCORE', ARGV[i + j], '-inf', '(' .. ARGV[4])
+end
+i = i + n_indices + 1
+local tipo = redis.call('TYPE', carregados)['ok']
+if tipo ~= 'hash' and tipo ~= 'none' then
+  redis.call('DEL', carregados)  -- formato antigo (set sem versão): recarrega tudo
+end
+for _, chave in ipairs({info, carregados, confirmados}) do
+  for _, campo in ipairs(redis.call('HKEYS', chave)) do
+    if string.sub(campo, 1, 10) < hoje then
+      redis.call('HDEL', chave, campo)
+    end
+  end
+end
+local carregados_agora = 0
+while i <= #ARGV do
+  local data, versao, n = ARGV[i], ARGV[i + 1], tonumber(ARGV[i + 2])
+  local anterior = redis.call('HGET', carregados, data)
+  if anterior ~= versao then
+    redis.call('HSET', carregados, data, versao)
+    carregados_agora = carregados_agora + 1
+    if anterior then
+      for _, slot in ipairs(redis.call('HKEYS', info)) do
+        if string.sub(slot, 1, 10) == data then
+          local _, chaves = indices(slot)
+          for _, k in ipairs(chaves) do
+            redis.call('ZREM', k, slot)
+          end
+          redis.call('HDEL', info, slot)
+        end
+      end
+    end
+    for j = i + 3, i + 2 + n do
+      local a = string.find(ARGV[j], '|', 1, true)
+      local b = string.find(ARGV[j], '|', a + 1, true)
+      local slot, pontuacao = string.sub(ARGV[j], 1, a - 1), string.sub(ARGV[j], a + 1, b - 1)
+      redis.call('HSET', info, slot, string.sub(ARGV[j], a + 1))
+      if not redis.call('HGET', confirmados, slot) and not redis.call('HGET', donos, slot) then
+        for k in string.gmatch(string.sub(ARGV[j], b + 1), '[^,]+') do
+          redis.call('ZADD', k, pontuacao, slot)
+        end
+      end
+    end
+  end
+  i = i + 3 + n
+end
+return carregados_agora
+""",
+    # ARGV[4]=slot, ARGV[5]=lead, ARGV[6]=ttl
+    # 1 = reservado agora, 2 = já era deste lead (expiração renovada), 0 = ocupado/inexistente
+    "reservar": """
+local slot, lead = ARGV[4], ARGV[5]
+local expira = agora + tonumber(ARGV[6])
+if redis.call('HGET', donos, slot) == lead then
+  redis.call('ZADD', holds, expira, slot)
+  return 2
+end
+if retirar(slot) then
+  redis.call('ZADD', holds, expira, slot)
+  redis.call('HSET', donos, slot, lead)
+  return 1
+end
+return 0
+""",
+    "liberar": """
+local slot, lead = ARGV[4], ARGV[5]
+if redis.call('HGET', donos, slot) ~= lead then
+  return 0
+end
+redis.call('ZREM', holds, slot)
+redis.call('HDEL', donos, slot)
+devolver(slot)
+return 1
+""",
+    "confirmar": """
+local slot, lead = ARGV[4], ARGV[5]
+if redis.call('HGET', confirmados, slot) == lead then
+  return 1
+end
+if redis.call('HGET', donos, slot) ~= lead then
+  return 0
+end
+redis.call('ZREM', holds, slot)
+redis.call('HDEL', donos, slot)
+redis.call('HSET', confirmados, slot, lead)
+return 1
+""",
+    # ARGV[4]=slot, ARGV[5]=lead: "confirmado", "preliminar" (reserva válida) ou "" (não é do lead)
+    "situacao": """
+local slot, lead = ARGV[4], ARGV[5]
+if redis.call('HGET', confirmados, slot) == lead then
+  return 'confirmado'
+end
+if redis.call('HGET', donos, slot) == lead then
+  return 'preliminar'
+end
+return ''
+""",
+    "disponivel": """
+local pontuacao, chaves = indices(ARGV[4])
+if pontuacao and redis.call('ZSCORE', chaves[1], ARGV[4]) then
+  return 1
+end
+return 0
+""",
+    # ARGV[4]=quantidade: retira da fila as reservas vencidas para avisar os leads
+    "expirar": """
+local lote = redis.call('LRANGE', expirados, 0, tonumber(ARGV[4]) - 1)
+redis.call('LTRIM', expirados, #lote, -1)
+return lote
+""",
+    # ARGV[4]=índice, ARGV[5]=mínimo, ARGV[6]=máximo, ARGV[7]=quantidade
+    "proximos": """
+return redis.call('ZRANGEBYSCORE', ARGV[4], ARGV[5], ARGV[6], 'LIMIT', 0, tonumber(ARGV[7]))
+""",
+    # ARGV[4]=data, ARGV[5]=índice, ARGV[6]=mínimo, ARGV[7]=máximo
+    "estado": """
+local function do_dia(pares)
+  local r = {}
+  for i = 1, #pares, 2 do
+    if string.sub(pares[i], 1, 10) == ARGV[4] then
+      r[#r + 1] = pares[i]
+      r[#r + 1] = pares[i + 1]
+    end
+  end
+  return r
+end
+return {
+  redis.call('ZRANGEBYSCORE', ARGV[5], ARGV[6], ARGV[7]),
+  do_dia(redis.call('HGETALL', donos)),
+  do_dia(redis.call('HGETALL', confirmados)),
+}
+""",
+}
+
+# Scripts registrados (SHA calculado uma vez; EVALSHA no cliente da chamada)
+_scripts: dict[str, object] = {}
+# Por cliente Redis: data → versão já carregada por este processo (evita reenviar a agenda)
+# e a trava do carregamento (requisições simultâneas enviam a agenda uma vez só)
+_carregados: "weakref.WeakKeyDictionary[object, dict]" = weakref.WeakKeyDictionary()
+_travas: "weakref.WeakKeyDictionary[object, tuple]" = weakref.WeakKeyDictionary()
+
+
+def _agora() -> float:
+    return time.time()
+
+
+def normalizar_horario(horario: str) -> str:
+    """
+    "9:00" → "09:00". Levanta ValueError para formatos inválidos.
+    """
+    m = re.fullmatch(r"\s*([01]?\d|2[0-3]):([0-5]\d)\s*", horario or "")
+    if not m:
+        raise ValueError(f"[ERRO] Horário inválido: {horario!r}")
+    return f"{int(m.group(1)):02d}:{m.group(2)}"
+
+
+def chave_indice(modalidade: Optional[str] = None) -> str:
+    return f"slots:livres:{modalidade or 'todos'}"
+
+
+def slot_id(data: str, horario: str) -> str:
+    return f"{data} {horario}"
+
+
+def pontuacao(data: str, horario: str = "00:00") -> int:
+    """
+    Minuto absoluto do slot (ordem cronológica no índice).
+    """
+    return datetime.date.fromisoformat(data).toordinal() * 1440 + int(horario[:2]) * 60 + int(horario[3:])
+
+
+def minuto_atual() -> int:
+    """
+    Minuto absoluto de agora (hora local), na escala de `pontuacao`.
+    """
+    agora = datetime.datetime.fromtimestamp(_agora())
+    return agora.date().toordinal() * 1440 + agora.hour * 60 + agora.minute
+
+
+def ja_passou(data: str, horario: str) -> bool:
+    """
+    O horário já começou (ou passou): não pode mais ser reservado nem sugerido.
+    """
+    return pontuacao(data, normalizar_horario(horario)) <= minuto_atual()
+
+
+async def _executar(nome: str, *args, recuperar: int = SLOT_RECUPERAR_MAX):
+    cliente = sessions.redis_client
+    if nome not in _scripts:
+        _scripts[nome] = cliente.register_script(_PRELUDIO + _LUA[nome])
+    with medir("redis", f"slots_{nome}"):
+        return await _scripts[nome](
+            keys=CHAVES, args=[_agora(), recuperar, SLOT_EXPIRADOS_MAX, *args], client=cliente
+        )
+
+
+def _versao(horarios: list) -> str:
+    return hashlib.blake2b(repr(horarios).encode(), digest_size=8).hexdigest()
+
+
+async def garantir_dias(datas: Iterable[str], agenda: Agenda):
+    """
+    Carrega no índice os dias ainda não carregados e recarrega os que mudaram na
+    agenda (exceção por data, agenda semanal, modalidades): cada dia guarda a versão
+    dos seus horários, então é enviado uma vez por versão, mesmo com vários workers.
+    Descarta os slots de dias passados.
+    """
+    cliente = sessions.redis_client
+    carregadas = _carregados.setdefault(cliente, {})
+    dias = {d: agenda(d) for d in datas}
+    versoes = {d: _versao(horarios) for d, horarios in dias.items()}
+    if all(carregadas.get(d) == v for d, v in versoes.items()):
+        return
+    loop = asyncio.get_running_loop()
+    trava_loop, trava = _travas.get(cliente, (None, None))
+    if trava_loop is not loop:
+        trava = asyncio.Lock()
+        _travas[cliente] = (loop, trava)
+    async with trava:
+        novas = {d: dias[d] for d, v in versoes.items() if carregadas.get(d) != v}
+        if novas:
+            hoje = datetime.date.fromtimestamp(_agora()).isoformat()
+            await _carregar(novas, versoes, hoje)
+            for data in [d for d in carregadas if d < hoje]:
+                del carregadas[data]
+            carregadas.update({d: versoes[d] for d in novas})
+
+
+async def _carregar(novas: dict[str, list], versoes: dict[str, str], hoje: str):
+    args = []
+    modalidades = set()
+    for data, horarios in novas.items():
+        slots = []
+        for horario, aceitas in horarios:
+            horario = normalizar_horario(horario)
+            indices = [chave_indice()] + [chave_indice(m) for m in aceitas]
+            modalidades.update(aceitas)
+            slots.append(f"{slot_id(data, horario)}|{pontuacao(data, horario)}|{','.join(indices)}")
+        args += [data, versoes[data], len(slots), *slots]
+    indices = [chave_indice()] + [chave_indice(m) for m in sorted(modalidades)]
+    await _executar("carregar", pontuacao(hoje), hoje, len(indices), *indices, *args)
+
+
+def limpar_cache_agenda():
+    """
+    Esquece quais dias este processo já carregou (ex.: após trocar o Redis).
+    """
+    _carregados.clear()
+
+
+async def reservar(
+    data: str, horario: str, lead_id: str, agenda: Agenda, ttl: int = SLOT_HOLD_TTL
+) -> Optional[float]:
+    """
+    Reserva preliminar atômica do horário para o lead, válida por `ttl` segundos.
+    Retorna a expiração (epoch) ou None se o horário não estiver livre (ou já passou).
+    Repetir a reserva do mesmo lead renova a expiração.
+    """
+    if ja_passou(data, horario):
+        return None
+    await garantir_dias([data], agenda)
+    agora = _agora()
+    ok = await _executar("reservar", slot_id(data, normalizar_horario(horario)), lead_id, ttl)
+    return agora + ttl if ok else None
+
+
+async def liberar(data: str, horario: str, lead_id: str, agenda: Agenda) -> bool:
+    """
+    Devolve ao estoque a reserva preliminar do lead (ex.: pagamento cancelado).
+    """
+    await garantir_dias([data], agenda)
+    return bool(await _executar("liberar", slot_id(data, normalizar_horario(horario)), lead_id))
+
+
+async def confirmar(data: str, horario: str, lead_id: str, agenda: Agenda) -> bool:
+    """
+    Converte a reserva preliminar do lead em definitiva. Falha se ela já expirou
+    (e o horário voltou ao estoque ou foi pego por outro lead).
+    """
+    await garantir_dias([data], agenda)
+    return bool(await _executar("confirmar", slot_id(data, normalizar_horario(horario)), lead_id))
+
+
+async def situacao(data: str, horario: str, lead_id: str, agenda: Agenda) -> Optional[str]:
+    """
+    "confirmado", "preliminar" (reserva ainda válida) ou None se o horário não é do lead.
+    """
+    await garantir_dias([data], agenda)
+    return await _executar("situacao", slot_id(data, normalizar_horario(horario)), lead_id) or None
+
+
+async def expirar_vencidas(quantidade: int = SLOT_RECUPERAR_MAX) -> list[tuple[str, str, str]]:
+    """
+    Devolve ao estoque as reservas preliminares vencidas e retira da fila até
+    `quantidade` delas para aviso: [(data, horário, lead), ...]. Inclui as que outras
+    operações já devolveram de passagem. Cada vencida sai para um único chamador,
+    mesmo com vários workers varrendo o mesmo Redis.
+    Custo: O(log n) por reserva vencida, independente do total de reservas pendentes.
+    """
+    lote = await _executar("expirar", quantidade, recuperar=quantidade)
+    vencidas = []
+    for item in lote:
+        slot, lead = item.split("|", 1)
+        data, horario = slot.split(" ")
+        vencidas.append((data, horario, lead))
+    return vencidas
+
+
+async def disponivel(data: str, horario: str, agenda: Agenda) -> bool:
+    try:
+        horario = normalizar_horario(horario)
+    except ValueError:
+        return False
+    await garantir_dias([data], agenda)
+    return bool(await _executar("disponivel", slot_id(data, horario)))
+
+
+async def proximos_livres(
+    data: str,
+    agenda: Agenda,
+    quantidade: int = 1,
+    depois_de: Optional[str] = None,
+    modalidade: Optional[str] = None,
+    horizonte_dias: int = 90,
+) -> list[tuple[str, str]]:
+    """
+    Próximos `quantidade` slots livres a partir de `data` (estritamente depois de
+    `depois_de`, se informado, e de agora), até `horizonte_dias` à frente, só entre
+    os que aceitam a `modalidade` (None = qualquer). Retorna [(data, horário), ...].
+    """
+    inicio = datetime.date.fromisoformat(data)
+    await garantir_dias(
+        [(inicio + datetime.timedelta(days=d)).isoformat() for d in range(horizonte_dias + 1)], agenda
+    )
+    minimo = pontuacao(data, normalizar_horario(depois_de)) + 1 if depois_de else pontuacao(data)
+    minimo = max(minimo, minuto_atual() + 1)  # hoje: só horários que ainda não começaram
+    maximo = f"({pontuacao((inicio + datetime.timedelta(days=horizonte_dias + 1)).isoformat())}"
+    slots = await _executar("proximos", chave_indice(modalidade), minimo, maximo, quantidade)
+    return [tuple(s.split(" ")) for s in slots]
+
+
+async def estado_dia(data: str, agenda: Agenda) -> dict:
+    """
+    Livres, reservas preliminares e confirmados do dia (diagnóstico e testes).
+    """
+    await garantir_dias([data], agenda)
+    fim = (datetime.date.fromisoformat(data) + datetime.timedelta(days=1)).isoformat()
+    livres, donos, confirmados = await _executar(
+        "estado", data, chave_indice(), pontuacao(data), f"({pontuacao(fim)}"
+    )
+
+    def _pares(valores: list) -> dict:
+        return {slot.split(" ")[1]: lead for slot, lead in zip(valores[::2], valores[1::2])}
+
+    return {
+        "livres": [s.split(" ")[1] for s in livres],
+        "reservados": _pares(donos),
+        "confirmados": _pares(confirmados),
+    }
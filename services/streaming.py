@@ -0,0 +1,106 @@
+# services/streaming.py
+
+import asyncio
+import os
+import re
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from utils.logger import log_event
+from utils.zapi import enviar_mensagem_zapi
+
+# ————— Configuração do streaming —————
+LLM_STREAMING = os.getenv("LLM_STREAMING", "0") == "1"
+STREAM_MIN_CHARS = int(os.getenv("STREAM_MIN_CHARS", "80"))    # evita mensagens picadas demais
+STREAM_MAX_CHARS = int(os.getenv("STREAM_MAX_CHARS", "700"))   # corta mesmo sem fim de frase
+STREAM_DIGITANDO_S = int(os.getenv("STREAM_DIGITANDO_S", "1"))  # "digitando..." antes de cada fragmento
+
+_FIM_DE_FRASE = re.compile(r"[.!?…:;](?=\s)")
+
+Enviar = Callable[[str, str], Awaitable[object]]
+
+
+def _encontrar_corte(buffer: str, min_chars: int, max_chars: int) -> Optional[int]:
+    """
+    Posição onde cortar o buffer, ou None se ainda não é hora:
+    1) quebra de parágrafo (sempre corta)
+    2) último fim de frase depois de min_chars
+    3) último espaço antes de max_chars, se o buffer estourou
+    """
+    paragrafo = buffer.find("\n\n")
+    if paragrafo > 0:
+        return paragrafo
+    if len(buffer) < min_chars:
+        return None
+    finais = [m.end() for m in _FIM_DE_FRASE.finditer(buffer, min_chars - 1)]
+    if finais:
+        return finais[-1]
+    if len(buffer) >= max_chars:
+        espaco = buffer.rfind(" ", 0, max_chars)
+        return espaco if espaco > 0 else max_chars
+    return None
+
+
+async def fatiar_em_mensagens(
+    trechos: AsyncIterator[str],
+    min_chars: int = STREAM_MIN_CHARS,
+    max_chars: int = STREAM_MAX_CHARS,
+) -> AsyncIterator[str]:
+    """
+    Agrupa os tokens do modelo em fragmentos do tamanho de frases/parágrafos,
+    liberando cada um assim que termina.
+    """
+    buffer = ""
+    async for trecho in trechos:
+        buffer += trecho
+        while (corte := _encontrar_corte(buffer, min_chars, max_chars)) is not None:
+            fragmento, buffer = buffer[:corte].strip(), buffer[corte:].lstrip()
+            if fragmento:
+                yield fragmento
+    if buffer.strip():
+        yield buffer.strip()
+
+
+async def _enviar_zapi_digitando(numero: str, texto: str):
+    await enviar_mensagem_zapi(numero, texto, delay_typing=STREAM_DIGITANDO_S)
+
+
+async def tentar_enviar(enviar: Enviar, numero: str, texto: str) -> bool:
+    """
+    Envia um fragmento; a falha (Z-API fora, tentativas esgotadas) é registrada e
+    não interrompe a resposta: os próximos fragmentos e o histórico seguem.
+    """
+    try:
+        await enviar(numero, texto)
+        return True
+    except Exception as e:
+        log_event("❌ Erro ao enviar fragmento Z-API", {"error": str(e), "body": {"phone": numero, "message": texto}})
+        return False
+
+
+async def transmitir_resposta(
+    numero: str,
+    trechos: AsyncIterator[str],
+    enviar: Enviar = _enviar_zapi_digitando,
+) -> str:
+    """
+    Consome o stream do modelo e envia cada fragmento pronto pelo WhatsApp.
+    Os envios acontecem em ordem e em paralelo com a geração dos próximos tokens;
+    um envio que falha é registrado e não interrompe os demais.
+    Retorna o texto completo (para o histórico).
+    """
+    fragmentos: list[str] = []
+    anterior: Optional[asyncio.Task] = None
+
+    async def enviar_em_ordem(espera: Optional[asyncio.Task], texto: str):
+        if espera is not None:
+            await espera
+        await tentar_enviar(enviar, numero, texto)
+
+    try:
+        async for fragmento in fatiar_em_mensagens(trechos):
+            fragmentos.append(fragmento)
+            anterior = asyncio.create_task(enviar_em_ordem(anterior, fragmento))
+    finally:
+        if anterior is not None:
+            await anterior
+    return "\n\n".join(fragmentos)
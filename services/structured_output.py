@@ -0,0 +1,201 @@
+# services/structured_output.py
+
+import json
+import re
+from typing import Literal, Optional, Type
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+from services.intent import normalizar_texto
+from utils.logger import log_event
+
+# Flags consumidas por services/choose_product.escolher_produto
+FLAGS_PERFIL = ("is_ttc", "is_gest", "bad_sperm", "is_child8", "menopausa")
+
+# Como o modelo costuma escrever cada flag (normalizado) → flag canônica
+SINONIMOS_FLAGS = {
+    "is_ttc": "is_ttc", "ttc": "is_ttc", "tentante": "is_ttc", "tentando engravidar": "is_ttc",
+    "is_gest": "is_gest", "gestante": "is_gest", "gravida": "is_gest", "gestacao": "is_gest",
+    "bad_sperm": "bad_sperm", "espermograma ruim": "bad_sperm", "espermograma_ruim": "bad_sperm",
+    "espermograma alterado": "bad_sperm",
+    "is_child8": "is_child8", "crianca 8 anos": "is_child8", "crianca_8_anos": "is_child8",
+    "crianca de 8 anos": "is_child8", "crianca": "is_child8",
+    "menopausa": "menopausa", "climaterio": "menopausa",
+}
+
+_TEMPERATURAS = {"quente": "quente", "morno": "morno", "morna": "morno", "frio": "frio", "fria": "frio"}
+
+_stats = {"total": 0, "direto": 0, "reparado": 0, "falha_json": 0, "falha_validacao": 0}
+
+
+# ————— Modelos —————
+class PerfilLead(BaseModel):
+    """
+    Saída do terminal NORA_PERFIL, já normalizada para o escolher_produto.
+    """
+    flags: dict[str, bool] = Field(default_factory=dict)
+    urgencia: int = Field(0, ge=0, le=100)
+    temperatura: Literal["quente", "morno", "frio"] = "morno"
+
+    @field_validator("flags", mode="before")
+    @classmethod
+    def _normalizar_flags(cls, valor):
+        if valor is None:
+            return {}
+        if isinstance(valor, str):
+            valor = [v for v in re.split(r"[,;]", valor) if v.strip()]
+        if isinstance(valor, list):
+            valor = {str(v): True for v in valor}
+        if not isinstance(valor, dict):
+            raise ValueError("flags deve ser objeto ou lista")
+        flags = {}
+        for nome, ativa in valor.items():
+            canonica = SINONIMOS_FLAGS.get(normalizar_texto(str(nome)).replace("-", " "))
+            if canonica and (ativa is True or str(ativa).lower() in ("true", "sim", "1")):
+                flags[canonica] = True
+        return flags
+
+    @field_validator("urgencia", mode="before")
+    @classmethod
+    def _normalizar_urgencia(cls, valor):
+        if isinstance(valor, str):
+            numero = re.search(r"\d+(?:[.,]\d+)?", valor)
+            if not numero:
+                raise ValueError("urgência sem número")
+            valor = float(numero.group().replace(",", "."))
+        if isinstance(valor, float):
+            valor = round(valor * 100) if 0 < valor < 1 else round(valor)
+        return max(0, min(100, valor)) if isinstance(valor, int) else valor
+
+    @field_validator("temperatura", mode="before")
+    @classmethod
+    def _normalizar_temperatura(cls, valor):
+        return _TEMPERATURAS.get(normalizar_texto(str(valor or "")), "morno")
+
+
+def formato_json(modelo: Type[BaseModel]) -> str:
+    """
+    Exemplo do JSON esperado, para incluir no prompt (o modo JSON do Ollama
+    garante a sintaxe; o exemplo guia as chaves e os valores).
+    """
+    exemplo = {
+        "flags": {f: False for f in FLAGS_PERFIL},
+        "urgencia": 0,
+        "temperatura": "quente|morno|frio",
+    }
+    if "produto" in modelo.model_fields:
+        exemplo["produto"] = "nome do produto"
+    return json.dumps(exemplo, ensure_ascii=False)
+
+
+# ————— Reparo de JSON —————
+_CERCA = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_VIRGULA_FINAL = re.compile(r",\s*([}\]])")
+_LITERAIS_PY = re.compile(r"\b(True|False|None)\b")
+
+
+def _recortar_objeto(texto: str) -> Optional[str]:
+    """
+    Primeiro objeto {...} balanceado do texto (ignora chaves dentro de strings).
+    """
+    inicio = texto.find("{")
+    if inicio < 0:
+        return None
+    profundidade, em_string, escape = 0, None, False
+    for i in range(inicio, len(texto)):
+        c = texto[i]
+        if em_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == em_string:
+                em_string = None
+        elif c in "\"'":
+            em_string = c
+        elif c == "{":
+            profundidade += 1
+        elif c == "}":
+            profundidade -= 1
+            if profundidade == 0:
+                return texto[inicio:i + 1]
+    # Cortado no meio (limite de tokens): fecha o que ficou aberto
+    return texto[inicio:] + "}" * profundidade
+
+
+def reparar_json(texto: str) -> str:
+    """
+    Conserta as malformações mais comuns da saída do modelo, sem nova geração:
+    cercas de markdown, texto antes/depois do objeto, vírgula sobrando,
+    aspas simples e True/False/None do Python.
+    """
+    cerca = _CERCA.search(texto)
+    if cerca:
+        texto = cerca.group(1)
+    objeto = _recortar_objeto(texto)
+    if objeto is None:
+        raise ValueError("[ERRO] Nenhum objeto JSON na resposta do modelo.")
+    objeto = _VIRGULA_FINAL.sub(r"\1", objeto)
+    if '"' not in objeto:
+        objeto = objeto.replace("'", '"')
+    return _LITERAIS_PY.sub(lambda m: {"True": "true", "False": "false", "None": "null"}[m.group()], objeto)
+
+
+def interpretar(texto: str, modelo: Type[BaseModel] = PerfilLead) -> BaseModel:
+    """
+    Converte a resposta bruta do modelo em `modelo` validado.
+    Tenta o JSON direto e, se falhar, a versão reparada.
+    Levanta ValueError quando nem o reparo salva.
+    """
+    _stats["total"] += 1
+    try:
+        dados = json.loads(texto)
+        origem = "direto"
+    except (json.JSONDecodeError, TypeError):
+        try:
+            dados = json.loads(reparar_json(str(texto)))
+            origem = "reparado"
+        except (json.JSONDecodeError, ValueError) as e:
+            _stats["falha_json"] += 1
+            raise ValueError(f"[ERRO] Saída do modelo não é JSON: {e}") from e
+
+    if not isinstance(dados, dict):
+        _stats["falha_json"] += 1
+        raise ValueError("[ERRO] Saída do modelo não é um objeto JSON.")
+    try:
+        resultado = modelo.model_validate(dados)
+    except ValidationError as e:
+        _stats["falha_validacao"] += 1
+        raise ValueError(f"[ERRO] Saída do modelo fora do esquema: {e.errors()[0]['msg']}") from e
+    _stats[origem] += 1
+    return resultado
+
+
+def interpretar_ou_padrao(texto: str, modelo: Type[BaseModel] = PerfilLead) -> dict:
+    """
+    Como interpretar(), mas nunca falha: em caso de erro devolve os valores
+    padrão do modelo com a chave "erro".
+    """
+    try:
+        return interpretar(texto, modelo).model_dump()
+    except ValueError as e:
+        log_event("❌ Falha ao interpretar saída estruturada", {"error": str(e), "resposta": str(texto)[:300]})
+        return {**modelo().model_dump(), "erro": str(e)}
+
+
+def estatisticas_saida_estruturada() -> dict:
+    """
+    Contadores de interpretação: direto, reparado e falhas (JSON e esquema).
+    """
+    total = _stats["total"]
+    falhas = _stats["falha_json"] + _stats["falha_validacao"]
+    return {
+        **_stats,
+        "taxa_falha": (falhas / total) if total else 0.0,
+        "taxa_reparo": (_stats["reparado"] / total) if total else 0.0,
+    }
+
+
+def limpar_estatisticas_saida_estruturada():
+    for chave in _stats:
+        _stats[chave] = 0
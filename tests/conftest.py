@@ -0,0 +1,21 @@
+# tests/conftest.py
+
+import os
+
+import pytest
+from dotenv import load_dotenv
+
+# Carrega o .env antes de qualquer import do app (core.db lê a configuração do
+# Supabase no import)
+load_dotenv(os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+
+@pytest.fixture(autouse=True)
+def _cache_respostas_limpo():
+    # O cache de respostas é global ao processo: cada teste começa vazio
+    from services.response_cache import get_cache_respostas
+
+    yield
+    cache = get_cache_respostas()
+    if cache is not None:
+        cache.limpar()
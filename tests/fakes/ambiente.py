@@ -0,0 +1,94 @@
+# tests/fakes/ambiente.py
+
+import os
+from typing import Optional
+
+import fakeredis
+
+import core.db as db
+import core.sessions as sessions
+import services.dialog_engine as dialog_engine
+import services.llm as llm
+import services.slot_inventory as slot_inventory
+import utils.zapi as zapi
+from models.lead import limpar_cache_leads
+from services.memory import limpar_memorias
+from services.response_cache import get_cache_respostas
+from tests.fakes.ollama import FakeOllama
+from tests.fakes.supabase import FakeSupabase, fake_supabase_leads
+from tests.fakes.zapi import FakeZapi
+
+
+class AmbienteLocal:
+    """
+    Liga o app aos substitutos locais dos serviços externos, para testes ponta a
+    ponta e benchmarks sem Redis, Supabase, Ollama nem Z-API de verdade:
+    - Redis: fakeredis (sessões, estoque de slots, dedup, cobranças)
+    - Supabase: cliente em memória (tabelas leads e lead_eventos)
+    - Ollama: servidor HTTP falso numa thread (OLLAMA_URL aponta para ele); com uma
+      URL, usa um servidor já rodando (ex.: Ollama falso em outro processo)
+    - Z-API: servidor falso via transporte ASGI, registrando as mensagens enviadas
+    Ao sair, restaura a configuração anterior e limpa os caches de processo.
+
+        with AmbienteLocal(FakeOllama(latencia=0.2)) as ambiente:
+            ...
+            ambiente.zapi.mensagens
+    """
+
+    def __init__(
+        self,
+        ollama: Optional[FakeOllama | str] = None,
+        zapi_falsa: Optional[FakeZapi] = None,
+        supabase: Optional[FakeSupabase] = None,
+        redis=None,
+    ):
+        self.ollama = ollama or FakeOllama()
+        self.zapi = zapi_falsa or FakeZapi()
+        self.supabase = supabase or fake_supabase_leads()
+        self.redis = redis or fakeredis.aioredis.FakeRedis(decode_responses=True, max_connections=10_000)
+        self._anteriores: list[tuple[object, str, object]] = []
+        self._ollama_url: Optional[str] = None
+
+    def _trocar(self, alvo, nome: str, valor):
+        self._anteriores.append((alvo, nome, getattr(alvo, nome)))
+        setattr(alvo, nome, valor)
+
+    @staticmethod
+    def _limpar_caches():
+        llm.limpar_clientes_llm()
+        limpar_cache_leads()
+        limpar_memorias()
+        slot_inventory.limpar_cache_agenda()
+        cache = get_cache_respostas()
+        if cache is not None:
+            cache.limpar()
+
+    def __enter__(self) -> "AmbienteLocal":
+        url = self.ollama if isinstance(self.ollama, str) else self.ollama.iniciar()
+        self._ollama_url = os.environ.get("OLLAMA_URL")
+        os.environ["OLLAMA_URL"] = url
+        self._trocar(sessions, "redis_client", self.redis)
+        self._trocar(dialog_engine, "MOCK_OPENAI", False)
+        self._trocar(zapi, "MOCK_ZAPI", False)
+        self._trocar(zapi, "ZAPI_API_URL", "http://fake-zapi")
+        self._trocar(zapi, "ZAPI_INSTANCE", "local")
+        self._trocar(zapi, "ZAPI_TOKEN", "local")
+        zapi.configurar_transporte(self.zapi.transport())
+        db.usar_cliente_supabase(self.supabase)
+        self._limpar_caches()
+        return self
+
+    def __exit__(self, *exc):
+        for alvo, nome, valor in reversed(self._anteriores):
+            setattr(alvo, nome, valor)
+        self._anteriores.clear()
+        if self._ollama_url is None:
+            os.environ.pop("OLLAMA_URL", None)
+        else:
+            os.environ["OLLAMA_URL"] = self._ollama_url
+        zapi.configurar_transporte(None)
+        db.usar_cliente_supabase(None)
+        self._limpar_caches()
+        if isinstance(self.ollama, FakeOllama):
+            self.ollama.parar()
+        return False
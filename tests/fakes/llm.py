@@ -0,0 +1,43 @@
+# tests/fakes/llm.py
+
+import asyncio
+
+
+class FakeLLM:
+    """
+    Substituto do OllamaLLM para testes: responde com `resposta` (ou ecoa o prompt),
+    simula latência e registra prompts e o pico de gerações simultâneas.
+    """
+
+    instancias: list["FakeLLM"] = []
+
+    def __init__(self, model: str = "fake", base_url: str = "", resposta: str | None = None,
+                 latencia: float = 0.0, **opcoes):
+        self.model = model
+        self.base_url = base_url
+        self.opcoes = opcoes
+        self.resposta = resposta
+        self.latencia = latencia
+        self.prompts: list[str] = []
+        self.em_voo = 0
+        self.pico_em_voo = 0
+        FakeLLM.instancias.append(self)
+
+    def _gerar(self, prompt: str) -> str:
+        return self.resposta if self.resposta is not None else f"[FAKE] {prompt[-40:]}"
+
+    async def ainvoke(self, prompt: str) -> str:
+        self.prompts.append(prompt)
+        self.em_voo += 1
+        self.pico_em_voo = max(self.pico_em_voo, self.em_voo)
+        try:
+            await asyncio.sleep(self.latencia)
+            return self._gerar(prompt)
+        finally:
+            self.em_voo -= 1
+
+    async def astream(self, prompt: str):
+        self.prompts.append(prompt)
+        for palavra in self._gerar(prompt).split(" "):
+            await asyncio.sleep(self.latencia)
+            yield palavra + " "
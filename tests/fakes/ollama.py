@@ -0,0 +1,127 @@
+# tests/fakes/ollama.py
+
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+RESPOSTA_PADRAO = (
+    "Olá! Posso te ajudar com informações sobre a consulta, os valores e os horários "
+    "disponíveis. Quer que eu verifique a agenda desta semana para você?"
+)
+
+
+class FakeOllama:
+    """
+    Servidor Ollama falso (POST /api/generate, NDJSON) para testes e benchmarks.
+    Fala o protocolo HTTP real, então o OllamaLLM do app roda sem alterações
+    (pool de conexões, parsing do stream) apontando OLLAMA_URL para ele.
+    - latencia: segundos até o primeiro token (processamento do prompt)
+    - tokens_por_segundo: ritmo da geração (0 = todos de uma vez)
+    - resposta: texto gerado; cada palavra é um token
+    """
+
+    def __init__(self, latencia: float = 0.0, tokens_por_segundo: float = 0.0, resposta: str = RESPOSTA_PADRAO):
+        self.latencia = latencia
+        self.tokens_por_segundo = tokens_por_segundo
+        self.resposta = resposta
+        self.prompts: list[str] = []
+        self.tokens = 0
+        self.em_voo = 0
+        self.pico_em_voo = 0
+        self.app = FastAPI(title="Fake Ollama")
+        self._servidor = None
+        self._thread: Optional[threading.Thread] = None
+
+        @self.app.post("/api/generate")
+        async def generate(request: Request):
+            corpo = await request.json()
+            self.prompts.append(corpo.get("prompt", ""))
+            modelo = corpo.get("model", "fake")
+            if not corpo.get("stream", True):
+                texto = "".join([t async for t in self._gerar()])
+                return JSONResponse(self._parte(modelo, texto, done=True))
+
+            async def linhas():
+                async for token in self._gerar():
+                    yield json.dumps(self._parte(modelo, token)) + "\n"
+                yield json.dumps(self._parte(modelo, "", done=True)) + "\n"
+
+            return StreamingResponse(linhas(), media_type="application/x-ndjson")
+
+        @self.app.get("/api/tags")
+        async def tags():
+            return {"models": [{"name": "fake", "model": "fake"}]}
+
+    async def _gerar(self):
+        self.em_voo += 1
+        self.pico_em_voo = max(self.pico_em_voo, self.em_voo)
+        try:
+            if self.latencia:
+                await asyncio.sleep(self.latencia)
+            intervalo = 1 / self.tokens_por_segundo if self.tokens_por_segundo else 0
+            palavras = self.resposta.split(" ")
+            for n, palavra in enumerate(palavras):
+                if intervalo:
+                    await asyncio.sleep(intervalo)
+                self.tokens += 1
+                yield palavra if n == len(palavras) - 1 else palavra + " "
+        finally:
+            self.em_voo -= 1
+
+    @staticmethod
+    def _parte(modelo: str, texto: str, done: bool = False) -> dict:
+        parte = {
+            "model": modelo,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "response": texto,
+            "done": done,
+        }
+        if done:
+            parte["done_reason"] = "stop"
+        return parte
+
+    def iniciar(self, porta: int = 0) -> str:
+        """
+        Sobe o servidor numa thread (porta 0 = livre) e devolve a URL base.
+        """
+        import uvicorn
+
+        config = uvicorn.Config(self.app, host="127.0.0.1", port=porta, log_level="warning", lifespan="off")
+        self._servidor = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._servidor.run, daemon=True)
+        self._thread.start()
+        limite = time.monotonic() + 10
+        while not self._servidor.started:
+            if time.monotonic() > limite or not self._thread.is_alive():
+                raise RuntimeError("[ERRO] Ollama falso não subiu")
+            time.sleep(0.01)
+        porta = self._servidor.servers[0].sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{porta}"
+
+    def parar(self):
+        if self._servidor is not None:
+            self._servidor.should_exit = True
+            self._thread.join(timeout=5)
+            self._servidor = None
+
+
+if __name__ == "__main__":
+    # Sobe o servidor falso localmente: OLLAMA_URL=http://localhost:11499
+    import argparse
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Ollama falso")
+    parser.add_argument("--porta", type=int, default=11499)
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos até o primeiro token")
+    parser.add_argument("--tokens-por-segundo", type=float, default=0.0)
+    args = parser.parse_args()
+    uvicorn.run(
+        FakeOllama(args.latencia, args.tokens_por_segundo).app, host="127.0.0.1", port=args.porta, log_level="warning"
+    )
@@ -0,0 +1,197 @@
+# tests/fakes/supabase.py
+
+import asyncio
+import copy
+from dataclasses import dataclass
+from typing import Optional
+
+
+class ErroPostgrest(Exception):
+    pass
+
+
+@dataclass
+class Resposta:
+    data: list | dict | None
+    error: Optional[str] = None
+    count: Optional[int] = None
+
+
+class _Consulta:
+    """
+    Subconjunto do query builder assíncrono do supabase-py usado pelo app:
+    select/insert/upsert/update/delete + eq/in_/limit/single, com execute() aguardável.
+    """
+
+    def __init__(self, banco: "FakeSupabase", tabela: str):
+        self.banco = banco
+        self.tabela = tabela
+        self.operacao = "select"
+        self.colunas = "*"
+        self.dados = None
+        self.on_conflict: Optional[str] = None
+        self.filtros: list[tuple[str, object]] = []
+        self.filtros_em: list[tuple[str, list]] = []
+        self.limite: Optional[int] = None
+        self.unico = False
+
+    # ——— operações ———
+    def select(self, colunas: str = "*", **_):
+        self.operacao, self.colunas = "select", colunas
+        return self
+
+    def insert(self, dados, default_to_null: bool = True, **_):
+        self.operacao, self.dados, self.default_to_null = "insert", dados, default_to_null
+        return self
+
+    def upsert(self, dados, on_conflict: str = "", ignore_duplicates: bool = False, default_to_null: bool = True, **_):
+        self.operacao, self.dados, self.on_conflict = "upsert", dados, on_conflict or "id"
+        self.ignore_duplicates, self.default_to_null = ignore_duplicates, default_to_null
+        return self
+
+    def update(self, dados, **_):
+        self.operacao, self.dados = "update", dados
+        return self
+
+    def delete(self, **_):
+        self.operacao = "delete"
+        return self
+
+    # ——— filtros ———
+    def eq(self, coluna: str, valor):
+        self.filtros.append((coluna, valor))
+        return self
+
+    def in_(self, coluna: str, valores):
+        self.filtros_em.append((coluna, list(valores)))
+        return self
+
+    def limit(self, n: int):
+        self.limite = n
+        return self
+
+    def single(self):
+        self.unico = True
+        return self
+
+    def _filtra(self, linha: dict) -> bool:
+        return all(linha.get(c) == v for c, v in self.filtros) and all(
+            linha.get(c) in valores for c, valores in self.filtros_em
+        )
+
+    def _projeta(self, linha: dict) -> dict:
+        if self.colunas.strip() == "*":
+            return copy.deepcopy(linha)
+        return {c.strip(): copy.deepcopy(linha.get(c.strip())) for c in self.colunas.split(",")}
+
+    def _valida_colunas(self, dados: dict):
+        conhecidas = self.banco.colunas.get(self.tabela)
+        if conhecidas is None:
+            return
+        desconhecidas = set(dados) - set(conhecidas)
+        if desconhecidas:
+            raise ErroPostgrest(f"PGRST204: coluna(s) {sorted(desconhecidas)} não existem em {self.tabela}")
+
+    async def execute(self) -> Resposta:
+        self.banco.requisicoes.append((self.tabela, self.operacao))
+        if self.banco.latencia:
+            await asyncio.sleep(self.banco.latencia)
+        if self.banco.falhas_transitorias > 0:
+            self.banco.falhas_transitorias -= 1
+            raise ConnectionError("timeout simulado")
+        linhas = self.banco.tabelas.setdefault(self.tabela, [])
+
+        if self.operacao == "select":
+            resultado = [self._projeta(l) for l in linhas if self._filtra(l)]
+            if self.limite is not None:
+                resultado = resultado[:self.limite]
+            if self.unico:
+                if len(resultado) != 1:
+                    raise ErroPostgrest("PGRST116: JSON object requested, multiple (or no) rows returned")
+                return Resposta(resultado[0])
+            return Resposta(resultado)
+
+        if self.operacao in ("insert", "upsert"):
+            novos = self.dados if isinstance(self.dados, list) else [self.dados]
+            if isinstance(self.dados, list) and self.default_to_null:
+                # Como o PostgREST em lote: coluna ausente numa linha e presente em outra vira NULL
+                colunas = {c for dados in novos for c in dados}
+                novos = [{c: dados.get(c) for c in colunas} for dados in novos]
+            gravados = []
+            for dados in novos:
+                self._valida_colunas(dados)
+                if self.operacao == "upsert":
+                    if self.on_conflict not in self.banco.unicos.get(self.tabela, ()):
+                        raise ErroPostgrest("42P10: there is no unique or exclusion constraint matching the ON CONFLICT specification")
+                    existente = next((l for l in linhas if l.get(self.on_conflict) == dados.get(self.on_conflict)), None)
+                    if existente is not None and self.ignore_duplicates:
+                        continue  # resolution=ignore-duplicates: a linha existente fica como está
+                    if existente is not None:
+                        existente.update(copy.deepcopy(dados))
+                        gravados.append(copy.deepcopy(existente))
+                        continue
+                linha = {c: None for c in self.banco.colunas.get(self.tabela, ())}
+                linha.update(copy.deepcopy(dados))
+                linhas.append(linha)
+                gravados.append(copy.deepcopy(linha))
+            return Resposta(gravados)
+
+        if self.operacao == "update":
+            self._valida_colunas(self.dados)
+            alteradas = []
+            for linha in linhas:
+                if self._filtra(linha):
+                    linha.update(copy.deepcopy(self.dados))
+                    alteradas.append(copy.deepcopy(linha))
+            return Resposta(alteradas)
+
+        if self.operacao == "delete":
+            removidas = [l for l in linhas if self._filtra(l)]
+            self.banco.tabelas[self.tabela] = [l for l in linhas if not self._filtra(l)]
+            return Resposta(removidas)
+
+        raise ErroPostgrest(f"operação desconhecida: {self.operacao}")
+
+
+class FakeSupabase:
+    """
+    Cliente Supabase em memória para testes: tabelas como listas de dicts,
+    colunas fixas por tabela (coluna desconhecida → erro, como no PostgREST),
+    restrições únicas para o upsert, registro de cada requisição (idas),
+    latência simulada e falhas transitórias (as próximas N requisições).
+    """
+
+    def __init__(
+        self,
+        colunas: Optional[dict[str, list[str]]] = None,
+        unicos: Optional[dict[str, tuple]] = None,
+        latencia: float = 0.0,
+    ):
+        self.colunas = colunas or {}
+        self.unicos = unicos or {}
+        self.latencia = latencia
+        self.falhas_transitorias = 0
+        self.tabelas: dict[str, list[dict]] = {}
+        self.requisicoes: list[tuple[str, str]] = []
+
+    def table(self, nome: str) -> _Consulta:
+        return _Consulta(self, nome)
+
+    def contar(self, operacao: Optional[str] = None) -> int:
+        return sum(1 for _, op in self.requisicoes if operacao is None or op == operacao)
+
+
+COLUNAS_LEADS = [
+    "id", "numero", "nome", "flags", "score", "temperatura", "urgencia", "formulario_respondido",
+    "etapa", "produto_escolhido", "historico", "idade", "tentante",
+    "menopausa", "updated_at",
+]
+
+COLUNAS_EVENTOS = ["id", "numero", "tipo", "dados", "criado_em"]
+
+
+def fake_supabase_leads() -> FakeSupabase:
+    """
+    Fake com as tabelas "leads" ("numero" único) e "lead_eventos" do app.
+    """
+    return FakeSupabase(colunas={"leads": COLUNAS_LEADS, "lead_eventos": COLUNAS_EVENTOS}, unicos={"leads": ("numero",)})
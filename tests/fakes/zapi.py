@@ -0,0 +1,62 @@
+# tests/fakes/zapi.py
+
+import asyncio
+from typing import Optional
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class FakeZapi:
+    """
+    Servidor Z-API falso para testes e benchmarks.
+    - Registra as mensagens recebidas
+    - Simula latência e falhas (as N primeiras requisições retornam `status_falha`,
+      com o cabeçalho Retry-After se `retry_after` for informado)
+    - Mede o pico de requisições simultâneas por instância
+    """
+
+    def __init__(
+        self, latencia: float = 0.0, falhas: int = 0, status_falha: int = 503, retry_after: Optional[str] = None
+    ):
+        self.latencia = latencia
+        self.falhas = falhas
+        self.status_falha = status_falha
+        self.retry_after = retry_after
+        self.mensagens: list[dict] = []
+        self.requisicoes = 0
+        self.em_voo: dict[str, int] = {}
+        self.pico_em_voo: dict[str, int] = {}
+        self.app = FastAPI(title="Fake Z-API")
+
+        @self.app.post("/instances/{instancia}/token/{token}/send-messages")
+        async def send_messages(instancia: str, token: str, request: Request):
+            self.requisicoes += 1
+            self.em_voo[instancia] = self.em_voo.get(instancia, 0) + 1
+            self.pico_em_voo[instancia] = max(self.pico_em_voo.get(instancia, 0), self.em_voo[instancia])
+            try:
+                if self.latencia:
+                    await asyncio.sleep(self.latencia)
+                if self.falhas > 0:
+                    self.falhas -= 1
+                    headers = {"Retry-After": self.retry_after} if self.retry_after is not None else None
+                    return JSONResponse({"error": "falha simulada"}, status_code=self.status_falha, headers=headers)
+                body = await request.json()
+                self.mensagens.append({"instancia": instancia, **body})
+                return {"zaapId": f"fake-{len(self.mensagens)}", "messageId": f"msg-{len(self.mensagens)}"}
+            finally:
+                self.em_voo[instancia] -= 1
+
+    def transport(self) -> httpx.ASGITransport:
+        """
+        Transporte httpx que encaminha as requisições direto para o app falso.
+        """
+        return httpx.ASGITransport(app=self.app)
+
+
+if __name__ == "__main__":
+    # Sobe o servidor falso localmente: ZAPI_API_URL=http://localhost:8099 MOCK_ZAPI=0
+    import uvicorn
+
+    uvicorn.run(FakeZapi().app, host="127.0.0.1", port=8099)
@@ -0,0 +1,109 @@
+import asyncio
+
+from services.coalescer import CoalescedorMensagens
+
+
+class RelogioFalso:
+    def __init__(self):
+        self.agora = 0.0
+
+    def __call__(self) -> float:
+        return self.agora
+
+
+def criar(janela=2.0, espera_max=10.0, latencia=0.0):
+    relogio = RelogioFalso()
+    chamadas = []
+
+    async def handler(numero, texto, payload):
+        chamadas.append((numero, texto))
+        await asyncio.sleep(latencia)
+        return f"resposta para {texto!r}"
+
+    return CoalescedorMensagens(handler, janela, espera_max, relogio), relogio, chamadas
+
+
+def test_rajada_vira_um_turno():
+    """
+    Três mensagens seguidas geram uma única chamada, após a janela de silêncio.
+    """
+    async def _run():
+        c, relogio, chamadas = criar()
+        futuros = [c.adicionar("5541999999999", "oi", {})]
+        relogio.agora = 0.5
+        futuros.append(c.adicionar("5541999999999", "tudo bem?", {}))
+        relogio.agora = 1.0
+        futuros.append(c.adicionar("5541999999999", "quero marcar", {"ultimo": True}))
+
+        relogio.agora = 2.9
+        assert c.descarregar_vencidos() == []
+
+        relogio.agora = 3.0
+        await asyncio.gather(*c.descarregar_vencidos())
+        return chamadas, [f.result() for f in futuros], c.metricas
+
+    chamadas, resultados, metricas = asyncio.run(_run())
+    assert chamadas == [("5541999999999", "oi\ntudo bem?\nquero marcar")]
+    assert len(set(resultados)) == 1
+    assert metricas == {"mensagens": 3, "turnos": 1}
+
+
+def test_espera_maxima_limita_o_adiamento():
+    async def _run():
+        c, relogio, chamadas = criar(janela=2.0, espera_max=3.0)
+        for t in range(4):
+            relogio.agora = float(t)
+            c.adicionar("5541999999999", f"msg {t}", {})
+            await asyncio.gather(*c.descarregar_vencidos())
+        return chamadas
+
+    assert asyncio.run(_run()) == [("5541999999999", "msg 0\nmsg 1\nmsg 2\nmsg 3")]
+
+
+def test_numeros_diferentes_sao_independentes():
+    async def _run():
+        c, relogio, chamadas = criar()
+        c.adicionar("5541999999991", "oi", {})
+        relogio.agora = 1.5
+        c.adicionar("5541999999992", "olá", {})
+        relogio.agora = 2.0
+        await asyncio.gather(*c.descarregar_vencidos())
+        assert chamadas == [("5541999999991", "oi")]
+        relogio.agora = 3.5
+        await asyncio.gather(*c.descarregar_vencidos())
+        return chamadas
+
+    assert asyncio.run(_run())[-1] == ("5541999999992", "olá")
+
+
+def test_grupos_do_mesmo_numero_em_ordem():
+    """
+    Um segundo grupo só começa depois que o primeiro termina.
+    """
+    async def _run():
+        c, relogio, chamadas = criar(latencia=0.01)
+        c.adicionar("5541999999999", "primeiro", {})
+        relogio.agora = 2.0
+        tarefas = c.descarregar_vencidos()
+        c.adicionar("5541999999999", "segundo", {})
+        relogio.agora = 4.0
+        tarefas += c.descarregar_vencidos()
+        await asyncio.gather(*tarefas)
+        return chamadas, c._travas
+
+    chamadas, travas = asyncio.run(_run())
+    assert [t for _, t in chamadas] == ["primeiro", "segundo"]
+    assert travas == {}
+
+
+def test_parar_descarrega_pendentes():
+    async def _run():
+        c, relogio, chamadas = criar()
+        c.iniciar()
+        futuro = c.adicionar("5541999999999", "oi", {})
+        await c.parar()
+        return futuro.result(), chamadas
+
+    resultado, chamadas = asyncio.run(_run())
+    assert resultado == "resposta para 'oi'"
+    assert chamadas == [("5541999999999", "oi")]
@@ -1,29 +1,28 @@
-import os
+import datetime
+
 import pytest
-import redis
 from fastapi.testclient import TestClient
+
+import routers.zapi_webhook as zapi_webhook
+import services.slot_inventory as slot_inventory
 from main import app
+from services.scheduler import agenda_do_dia
+from tests.fakes.ambiente import AmbienteLocal
+from tests.fakes.ollama import RESPOSTA_PADRAO
+from utils.zapi import aguardar_envios_pendentes
 
-# Configurações de teste para Redis
-REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-
-@pytest.fixture(autouse=True)
-def flush_redis():
-    """
-    Fixture que limpa o Redis antes de cada teste.
-    """
-    client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
-    client.flushdb()
-    yield
-    client.flushdb()
 
 @pytest.fixture()
-def client():
+def nora(monkeypatch):
     """
-    TestClient do FastAPI para chamadas ao webhook.
+    App completo (lifespan incluso) com Redis, Supabase, Ollama e Z-API locais.
+    Devolve o client e o ambiente.
     """
-    return TestClient(app)
+    monkeypatch.setattr(zapi_webhook, "FILA_ATIVA", False)
+    with AmbienteLocal() as ambiente:
+        with TestClient(app) as client:
+            yield client, ambiente
+
 
 def post_message(client, phone, message):
     """
@@ -39,55 +38,70 @@ def post_message(client, phone, message):
     }
     return client.post("/zapi/webhook", json=payload)
 
-def test_simple_greeting(client):
+
+def _proxima_segunda() -> str:
+    hoje = datetime.date.today()
+    return (hoje + datetime.timedelta(days=7 - hoje.weekday())).isoformat()
+
+
+def test_simple_greeting(nora):
     """
-    Testa que NORA responde a saudação básica.
+    Saudação vai para o LLM e a resposta gerada é enviada pela Z-API.
     """
+    client, ambiente = nora
     response = post_message(client, "5541999999999", "Oi, boa tarde!")
     assert response.status_code == 200
     data = response.json()
-    assert data["ok"] is True
-    assert "boa tarde" in data["resposta_enviada"].lower()
+    assert data == {"ok": True, "mensagem_enviada": RESPOSTA_PADRAO}
+    assert "Oi, boa tarde!" in ambiente.ollama.prompts[-1]
+
+    client.portal.call(aguardar_envios_pendentes)  # o envio sai em segundo plano
+    assert ambiente.zapi.mensagens[-1]["message"] == RESPOSTA_PADRAO
 
-def test_agendamento_flow(client):
+
+def test_agendamento_flow(nora):
     """
     Testa fluxo de agendamento completo:
     1) Lead diz que quer agendar
     2) NORA pede data e horário
     3) Lead fornece data e horário válidos
-    4) NORA confirma agendamento
+    4) NORA faz a reserva preliminar e o horário sai do estoque
     """
+    client, ambiente = nora
     phone = "5541999999998"
+    data = _proxima_segunda()
+    ambiente.supabase.tabelas["leads"] = [{"numero": phone, "nome": "Ana", "produto_escolhido": "pacote_completo"}]
+
     # 1) Intenção de agendar
     r1 = post_message(client, phone, "Quero agendar uma consulta")
     assert r1.status_code == 200
-    d1 = r1.json()
-    assert "por favor me informe a data" in d1["resposta_enviada"].lower()
+    assert "por favor me informe a data" in r1.json()["mensagem_enviada"].lower()
 
-    # 2) Fornece data e horário válidos (conforme slots mock)
-    r2 = post_message(client, phone, "2025-07-01 09:00")
+    # 2) Fornece data e horário válidos
+    r2 = post_message(client, phone, f"{data} 09:00")
     assert r2.status_code == 200
-    d2 = r2.json()
-    assert "capturados" in d2["resposta_enviada"].lower()
+    assert "capturados" in r2.json()["mensagem_enviada"].lower()
 
-    # 3) Chamamos novamente para processar agendamento
-    r3 = post_message(client, phone, "")  # mensagem vazia para acionar scheduler
+    # 3) Pede o agendamento de novo: reserva preliminar com link de pagamento
+    r3 = post_message(client, phone, "Quero agendar")
     assert r3.status_code == 200
-    d3 = r3.json()
-    assert "confirmado" in d3["resposta_enviada"].lower()
-    assert "09:00" in d3["resposta_enviada"]
+    d3 = r3.json()["mensagem_enviada"]
+    assert "reserva preliminar" in d3.lower() and "09:00" in d3
+
+    # Nada disso passou pelo LLM; o horário saiu do estoque e o histórico ficou no Redis
+    assert ambiente.ollama.prompts == []
+    assert not client.portal.call(slot_inventory.disponivel, data, "09:00", agenda_do_dia)
+    assert client.portal.call(ambiente.redis.exists, f"session:{phone}:history")
 
-    # Verifica no Redis se o slot foi removido
-    client_redis = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
-    remaining = client_redis.get(f"session:{phone}")
-    assert remaining is not None
 
-def test_intent_detection_preco(client):
+def test_intent_detection_preco(nora):
     """
-    Testa detecção de intenção de preço e resposta genérica do GPT.
+    Pergunta de preço não é agendamento: resposta gerada pelo LLM com a pergunta no prompt.
     """
+    client, ambiente = nora
     response = post_message(client, "5541999999997", "Quanto custa uma consulta?")
     assert response.status_code == 200
     data = response.json()
     assert data["ok"] is True
-    assert "custa" in data["resposta_enviada"].lower() or data["resposta_enviada"]
+    assert data["mensagem_enviada"] == RESPOSTA_PADRAO
+    assert "Quanto custa uma consulta?" in ambiente.ollama.prompts[-1]
@@ -0,0 +1,58 @@
+import pytest
+
+from services.intent import (
+    detectar_intencao,
+    detectar_intencoes,
+    detectar_intencoes_em_lote,
+    estatisticas_cache_intencao,
+    limpar_cache_intencao,
+    normalizar_texto,
+)
+
+
+def test_normalizar_texto():
+    assert normalizar_texto("  Horário   DISPONÍVEL ") == "horario disponivel"
+
+
+@pytest.mark.parametrize("mensagem, esperada", [
+    ("Quero agendar uma consulta", "agendar"),
+    ("tem horario amanha?", "agendar"),           # sem acento
+    ("Tem horário amanhã?", "agendar"),
+    ("Quanto custa uma consulta?", "preco"),        # "quanto custa" pesa mais que "consulta"
+    ("Preciso cancelar minha consulta", "cancelar"),
+    ("NÃO POSSO IR amanhã", "cancelar"),
+    ("Oi, boa tarde!", "nenhuma"),
+    ("reagendamento", "nenhuma"),                   # keyword só conta como palavra inteira
+])
+def test_detectar_intencao(mensagem, esperada):
+    assert detectar_intencao(mensagem) == esperada
+
+
+def test_scores_de_todas_as_intencoes():
+    scores = detectar_intencoes("Quanto custa? Quero agendar uma consulta")
+    assert scores == {"agendar": 3, "preco": 2}
+    assert list(scores) == ["agendar", "preco"]
+
+
+def test_empate_respeita_ordem_das_intencoes():
+    assert detectar_intencoes("agenda e preço") == {"agendar": 1, "preco": 1}
+    assert detectar_intencao("agenda e preço") == "agendar"
+
+
+def test_cache_por_texto_normalizado():
+    """
+    Variações de caixa/acento/espaço caem na mesma entrada do cache.
+    """
+    limpar_cache_intencao()
+    detectar_intencao("Quanto custa?")
+    detectar_intencao("  quanto   CUSTA? ")
+    stats = estatisticas_cache_intencao()
+    assert (stats["hits"], stats["misses"], stats["tamanho"]) == (1, 1, 1)
+    assert stats["taxa_acerto"] == 0.5
+
+
+def test_detectar_intencoes_em_lote():
+    limpar_cache_intencao()
+    mensagens = ["quero agendar", "quanto custa", "quero agendar", "oi"]
+    assert detectar_intencoes_em_lote(mensagens) == ["agendar", "preco", "agendar", "nenhuma"]
+    assert estatisticas_cache_intencao()["misses"] == 3
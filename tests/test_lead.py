@@ -0,0 +1,202 @@
+import asyncio
+import time
+
+import pytest
+
+import core.db as db
+import models.lead as lead_repo
+import services.llm as llm
+import services.product_pipeline as pipeline
+from services.scheduler import validar_pacote_obrigatorio
+from tests.fakes.llm import FakeLLM
+from tests.fakes.supabase import FakeSupabase, fake_supabase_leads
+
+PHONE = "5541999999999"
+
+
+@pytest.fixture()
+def banco():
+    fake = fake_supabase_leads()
+    db.usar_cliente_supabase(fake)
+    lead_repo.limpar_cache_leads()
+    yield fake
+    db.usar_cliente_supabase(None)
+    lead_repo.limpar_cache_leads()
+
+
+def test_update_sem_select_previo(banco):
+    async def _run():
+        await lead_repo.create_lead(PHONE)
+        await lead_repo.update_lead(PHONE, {"etapa": "aguardando_form", "coluna_inexistente": 1})
+        await lead_repo.update_lead(PHONE, {"etapa": "produto", "score": 80})
+
+    asyncio.run(_run())
+    assert [op for _, op in banco.requisicoes] == ["upsert", "update", "update"]
+    assert banco.tabelas["leads"][0]["etapa"] == "produto"
+
+
+def test_update_com_cache_antigo_ainda_vai_ao_supabase(banco):
+    """
+    Outro worker alterou o lead depois da leitura: repetir o valor do cache local
+    não pode ser descartado como "nada mudou".
+    """
+    async def _run():
+        lead = await lead_repo.create_lead(PHONE)
+        lead["etapa"] = "aguardando_form"
+        await lead_repo.update_lead(PHONE, lead)
+        banco.tabelas["leads"][0]["etapa"] = "produto"  # escrita de outro worker
+        await lead_repo.update_lead(PHONE, {"etapa": "aguardando_form", "flags": {"is_ttc": True}})
+
+    asyncio.run(_run())
+    assert banco.contar("update") == 2
+    assert banco.tabelas["leads"][0]["etapa"] == "aguardando_form"
+
+
+def test_falha_de_leitura_nao_recria_lead_existente(banco):
+    """
+    Erro transitório na leitura não vira "lead não encontrado"; e mesmo quem chega
+    a create_lead (ex.: duas primeiras mensagens simultâneas) não sobrescreve o lead.
+    """
+    existente = {"numero": PHONE, "nome": "Ana", "formulario_respondido": True,
+                 "produto_escolhido": "Plano Infantil", "historico": "tentante há 1 ano"}
+    banco.tabelas["leads"] = [dict(existente)]
+    banco.falhas_transitorias = 1
+
+    async def _run():
+        with pytest.raises(ConnectionError):
+            await lead_repo.get_lead(PHONE)
+        return await asyncio.gather(lead_repo.create_lead(PHONE), lead_repo.create_lead(PHONE))
+
+    criados = asyncio.run(_run())
+    assert len(banco.tabelas["leads"]) == 1
+    assert {k: banco.tabelas["leads"][0][k] for k in existente} == existente
+    assert all(c["produto_escolhido"] == "Plano Infantil" for c in criados)
+
+
+def test_cache_de_leitura_com_ttl(banco, monkeypatch):
+    agora = [0.0]
+    monkeypatch.setattr(lead_repo, "_agora", lambda: agora[0])
+    banco.tabelas["leads"] = [{"numero": PHONE, "nome": "Ana", "etapa": "inicial"}]
+
+    async def _run():
+        assert (await lead_repo.get_lead(PHONE))["nome"] == "Ana"
+        copia = await lead_repo.get_lead(PHONE)
+        copia["nome"] = "alterado fora do repositório"
+        assert (await lead_repo.get_lead(PHONE))["nome"] == "Ana"
+        assert banco.contar("select") == 1
+
+        agora[0] = lead_repo.LEAD_CACHE_TTL + 1
+        await lead_repo.get_lead(PHONE)
+        assert banco.contar("select") == 2
+
+    asyncio.run(_run())
+
+
+def test_upsert_cai_para_insert_sem_restricao_unica():
+    fake = FakeSupabase(colunas={"leads": ["numero", "nome", "flags", "score", "temperatura", "formulario_respondido",
+                                            "produto_escolhido", "historico", "updated_at"]})
+    db.usar_cliente_supabase(fake)
+    lead_repo.limpar_cache_leads()
+
+    async def _run():
+        await lead_repo.create_lead(PHONE)
+        await lead_repo.create_lead("5541888888888")
+
+    asyncio.run(_run())
+    assert [op for _, op in fake.requisicoes] == ["upsert", "insert", "insert"]
+    db.usar_cliente_supabase(None)
+    lead_repo.limpar_cache_leads()
+
+
+def test_lead_inexistente(banco):
+    banco.tabelas["leads"] = [{"numero": "outro", "nome": ""}]
+
+    async def _run():
+        with pytest.raises(ValueError):
+            await lead_repo.update_lead(PHONE, {"nome": "Ana"})
+        return await lead_repo.get_lead(PHONE)
+
+    assert asyncio.run(_run()) is None
+
+
+def test_consultas_concorrentes_sobrepoem_latencia(banco):
+    """
+    Com o cliente assíncrono, dez leituras de 50 ms não bloqueiam o loop
+    umas das outras (com o cliente síncrono levariam ~500 ms).
+    """
+    banco.latencia = 0.05
+    banco.tabelas["leads"] = [{"numero": str(n), "nome": ""} for n in range(10)]
+
+    async def _run():
+        inicio = time.perf_counter()
+        leads = await asyncio.gather(*(lead_repo.get_lead(str(n)) for n in range(10)))
+        return leads, time.perf_counter() - inicio
+
+    leads, duracao = asyncio.run(_run())
+    assert all(leads)
+    assert duracao < 0.25
+
+
+def test_validar_pacote_usa_repositorio(banco):
+    banco.tabelas["leads"] = [
+        {"numero": PHONE, "produto_escolhido": "Pacote 3 Consultas"},
+        {"numero": "5541888888888", "produto_escolhido": "  "},
+    ]
+
+    async def _run():
+        return [
+            await validar_pacote_obrigatorio(PHONE),
+            await validar_pacote_obrigatorio("5541888888888"),
+            await validar_pacote_obrigatorio("5541777777777"),
+            await validar_pacote_obrigatorio(PHONE),  # do cache
+        ]
+
+    assert asyncio.run(_run()) == [True, False, False, True]
+    assert banco.contar("select") == 3
+
+
+def test_cliente_compartilhado_por_loop(monkeypatch):
+    criados = []
+
+    async def acreate_client(url, key, options=None):
+        await asyncio.sleep(0.01)
+        criados.append(options)
+        return object()
+
+    monkeypatch.setattr(db, "SUPABASE_URL", "https://exemplo.supabase.co")
+    monkeypatch.setattr(db, "SUPABASE_KEY", "chave")
+    monkeypatch.setattr(db, "acreate_client", acreate_client)
+    db.usar_cliente_supabase(None)
+
+    async def _run():
+        clientes = await asyncio.gather(*(db.get_supabase() for _ in range(5)))
+        await db.fechar_supabase()
+        return clientes
+
+    clientes = asyncio.run(_run())
+    assert len(criados) == 1 and len({id(c) for c in clientes}) == 1
+    assert criados[0].httpx_client is not None
+    clientes = asyncio.run(_run())  # novo loop → novo cliente
+    assert len(criados) == 2
+
+
+def test_idas_por_mensagem_no_pipeline(banco, monkeypatch):
+    """
+    Lead novo: leitura + upsert + um PATCH (antes: select, insert, select de esquema e update).
+    """
+    FakeLLM.instancias.clear()
+    monkeypatch.setattr(llm, "OllamaLLM", FakeLLM)
+    monkeypatch.setattr(pipeline, "enviar_mensagem", lambda *a: None)
+    llm.limpar_clientes_llm()
+
+    async def _run():
+        with lead_repo.contar_idas() as primeira:
+            await pipeline.process_zapi_payload({"phone": PHONE, "message": "estou grávida de 20 semanas"})
+        with lead_repo.contar_idas() as segunda:
+            await pipeline.process_zapi_payload({"phone": PHONE, "message": "ainda não"})
+        return primeira["idas"], segunda["idas"]
+
+    assert asyncio.run(_run()) == (3, 0)
+    llm.limpar_clientes_llm()
+    assert banco.tabelas["leads"][0]["etapa"] == "aguardando_form"
+    assert banco.tabelas["leads"][0]["flags"] == '{"is_gest": true}'
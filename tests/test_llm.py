@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+import services.llm as llm
+import services.nlp as nlp
+from tests.fakes.llm import FakeLLM
+
+
+@pytest.fixture(autouse=True)
+def fake_ollama(monkeypatch):
+    """
+    Troca o OllamaLLM pelo FakeLLM e zera o cache de clientes do gateway.
+    """
+    FakeLLM.instancias.clear()
+    monkeypatch.setattr(llm, "OllamaLLM", FakeLLM)
+    llm.limpar_clientes_llm()
+    yield
+    llm.limpar_clientes_llm()
+
+
+def test_cliente_reutilizado_por_modelo():
+    """
+    Mesma configuração → mesma instância; modelo diferente → outra instância.
+    """
+    assert llm.get_ollama_llm() is llm.get_ollama_llm()
+    assert llm.get_ollama_llm("outro:1b") is not llm.get_ollama_llm()
+    assert llm.get_ollama_llm(format="json") is not llm.get_ollama_llm()
+    assert len(FakeLLM.instancias) == 3
+
+
+def test_limite_de_geracoes_simultaneas(monkeypatch):
+    monkeypatch.setattr(llm, "LLM_MAX_INFLIGHT", 2)
+    fake = llm.get_ollama_llm()
+    fake.latencia = 0.01
+
+    async def _run():
+        return await asyncio.gather(*(llm.ainvoke(f"p{i}") for i in range(8)))
+
+    respostas = asyncio.run(_run())
+    assert len(respostas) == 8
+    assert fake.pico_em_voo == 2
+    assert llm.estatisticas_llm()["em_voo"] == 0
+
+
+def test_astream_entrega_trechos():
+    llm.get_ollama_llm().resposta = "Olá tudo bem"
+
+    async def _run():
+        return [t async for t in llm.astream("oi")]
+
+    assert asyncio.run(_run()) == ["Olá ", "tudo ", "bem "]
+
+
+def test_nlp_usa_o_gateway():
+    """
+    Os terminais do nlp compartilham o mesmo cliente do gateway.
+    """
+    llm.get_ollama_llm().resposta = "  Copy gerada  "
+    assert asyncio.run(nlp.gerar_copy("Consulta Avulsa", "morno", "Ana")) == "Copy gerada"
+    assert asyncio.run(nlp.decidir_produto_ia(50, {}, False)) == "Copy gerada"
+    assert len(FakeLLM.instancias) == 1
@@ -0,0 +1,100 @@
+import asyncio
+import io
+import json
+import queue
+
+import pytest
+
+import services.dialog_engine as dialog_engine
+import utils.logger as logger
+from utils.logger import correlacao_atual, descarregar_logs, log_event, nova_correlacao
+
+
+@pytest.fixture()
+def saida():
+    """
+    Troca a saída do listener por um buffer e devolve as linhas JSON escritas.
+    """
+    descarregar_logs()
+    buffer = io.StringIO()
+    anterior = logger._saida.setStream(buffer)
+
+    def linhas() -> list[dict]:
+        descarregar_logs()
+        return [json.loads(l) for l in buffer.getvalue().splitlines()]
+
+    yield linhas
+    logger._saida.setStream(anterior)
+
+
+def _regras(monkeypatch, niveis: str = "", amostragem: str = ""):
+    monkeypatch.setattr(logger, "_REGRAS_NIVEL", logger._regras(niveis))
+    monkeypatch.setattr(logger, "_REGRAS_AMOSTRAGEM", logger._regras(amostragem))
+    logger._nivel_do_evento.cache_clear()
+    logger._taxa_do_evento.cache_clear()
+
+
+def test_linha_json_compacta_com_telefone_mascarado(saida):
+    dados = {"body": {"phone": "5541999991234", "message": "meu outro número é 11987654321"}}
+    log_event("📤 Mensagem enviada Z-API", dados)
+    dados["body"] = "alterado depois"
+    log_event("❌ Erro ao enviar Z-API", {"error": "timeout"})
+
+    enviada, erro = saida()
+    assert enviada["nivel"] == "INFO" and erro["nivel"] == "ERROR"
+    assert enviada["evento"] == "📤 Mensagem enviada Z-API"
+    assert enviada["dados"]["body"]["phone"] == "5541*****1234"
+    assert enviada["dados"]["body"]["message"].endswith("1198***4321")
+    assert "5541999991234" not in json.dumps(enviada)
+
+
+def test_correlacao_acompanha_tarefas_em_segundo_plano(saida):
+    async def enviar():
+        log_event("📤 Mensagem enviada Z-API", {"ok": True})
+
+    async def _run():
+        nova_correlacao("msg-1")
+        log_event("🔹 Mensagem recebida", {})
+        await asyncio.create_task(enviar())
+
+    asyncio.run(_run())
+    assert [l["correlacao"] for l in saida()] == ["msg-1", "msg-1"]
+
+
+def test_fila_e_agrupamento_retomam_a_correlacao_do_webhook(monkeypatch):
+    vistas = []
+
+    async def responder(numero, texto, payload, aguardar_envio=False):
+        vistas.append(correlacao_atual())
+
+    monkeypatch.setattr(dialog_engine, "responder_mensagem", responder)
+    monkeypatch.setattr(dialog_engine, "get_coalescedor", lambda: None)
+
+    async def _run():
+        await dialog_engine.responder_mensagem_da_fila("5541", "oi", {"correlacao": "fila-1"})
+        await dialog_engine.responder_turno_agrupado("5541", "oi", {"correlacao": "grupo-1"})
+
+    asyncio.run(_run())
+    assert vistas == ["fila-1", "grupo-1"]
+
+
+def test_nivel_e_amostragem_por_evento(saida, monkeypatch):
+    _regras(monkeypatch, niveis="MOCK Mensagem=DEBUG", amostragem="Mensagem recebida=0")
+    try:
+        log_event("📤 MOCK Mensagem enviada Z-API", {"n": 1})  # abaixo de INFO: não sai
+        for _ in range(10):
+            log_event("🔹 Mensagem recebida", {"n": 2})  # amostragem 0
+            log_event("❌ Mensagem recebida com erro", {"n": 3})  # erros nunca são amostrados
+        log_event("🔹 Mensagem recebida", {"n": 4}, nivel="warning")
+    finally:
+        _regras(monkeypatch)
+
+    assert [l["dados"]["n"] for l in saida()] == [3] * 10 + [4]
+
+
+def test_fila_cheia_descarta_sem_bloquear(monkeypatch):
+    monkeypatch.setattr(logger, "_fila", queue.Queue(2))
+    monkeypatch.setitem(logger._stats, "descartados", 0)
+    for n in range(5):
+        log_event("🔹 Evento", {"n": n})
+    assert logger._stats["descartados"] == 3
@@ -0,0 +1,112 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+import core.sessions as sessions
+import services.memory as memory
+
+
+@pytest.fixture(autouse=True)
+def memoria_limpa(monkeypatch):
+    """
+    Memória vazia, relógio controlado e Redis falso a cada teste.
+    """
+    relogio = {"agora": 0.0}
+    monkeypatch.setattr(memory, "_agora", lambda: relogio["agora"])
+    monkeypatch.setattr(sessions, "redis_client", fakeredis.aioredis.FakeRedis(decode_responses=True))
+    memory.limpar_memorias()
+    yield relogio
+    memory.limpar_memorias()
+
+
+def conversar(phone, n):
+    mem = memory.get_memory_for_user(phone)
+    for i in range(n):
+        mem.chat_memory.add_user_message(f"msg {i}")
+    return mem
+
+
+def test_reutiliza_memoria_do_usuario():
+    assert memory.get_memory_for_user("1") is memory.get_memory_for_user("1")
+    stats = memory.estatisticas_memoria()
+    assert (stats["hits"], stats["misses"], stats["usuarios"]) == (1, 1, 1)
+
+
+def test_despejo_lru(monkeypatch):
+    monkeypatch.setattr(memory, "MEMORY_MAX_USERS", 2)
+    memory.get_memory_for_user("1")
+    memory.get_memory_for_user("2")
+    memory.get_memory_for_user("1")  # "2" vira o menos usado
+    memory.get_memory_for_user("3")
+    assert list(memory._user_memories) == ["1", "3"]
+    assert memory.estatisticas_memoria()["despejos_lru"] == 1
+
+
+def test_expiracao_por_ttl(memoria_limpa, monkeypatch):
+    monkeypatch.setattr(memory, "MEMORY_TTL", 10)
+    memory.get_memory_for_user("1")
+    memoria_limpa["agora"] = 5
+    memory.get_memory_for_user("2")
+    memoria_limpa["agora"] = 12
+    memory.get_memory_for_user("2")
+    assert list(memory._user_memories) == ["2"]
+    assert memory.estatisticas_memoria()["despejos_ttl"] == 1
+
+
+def test_janela_de_mensagens(monkeypatch):
+    monkeypatch.setattr(memory, "MEMORY_MAX_MESSAGES", 3)
+    conversar("1", 10)
+    mensagens = memory.get_memory_for_user("1").chat_memory.messages
+    assert [m.content for m in mensagens] == ["msg 7", "msg 8", "msg 9"]
+
+
+def test_export_import():
+    conversar("1", 2)
+    exportada = memory.export_memory("1")
+    memory.import_memory("2", exportada)
+    assert memory.export_memory("2") == exportada
+    assert memory.export_memory("inexistente") == []
+
+
+def test_spill_para_redis_e_restauracao(monkeypatch):
+    """
+    Memória despejada é gravada no Redis e volta em obter_memoria.
+    """
+    monkeypatch.setattr(memory, "MEMORY_SPILL_REDIS", True)
+    monkeypatch.setattr(memory, "MEMORY_MAX_USERS", 1)
+
+    async def _run():
+        conversar("1", 2)
+        await memory.obter_memoria("2")  # despeja "1" e grava no Redis
+        assert await sessions.redis_client.exists(memory.get_memory_key("1"))
+        mem = await memory.obter_memoria("1")
+        return [m.content for m in mem.chat_memory.messages]
+
+    assert asyncio.run(_run()) == ["msg 0", "msg 1"]
+    assert memory.estatisticas_memoria()["restauradas"] == 1
+
+
+def test_spill_pendente_tem_teto_e_descarga_periodica(monkeypatch):
+    """
+    Sem ninguém chamar obter_memoria, a descarga periódica grava as despejadas;
+    acima do teto as mais antigas são descartadas.
+    """
+    monkeypatch.setattr(memory, "MEMORY_SPILL_REDIS", True)
+    monkeypatch.setattr(memory, "MEMORY_MAX_USERS", 1)
+    monkeypatch.setattr(memory, "MEMORY_SPILL_MAX_PENDENTES", 2)
+    monkeypatch.setattr(memory, "MEMORY_SPILL_INTERVALO", 0.01)
+
+    async def _run():
+        memory.iniciar_descarga_memorias()
+        for phone in "1234":
+            conversar(phone, 1)  # cada novo usuário despeja o anterior
+        assert list(memory._spill_pendente) == ["2", "3"]
+        await asyncio.sleep(0.05)
+        gravadas = [bool(await sessions.redis_client.exists(memory.get_memory_key(p))) for p in "123"]
+        await memory.parar_descarga_memorias()
+        return gravadas
+
+    assert asyncio.run(_run()) == [False, True, True]
+    stats = memory.estatisticas_memoria()
+    assert stats["spill_pendente"] == 0 and stats["spill_descartados"] == 1
@@ -0,0 +1,180 @@
+import asyncio
+import random
+
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+
+import routers.zapi_webhook as zapi_webhook
+import services.message_queue as mq
+from main import app
+
+
+def gerar_mensagens():
+    """
+    Mensagens intercaladas de três números diferentes.
+    """
+    return [(f"55419999900{i % 3}", f"msg {i // 3}") for i in range(30)]
+
+
+async def processar_tudo(backend, workers=4):
+    processadas: dict[str, list[str]] = {}
+
+    async def handler(numero, texto, payload):
+        await asyncio.sleep(random.uniform(0, 0.003))
+        processadas.setdefault(numero, []).append(texto)
+
+    fila = mq.FilaMensagens(handler, backend, workers=workers)
+    await fila.iniciar()
+    for numero, texto in gerar_mensagens():
+        await fila.enfileirar(numero, texto, {})
+    while sum(len(v) for v in processadas.values()) < 30:
+        await asyncio.sleep(0.005)
+    snapshot = await fila.snapshot()
+    await fila.parar()
+    return processadas, snapshot
+
+
+def test_ordem_por_telefone_backend_memoria():
+    """
+    Cada número recebe suas mensagens na ordem em que chegaram.
+    """
+    processadas, snapshot = asyncio.run(processar_tudo(mq.BackendMemoria(4)))
+    for mensagens in processadas.values():
+        assert mensagens == [f"msg {i}" for i in range(10)]
+    assert snapshot["processadas"] == 30
+    assert snapshot["profundidade"] == 0
+    assert snapshot["espera_max_s"] >= snapshot["espera_media_s"] >= 0
+
+
+def test_ordem_por_telefone_backend_redis_stream():
+    async def _run():
+        redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        # Sem BLOCK: parar() não precisa esperar o XREADGROUP bloqueado expirar
+        backend = mq.BackendRedisStream(redis, 4, prefixo="teste:entrada", bloqueio_ms=0)
+        resultado = await processar_tudo(backend)
+        assert await redis.xlen("teste:entrada:0") == 0
+        return resultado
+
+    processadas, snapshot = asyncio.run(_run())
+    for mensagens in processadas.values():
+        assert mensagens == [f"msg {i}" for i in range(10)]
+    assert snapshot["backend"] == "BackendRedisStream"
+
+
+def test_falha_no_handler_nao_derruba_worker():
+    async def _run():
+        vistas = []
+
+        async def handler(numero, texto, payload):
+            vistas.append(texto)
+            if texto == "quebra":
+                raise ValueError("boom")
+
+        fila = mq.FilaMensagens(handler, mq.BackendMemoria(1), workers=1)
+        await fila.iniciar()
+        await fila.enfileirar("5541999999999", "quebra", {})
+        await fila.enfileirar("5541999999999", "segue", {})
+        while len(vistas) < 2:
+            await asyncio.sleep(0.005)
+        await fila.parar()
+        return vistas, fila.metricas.falhas
+
+    assert asyncio.run(_run()) == (["quebra", "segue"], 1)
+
+
+def test_erro_do_backend_nao_derruba_worker(monkeypatch):
+    """
+    Uma falha ao ler do backend (Redis fora, timeout) é registrada e o worker do shard segue.
+    """
+    monkeypatch.setattr(mq, "FILA_ERRO_PAUSA_S", 0)
+
+    class BackendInstavel(mq.BackendMemoria):
+        falhas = 1
+
+        async def consumir(self, shard):
+            if self.falhas:
+                self.falhas -= 1
+                raise ConnectionError("redis fora")
+            return await super().consumir(shard)
+
+    async def _run():
+        processadas = []
+
+        async def handler(numero, texto, payload):
+            processadas.append(texto)
+
+        fila = mq.FilaMensagens(handler, BackendInstavel(1), workers=1)
+        await fila.iniciar()
+        await fila.enfileirar("5541999990000", "oi", {})
+        for _ in range(200):
+            if processadas:
+                break
+            await asyncio.sleep(0.005)
+        snapshot = await fila.snapshot()
+        await fila.parar()
+        return processadas, snapshot
+
+    processadas, snapshot = asyncio.run(_run())
+    assert processadas == ["oi"]
+    assert snapshot["erros_backend"] == 1 and snapshot["processadas"] == 1
+
+
+def test_cada_shard_tem_um_so_consumidor_entre_processos():
+    """
+    Dois processos na mesma stream: só o dono lê o shard; se ele cai, o outro
+    assume e relê o que ficou sem confirmação.
+    """
+    async def _ler(backend):
+        for _ in range(3):  # a primeira leitura só drena os pendentes
+            if (recebido := await backend.consumir(0)) is not None:
+                return recebido
+
+    async def _run():
+        redis = fakeredis.aioredis.FakeRedis(decode_responses=True)
+        a, b = (mq.BackendRedisStream(redis, 1, prefixo="teste:posse", bloqueio_ms=0, posse_ms=300) for _ in range(2))
+        a.consumidor, b.consumidor = "proc-a", "proc-b"
+        await a.preparar()
+        await b.preparar()
+        await a.publicar(0, mq.ItemFila("5541999990000", "oi", {}))
+        item_a, _ = await _ler(a)
+        assert await b.consumir(0) is None  # shard do processo a
+        # a sai sem confirmar (devolve a posse; numa queda ela expira) e b assume
+        await a.encerrar()
+        item_b, token = await _ler(b)
+        await b.confirmar(0, token)
+        await b.encerrar()
+        return item_a, item_b, await redis.xlen("teste:posse:0")
+
+    item_a, item_b, restantes = asyncio.run(_run())
+    assert item_a.texto == item_b.texto == "oi"
+    assert restantes == 0
+
+
+
+@pytest.fixture()
+def fila_no_webhook(monkeypatch):
+    """
+    Liga o modo fila no webhook com um handler que só registra as chamadas.
+    """
+    recebidas = []
+
+    async def handler(numero, texto, payload):
+        recebidas.append((numero, texto))
+
+    monkeypatch.setattr(zapi_webhook, "FILA_ATIVA", True)
+    with TestClient(app) as client:
+        client.portal.call(mq.iniciar_fila, handler, mq.BackendMemoria(mq.FILA_WORKERS))
+        yield client, recebidas
+        client.portal.call(mq.parar_fila)
+
+
+def test_webhook_enfileira_e_responde(fila_no_webhook):
+    client, recebidas = fila_no_webhook
+    payload = {"phone": "5541999999999", "text": {"message": "Oi"}}
+    response = client.post("/zapi/webhook", json=payload)
+    assert response.json() == {"ok": True, "enfileirado": True}
+
+    metricas = client.get("/zapi/fila").json()
+    assert metricas["ativa"] is True
+    assert metricas["enfileiradas"] == 1
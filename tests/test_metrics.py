@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import routers.zapi_webhook as zapi_webhook
+import services.dedup as dedup
+import services.llm as llm
+import utils.metrics as metrics
+from main import app
+from tests.fakes.llm import FakeLLM
+from utils.metrics import ETAPAS, ERROS, LLM_TOKENS, cronometrar, exportar_metricas, medir
+
+
+@pytest.fixture(autouse=True)
+def limpo():
+    metrics.limpar_metricas()
+    yield
+    metrics.limpar_metricas()
+
+
+def _amostras(texto: str) -> dict[str, float]:
+    return {
+        linha.rsplit(" ", 1)[0]: float(linha.rsplit(" ", 1)[1])
+        for linha in texto.splitlines() if linha and not linha.startswith("#")
+    }
+
+
+def test_histograma_no_formato_texto_do_prometheus():
+    h = metrics.Histograma("teste_segundos", "Ajuda", ("etapa",), buckets=(0.1, 1.0))
+    for valor in (0.05, 0.1, 0.5, 3.0):
+        h.observar(valor, 'a"b')
+
+    assert h.exportar() == [
+        'teste_segundos_bucket{etapa="a\\"b",le="0.1"} 2',
+        'teste_segundos_bucket{etapa="a\\"b",le="1.0"} 3',
+        'teste_segundos_bucket{etapa="a\\"b",le="+Inf"} 4',
+        'teste_segundos_sum{etapa="a\\"b"} 3.65',
+        'teste_segundos_count{etapa="a\\"b"} 4',
+    ]
+
+
+def test_etapas_medidas_com_bloco_e_decorador():
+    @cronometrar("intencao")
+    def classificar(texto):
+        return texto.upper()
+
+    @cronometrar("zapi", "envio")
+    async def enviar():
+        raise RuntimeError("falhou")
+
+    async def _run():
+        with medir("supabase", "select"):
+            await asyncio.sleep(0.01)
+        with pytest.raises(RuntimeError):
+            await enviar()
+
+    assert classificar("oi") == "OI" and classificar.__name__ == "classificar"
+    asyncio.run(_run())
+
+    assert ETAPAS.contagem("intencao", "classificar") == 1
+    assert ETAPAS.series[("supabase", "select")][-1] >= 0.01
+    assert ETAPAS.contagem("zapi", "envio") == 1
+    assert ERROS.series == {("zapi", "envio"): 1}
+
+
+def test_desligado_nao_envolve_nada(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICAS_ATIVAS", False)
+
+    def funcao():
+        return 1
+
+    assert cronometrar("redis")(funcao) is funcao
+    assert medir("redis") is medir("supabase")
+    with medir("redis"):
+        pass
+    metrics.registrar_geracao("astream", 10, 1.0)
+    assert ETAPAS.series == {} and LLM_TOKENS.series == {}
+
+
+def test_tokens_por_segundo_do_stream(monkeypatch):
+    monkeypatch.setattr(llm, "get_ollama_llm", lambda *a, **k: FakeLLM(resposta="um dois tres quatro", latencia=0.005))
+
+    async def _run():
+        return [t async for t in llm.astream("oi")], await llm.ainvoke("oi")
+
+    trechos, resposta = asyncio.run(_run())
+    assert len(trechos) == 4 and resposta == "um dois tres quatro"
+    assert LLM_TOKENS.series == {("astream",): 4, ("ainvoke",): len(resposta) // 4}
+    assert metrics.LLM_TOKENS_S.contagem("astream") == 1
+    assert ETAPAS.contagem("llm", "astream") == ETAPAS.contagem("llm", "ainvoke") == 1
+
+
+def test_endpoint_metrics_expoe_etapas_e_profundidades(monkeypatch):
+    monkeypatch.setattr(zapi_webhook, "FILA_ATIVA", False)
+    monkeypatch.setattr(dedup, "DEDUP_ATIVO", False)
+
+    async def responder(numero, texto, payload):
+        return "resposta"
+
+    monkeypatch.setattr(zapi_webhook, "responder_mensagem", responder)
+    client = TestClient(app)
+    payload = {"phone": "5541999999999", "text": {"message": "oi"}}
+    assert client.post("/zapi/webhook", json=payload).json()["ok"]
+
+    resposta = client.get("/metrics")
+    assert resposta.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE nora_etapa_segundos histogram" in resposta.text
+    amostras = _amostras(resposta.text)
+    assert amostras['nora_etapa_segundos_count{etapa="webhook",operacao="zapi"}'] == 1
+    assert amostras['nora_llm_vagas{estado="em_voo"}'] == 0
+    assert "nora_log_fila" in amostras
+    assert not any(nome.startswith("nora_dedup_total") for nome in amostras)  # dedup desligado
+
+
+def test_coletor_com_falha_nao_derruba_a_coleta():
+    def quebrado():
+        raise ConnectionError("redis fora")
+
+    metrics.coletado("teste_quebrado", "Falha", quebrado)
+    metrics.coletado("teste_ok", "Ok", lambda: 7)
+    try:
+        texto = asyncio.run(exportar_metricas())
+    finally:
+        metrics._registro.pop("teste_quebrado")
+        metrics._registro.pop("teste_ok")
+    assert "teste_quebrado" not in texto and "teste_ok 7" in texto
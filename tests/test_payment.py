@@ -0,0 +1,212 @@
+import asyncio
+import datetime
+
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+
+import core.sessions as sessions
+import services.hold_sweeper as hold_sweeper
+import services.payment as payment
+import services.scheduler as scheduler
+import services.slot_inventory as inventario
+from main import app
+
+_HOJE = datetime.date.today()
+TER = (_HOJE + datetime.timedelta(days=7 + (1 - _HOJE.weekday()) % 7)).isoformat()
+AGENDA_TER = ["09:00", "10:00", "14:00"]
+
+
+@pytest.fixture()
+def ambiente(monkeypatch):
+    """
+    Redis falso, relógio controlado, gateway local e envios Z-API registrados.
+    """
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True, max_connections=1000)
+    monkeypatch.setattr(sessions, "redis_client", client)
+    monkeypatch.setattr(scheduler, "slots", {TER: AGENDA_TER})
+    agora = [1_000.0]
+    monkeypatch.setattr(inventario, "_agora", lambda: agora[0])
+    gateway = payment.GatewayLocal()
+    monkeypatch.setattr(payment, "_gateway", gateway)
+    enviadas = []
+    monkeypatch.setattr(scheduler, "agendar_envio_zapi", lambda numero, texto: enviadas.append((numero, texto)))
+
+    async def pacote_ok(lead_id: str) -> bool:
+        return True
+
+    monkeypatch.setattr(scheduler, "validar_pacote_obrigatorio", pacote_ok)
+    return agora, gateway, enviadas
+
+
+def _cobranca(gateway: payment.GatewayLocal) -> str:
+    return list(gateway.links)[-1]
+
+
+def test_reserva_nao_paga_expira_e_lead_e_avisado(ambiente):
+    agora, gateway, enviadas = ambiente
+    varredor = hold_sweeper.VarredorReservas(scheduler.reserva_expirada)
+
+    async def _run():
+        resultado = await scheduler.processar_agendamento("ana", TER, "09:00", distancia_km=0)
+        assert gateway.links[_cobranca(gateway)] in resultado["mensagem"]
+        assert await varredor.varrer() == 0
+        agora[0] += inventario.SLOT_HOLD_TTL + 1
+        assert await varredor.varrer() == 1
+        assert await varredor.varrer() == 0
+        return await inventario.estado_dia(TER, scheduler.agenda_do_dia), await payment.get_cobranca(_cobranca(gateway))
+
+    estado, cobranca = asyncio.run(_run())
+    assert estado["livres"] == AGENDA_TER and estado["reservados"] == {}
+    assert cobranca["status"] == "expirado"
+    assert gateway.cancelados == [cobranca["id"]]
+    assert enviadas[0][0] == "ana" and "expirou sem pagamento" in enviadas[0][1]
+    assert f"{TER} às 09:00" in enviadas[0][1]  # o próprio horário voltou às sugestões
+
+
+def test_vencida_devolvida_por_outra_operacao_tambem_e_avisada(ambiente):
+    agora, gateway, enviadas = ambiente
+
+    async def _run():
+        await scheduler.processar_agendamento("ana", TER, "09:00", distancia_km=0)
+        agora[0] += inventario.SLOT_HOLD_TTL + 1
+        # outro lead pega o horário antes da varredura (a vencida volta ao estoque de passagem)
+        assert (await scheduler.processar_agendamento("bia", TER, "09:00", distancia_km=0))["status"] == "preliminar"
+        return await hold_sweeper.VarredorReservas(scheduler.reserva_expirada).varrer()
+
+    assert asyncio.run(_run()) == 1
+    assert [numero for numero, _ in enviadas] == ["ana"]
+
+
+def test_pagamento_confirma_reserva_e_evento_repetido_e_ignorado(ambiente):
+    agora, gateway, enviadas = ambiente
+
+    async def _run():
+        await scheduler.processar_agendamento("ana", TER, "10:00", distancia_km=0)
+        evento = gateway.evento(_cobranca(gateway), "approved")
+        primeiro = await scheduler.confirmar_pagamento(evento)
+        repetido = await scheduler.confirmar_pagamento(evento)
+        agora[0] += inventario.SLOT_HOLD_TTL * 2
+        expiradas = await hold_sweeper.VarredorReservas(scheduler.reserva_expirada).varrer()
+        return primeiro, repetido, expiradas, await inventario.estado_dia(TER, scheduler.agenda_do_dia)
+
+    primeiro, repetido, expiradas, estado = asyncio.run(_run())
+    assert primeiro["status"] == "confirmado"
+    assert repetido == {"status": "ignorado"}
+    assert expiradas == 0
+    assert estado["confirmados"] == {"10:00": "ana"}
+    assert len(enviadas) == 1 and "Pagamento confirmado" in enviadas[0][1]
+
+
+def test_pagamento_atrasado_retoma_horario_livre_ou_estorna(ambiente):
+    agora, gateway, enviadas = ambiente
+    varredor = hold_sweeper.VarredorReservas(scheduler.reserva_expirada)
+
+    async def _run():
+        await scheduler.processar_agendamento("ana", TER, "09:00", distancia_km=0)
+        cobranca_ana = _cobranca(gateway)
+        await scheduler.processar_agendamento("bia", TER, "14:00", distancia_km=0)
+        cobranca_bia = _cobranca(gateway)
+        agora[0] += inventario.SLOT_HOLD_TTL + 1
+        await varredor.varrer()
+        await scheduler.processar_agendamento("caio", TER, "14:00", distancia_km=0)  # pega o horário da bia
+        ana = await scheduler.confirmar_pagamento(gateway.evento(cobranca_ana))
+        bia = await scheduler.confirmar_pagamento(gateway.evento(cobranca_bia))
+        return ana, bia, await payment.get_cobranca(cobranca_bia)
+
+    ana, bia, cobranca_bia = asyncio.run(_run())
+    assert ana["status"] == "confirmado"
+    assert bia["status"] == "reembolso" and cobranca_bia["status"] == "reembolso"
+    assert "estornar" in enviadas[-1][1]
+
+
+def test_pagamento_recusado_libera_horario(ambiente):
+    agora, gateway, enviadas = ambiente
+
+    async def _run():
+        await scheduler.processar_agendamento("ana", TER, "09:00", distancia_km=0)
+        resultado = await scheduler.confirmar_pagamento(gateway.evento(_cobranca(gateway), "refused"))
+        return resultado, await scheduler.verificar_disponibilidade(TER, "09:00")
+
+    resultado, livre = asyncio.run(_run())
+    assert resultado["status"] == "recusado" and livre
+
+
+def test_pagamento_depois_de_recusa_confirma_e_recusa_depois_do_pagamento_e_ignorada(ambiente):
+    agora, gateway, enviadas = ambiente
+
+    async def _run():
+        await scheduler.processar_agendamento("ana", TER, "09:00", distancia_km=0)
+        cobranca = _cobranca(gateway)
+        recusado = await scheduler.confirmar_pagamento(gateway.evento(cobranca, "refused"))
+        pago = await scheduler.confirmar_pagamento(gateway.evento(cobranca))
+        tardia = await scheduler.confirmar_pagamento(gateway.evento(cobranca, "refused"))
+        return recusado, pago, tardia, await inventario.estado_dia(TER, scheduler.agenda_do_dia)
+
+    recusado, pago, tardia, estado = asyncio.run(_run())
+    assert recusado["status"] == "recusado" and pago["status"] == "confirmado"
+    assert tardia == {"status": "ignorado"}
+    assert estado["confirmados"] == {"09:00": "ana"}
+
+
+def test_aviso_velho_de_expiracao_nao_cancela_pagamento_nem_nova_reserva(ambiente):
+    agora, gateway, enviadas = ambiente
+    varredor = hold_sweeper.VarredorReservas(scheduler.reserva_expirada)
+
+    async def _run():
+        await scheduler.processar_agendamento("ana", TER, "09:00", distancia_km=0)
+        cobranca_ana = _cobranca(gateway)
+        await scheduler.processar_agendamento("bia", TER, "10:00", distancia_km=0)
+        agora[0] += inventario.SLOT_HOLD_TTL + 1
+        # antes da varredura: a bia pagou atrasada e a ana reservou o mesmo horário de novo
+        await scheduler.confirmar_pagamento(gateway.evento(_cobranca(gateway)))
+        await scheduler.processar_agendamento("ana", TER, "09:00", distancia_km=0)
+        await varredor.varrer()
+        return await inventario.estado_dia(TER, scheduler.agenda_do_dia), await payment.get_cobranca(cobranca_ana)
+
+    estado, cobranca_ana = asyncio.run(_run())
+    assert estado["reservados"] == {"09:00": "ana"} and estado["confirmados"] == {"10:00": "bia"}
+    assert cobranca_ana["status"] == "pendente" and gateway.cancelados == []
+    assert not any("expirou" in texto for _, texto in enviadas)
+
+
+def test_varredores_concorrentes_avisam_cada_reserva_uma_vez(monkeypatch):
+    """
+    Milhares de reservas vencendo juntas, três workers varrendo o mesmo Redis:
+    todas voltam ao estoque e cada lead recebe exatamente um aviso.
+    """
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True, max_connections=1000)
+    monkeypatch.setattr(sessions, "redis_client", client)
+    agora = [0.0]
+    monkeypatch.setattr(inventario, "_agora", lambda: agora[0])
+    data = "2030-07-01"
+
+    def agenda(data):
+        return [(f"{h:02d}:{m:02d}", ("online",)) for h in range(24) for m in range(60)]
+
+    avisos = []
+
+    async def notificar(lead, data, horario):
+        avisos.append(lead)
+
+    async def _run():
+        for horario, _ in agenda(data):
+            await inventario.reservar(data, horario, f"lead-{horario}", agenda, ttl=60)
+        agora[0] += 61
+        varredores = [hold_sweeper.VarredorReservas(notificar, lote=200) for _ in range(3)]
+        totais = await asyncio.gather(*(v.varrer() for v in varredores))
+        livres = await inventario.proximos_livres(data, agenda, quantidade=10_000, horizonte_dias=0)
+        return sum(totais), len(livres)
+
+    total, livres = asyncio.run(_run())
+    assert total == livres == len(avisos) == len(set(avisos)) == 1440
+
+
+def test_webhook_exige_token_do_gateway(ambiente, monkeypatch):
+    monkeypatch.setattr(payment, "PAGAMENTO_WEBHOOK_TOKEN", "segredo")
+    client = TestClient(app)
+    assert client.post("/pagamentos/webhook", json={"id": "x", "status": "pago"}).status_code == 401
+    resposta = client.post(
+        "/pagamentos/webhook", json={"id": "x", "status": "?"}, headers={"X-Webhook-Token": "segredo"}
+    )
+    assert resposta.json()["ok"] is False
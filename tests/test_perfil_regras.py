@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+import services.llm as llm
+import services.nlp as nlp
+import services.perfil_regras as pr
+from benchmarks.perfil_rotulado import AMOSTRA
+from tests.fakes.llm import FakeLLM
+
+
+@pytest.fixture(autouse=True)
+def estatisticas_zeradas():
+    pr.limpar_estatisticas_perfil_regras()
+    yield
+    pr.limpar_estatisticas_perfil_regras()
+
+
+@pytest.mark.parametrize(
+    "mensagem, flags",
+    [
+        ("Estou grávida de 20 semanas", {"is_gest": True}),
+        ("espermograma ruim", {"bad_sperm": True}),
+        ("ESTAMOS TENTANDO ENGRAVIDAR", {"is_ttc": True}),
+        ("minha filha de 8 anos", {"is_child8": True}),
+        ("entrei na menopausa", {"menopausa": True}),
+    ],
+)
+def test_flags_com_confianca(mensagem, flags):
+    perfil = pr.extrair_perfil_por_regras(mensagem)
+    assert perfil["flags"] == flags
+    assert pr.perfil_suficiente(perfil)
+
+
+def test_negacao_nao_marca_flag():
+    assert pr.extrair_perfil_por_regras("não estou grávida")["flags"] == {}
+
+
+def test_sinal_fraco_escala_para_o_llm():
+    perfil = pr.extrair_perfil_por_regras("Meu exame de espermograma chegou")
+    assert perfil["flags"] == {"bad_sperm": True}
+    assert not pr.perfil_suficiente(perfil)
+
+
+def test_urgencia_e_temperatura():
+    perfil = pr.extrair_perfil_por_regras("estou grávida e com sangramento, é urgente")
+    assert perfil["urgencia"] == 90 and perfil["temperatura"] == "quente"
+    perfil = pr.extrair_perfil_por_regras("queremos engravidar, só pesquisando por enquanto")
+    assert perfil["urgencia"] == pr.URGENCIA_POR_FLAG["is_ttc"] and perfil["temperatura"] == "frio"
+
+
+def test_amostra_rotulada_sem_flag_errada():
+    """
+    Nenhum perfil resolvido sem LLM na amostra rotulada tem flags erradas,
+    e a maioria das mensagens com flag dispensa o LLM.
+    """
+    resolvidas = 0
+    for mensagem, esperado in AMOSTRA:
+        perfil = pr.extrair_perfil_por_regras(mensagem)
+        if pr.perfil_suficiente(perfil):
+            resolvidas += 1
+            assert set(perfil["flags"]) == esperado, mensagem
+    assert resolvidas >= sum(1 for _, esperado in AMOSTRA if esperado) // 2
+
+
+def test_analise_perfil_so_chama_llm_quando_precisa(monkeypatch):
+    FakeLLM.instancias.clear()
+    monkeypatch.setattr(llm, "OllamaLLM", FakeLLM)
+    llm.limpar_clientes_llm()
+    fake = llm.get_ollama_llm(format="json")
+    fake.resposta = '{"flags": {}, "urgencia": 10, "temperatura": "frio"}'
+
+    async def _run():
+        return [
+            await nlp.analise_perfil("estou grávida de 20 semanas"),
+            await nlp.analise_perfil("oi, queria umas informações"),
+            await nlp.analise_perfil("meu marido tem azoospermia"),
+        ]
+
+    gest, generico, azoo = asyncio.run(_run())
+    llm.limpar_clientes_llm()
+    assert gest["flags"] == {"is_gest": True}
+    assert generico["temperatura"] == "frio"
+    assert "produto_sugerido_ia" not in azoo and pr.perfil_suficiente(azoo)
+    assert len(fake.prompts) == 1
+    assert pr.estatisticas_perfil_regras() == {"regras": 2, "escalados": 1, "taxa_sem_llm": 2 / 3}
@@ -0,0 +1,81 @@
+import asyncio
+import json
+
+import pytest
+
+import services.llm as llm
+import services.nlp as nlp
+import services.product_pipeline as pipeline
+from tests.fakes.llm import FakeLLM
+
+PHONE = "5541999999999"
+
+
+@pytest.fixture()
+def ambiente(monkeypatch):
+    """
+    Ollama falso, leads em um dict e envios do WhatsApp registrados em lista.
+    """
+    FakeLLM.instancias.clear()
+    monkeypatch.setattr(llm, "OllamaLLM", FakeLLM)
+    llm.limpar_clientes_llm()
+    leads: dict[str, dict] = {}
+    enviados: list[str] = []
+
+    async def get_lead(numero):
+        return leads.get(numero)
+
+    async def create_lead(numero):
+        return leads.setdefault(numero, {"numero": numero})
+
+    async def update_lead(numero, dados):
+        leads[numero].update(dados)
+
+    monkeypatch.setattr(pipeline, "get_lead", get_lead)
+    monkeypatch.setattr(pipeline, "create_lead", create_lead)
+    monkeypatch.setattr(pipeline, "update_lead", update_lead)
+    monkeypatch.setattr(pipeline, "enviar_mensagem", lambda numero, texto: enviados.append(texto))
+    yield leads, enviados
+    llm.limpar_clientes_llm()
+
+
+def test_terminais_rodam_em_paralelo_com_limite(ambiente, monkeypatch):
+    monkeypatch.setattr(nlp, "TERMINAIS_MAX_CONCORRENCIA", 2)
+    monkeypatch.setattr(llm, "LLM_MAX_INFLIGHT", 10)
+    fake = llm.get_ollama_llm()
+    fake.latencia = 0.02
+
+    async def falha():
+        raise ValueError("boom")
+
+    async def _run():
+        return await nlp.executar_terminais(
+            a=nlp.gerar_copy("Consulta Avulsa", "morno", "Ana"),
+            b=nlp.decidir_produto_ia(50, {}, False),
+            c=nlp.gerar_copy("Plano Infantil", "quente", "Bia"),
+            d=falha(),
+        )
+
+    resultados = asyncio.run(_run())
+    assert list(resultados) == ["a", "b", "c", "d"]
+    assert resultados["d"] is None
+    assert all(resultados[n] for n in "abc")
+    assert fake.pico_em_voo == 2
+
+
+def test_etapa_de_produto_gera_so_a_copy(ambiente, monkeypatch):
+    """
+    Na etapa de produto só a copy vai ao modelo (o produto vem das regras).
+    """
+    leads, enviados = ambiente
+    monkeypatch.setattr(pipeline, "LLM_STREAMING", False)
+    leads[PHONE] = {"numero": PHONE, "formulario_respondido": True, "etapa": "produto", "score": 40, "flags": []}
+    fake = llm.get_ollama_llm()
+    fake.resposta = "Copy do produto"
+
+    asyncio.run(pipeline.process_zapi_payload({"phone": PHONE, "message": "preenchi"}))
+
+    assert len(fake.prompts) == 1
+    assert enviados == ["Copy do produto"]
+    assert leads[PHONE]["produto_escolhido"]
+    assert leads[PHONE]["etapa"] == "finalizado"
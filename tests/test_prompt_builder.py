@@ -0,0 +1,93 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+import core.sessions as sessions
+import services.dialog_engine as dialog_engine
+import services.llm as llm
+import services.prompt_builder as pb
+from tests.fakes.llm import FakeLLM
+
+PHONE = "5541999999999"
+
+
+def historico(n, tamanho=200):
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"mensagem {i} " + "x" * tamanho,
+            "timestamp": f"2025-07-01T10:{i // 60:02d}:{i % 60:02d}",
+        }
+        for i in range(n)
+    ]
+
+
+def test_prompt_inclui_sistema_resumo_e_mensagem_uma_vez():
+    history = historico(4, tamanho=0) + [{"role": "user", "content": "quero marcar", "timestamp": "2025-07-01T11:00:00"}]
+    prompt = pb.montar_prompt({"resumo": "Paciente Ana, gestante."}, history, "quero marcar")
+    assert prompt.startswith(f"system: {pb.SYSTEM_PROMPT}\n")
+    assert "Resumo da conversa até aqui: Paciente Ana, gestante." in prompt
+    assert prompt.count("quero marcar") == 1
+    assert prompt.endswith("user: quero marcar\nassistant:")
+
+
+def test_prompt_respeita_orcamento():
+    prompt = pb.montar_prompt({}, historico(200), "oi", max_tokens=400)
+    assert pb.estimar_tokens(prompt) <= 400 + 5
+    assert "mensagem 199" in prompt
+
+
+def test_mensagem_gigante_e_truncada():
+    prompt = pb.montar_prompt({}, [], "a" * 20000, max_tokens=300)
+    assert pb.estimar_tokens(prompt) <= 300 + 5
+
+
+def test_resumo_incremental(monkeypatch):
+    monkeypatch.setattr(pb, "PROMPT_TURNOS_RECENTES", 4)
+    monkeypatch.setattr(pb, "save_session", lambda *a: asyncio.sleep(0))
+    session = {}
+
+    async def _run():
+        primeira = await pb.atualizar_resumo(PHONE, session, historico(6, tamanho=0))
+        repetida = await pb.atualizar_resumo(PHONE, session, historico(6, tamanho=0))
+        segunda = await pb.atualizar_resumo(PHONE, session, historico(8, tamanho=0))
+        return primeira, repetida, segunda
+
+    primeira, repetida, segunda = asyncio.run(_run())
+    assert primeira["resumo"] == "user: mensagem 0 | assistant: mensagem 1"
+    assert repetida is None
+    assert segunda["resumo"].endswith("user: mensagem 2 | assistant: mensagem 3")
+    assert session["resumo_ate"] == "2025-07-01T10:00:03"
+
+
+def test_resumo_extrativo_limitado():
+    resumo = pb.resumir_extrativo("", historico(100), max_tokens=100)
+    assert pb.estimar_tokens(resumo) <= 101
+    assert "mensagem 99" in resumo
+
+
+def test_tamanho_do_prompt_constante_em_conversa_longa(monkeypatch):
+    """
+    Em 40 turnos pelo fallback, o prompt para de crescer depois da janela recente.
+    """
+    monkeypatch.setattr(sessions, "redis_client", fakeredis.aioredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(llm, "OllamaLLM", FakeLLM)
+    llm.limpar_clientes_llm()
+    fake = llm.get_ollama_llm()
+    fake.resposta = "Claro! " + "y" * 150
+
+    async def _run():
+        for i in range(40):
+            mensagem = f"pergunta {i} " + "z" * 150
+            await sessions.append_message(PHONE, "user", mensagem)
+            await dialog_engine.gerar_resposta_fallback(PHONE, mensagem)
+            await asyncio.gather(*pb._resumos_em_andamento.values())
+        return await sessions.load_session(PHONE, history_limit=0)
+
+    session = asyncio.run(_run())
+    llm.limpar_clientes_llm()
+    tamanhos = [pb.estimar_tokens(p) for p in fake.prompts]
+    assert max(tamanhos) <= pb.PROMPT_MAX_TOKENS + 5
+    assert max(tamanhos[20:]) - min(tamanhos[20:]) < 100
+    assert session["resumo"]
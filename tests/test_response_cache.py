@@ -0,0 +1,124 @@
+import asyncio
+
+import fakeredis
+
+import core.sessions as sessions
+import services.dialog_engine as dialog_engine
+import services.llm as llm
+import services.response_cache as rc
+from tests.fakes.llm import FakeLLM
+
+PHONE = "5541999999999"
+
+
+class Relogio:
+    def __init__(self):
+        self.agora = 0.0
+
+    def __call__(self):
+        return self.agora
+
+
+def test_acerto_exato_ignora_acentos_e_caixa():
+    cache = rc.CacheRespostas(similaridade=0)
+    cache.guardar("Qual o horário de atendimento?", {}, "Das 8h às 18h.", custo_s=2.0)
+    assert cache.buscar("qual o horario de atendimento", {}) == "Das 8h às 18h."
+    stats = cache.estatisticas()
+    assert stats["hits_exatos"] == 1
+    assert stats["segundos_economizados"] == 2.0
+
+
+def test_estado_da_sessao_faz_parte_da_chave():
+    cache = rc.CacheRespostas(similaridade=0)
+    cache.guardar("como funciona a consulta", {"data": "2025-07-01", "horario": "10:00"}, "Dia 1 às 10h.")
+    assert cache.buscar("como funciona a consulta", {}) is None
+    assert cache.buscar("como funciona a consulta", {"data": "2025-07-01", "horario": "10:00"}) == "Dia 1 às 10h."
+
+
+def test_vizinho_mais_proximo_acima_do_limiar():
+    cache = rc.CacheRespostas(similaridade=0.8)
+    cache.guardar("qual o endereço da clínica", {}, "Rua das Flores, 100.")
+    cache.guardar("quanto custa a consulta", {}, "R$ 300.")
+    assert cache.buscar("oi, qual é o endereço da clínica?", {}) == "Rua das Flores, 100."
+    assert cache.buscar("a clínica aceita convênio", {}) is None
+    stats = cache.estatisticas()
+    assert stats["hits_semanticos"] == 1
+    assert stats["misses"] == 1
+
+
+def test_mensagens_curtas_nao_entram():
+    cache = rc.CacheRespostas()
+    assert not cache.guardar("ok", {}, "Combinado!")
+    assert cache.buscar("ok", {}) is None
+
+
+def test_ttl_e_limite_de_tamanho():
+    relogio = Relogio()
+    cache = rc.CacheRespostas(max_entradas=2, ttl=60, similaridade=0, relogio=relogio)
+    cache.guardar("pergunta numero um", {}, "1")
+    cache.guardar("pergunta numero dois", {}, "2")
+    cache.buscar("pergunta numero um", {})  # vira a mais recente
+    cache.guardar("pergunta numero tres", {}, "3")
+    assert cache.buscar("pergunta numero dois", {}) is None
+    assert cache.buscar("pergunta numero um", {}) == "1"
+    assert cache.metricas["despejos"] == 1
+
+    relogio.agora = 61
+    assert cache.buscar("pergunta numero tres", {}) is None
+    assert cache.estatisticas()["entradas"] == 1
+    # O índice invertido acompanha as remoções
+    assert "tres" not in cache._indice
+
+
+def test_fallback_so_chama_o_llm_uma_vez_por_pergunta(monkeypatch):
+    monkeypatch.setattr(sessions, "redis_client", fakeredis.aioredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(llm, "OllamaLLM", FakeLLM)
+    monkeypatch.setattr(dialog_engine, "get_cache_respostas", lambda: cache)
+    cache = rc.CacheRespostas()
+    llm.limpar_clientes_llm()
+    fake = llm.get_ollama_llm()
+    fake.resposta = "Atendemos de segunda a sexta, das 8h às 18h."
+
+    async def _run():
+        # Primeira mensagem de cada lead: sem contexto, a resposta vale para todos
+        respostas = [
+            await dialog_engine.gerar_resposta_fallback("5541000000001", "qual o horário de atendimento?"),
+            await dialog_engine.gerar_resposta_fallback("5541000000002", "Qual o horario de atendimento"),
+            await dialog_engine.gerar_resposta_fallback("5541000000003", "Bom dia! Qual é o horário de atendimento?"),
+        ]
+        return respostas, await sessions.get_history("5541000000003")
+
+    respostas, history = asyncio.run(_run())
+    llm.limpar_clientes_llm()
+    assert len(fake.prompts) == 1
+    assert respostas == [fake.resposta] * 3
+    assert [m["content"] for m in history] == [fake.resposta]
+    assert cache.metricas["hits_exatos"] == 1
+    assert cache.metricas["hits_semanticos"] == 1
+
+
+def test_conversa_com_contexto_nao_usa_o_cache(monkeypatch):
+    """
+    A resposta gerada com o histórico de um lead não é servida a outro lead nem ao
+    mesmo lead depois que o contexto mudou.
+    """
+    monkeypatch.setattr(sessions, "redis_client", fakeredis.aioredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(llm, "OllamaLLM", FakeLLM)
+    monkeypatch.setattr(dialog_engine, "get_cache_respostas", lambda: cache)
+    cache = rc.CacheRespostas()
+    llm.limpar_clientes_llm()
+    fake = llm.get_ollama_llm()
+    fake.resposta = "Claro, Ana! Como conversamos, o pacote infantil cobre as consultas."
+
+    async def _run():
+        await sessions.append_message(PHONE, "user", "Meu nome é Ana e escolhi o pacote infantil")
+        await sessions.append_message(PHONE, "assistant", "Anotado, Ana!")
+        await dialog_engine.gerar_resposta_fallback(PHONE, "o que o meu pacote cobre?")
+        await sessions.save_session("5541000000009", {"resumo": "Lead Bruno, gestante."})
+        await dialog_engine.gerar_resposta_fallback("5541000000009", "o que o meu pacote cobre?")
+        await dialog_engine.gerar_resposta_fallback("5541000000008", "o que o meu pacote cobre?")
+
+    asyncio.run(_run())
+    llm.limpar_clientes_llm()
+    assert len(fake.prompts) == 3
+    assert cache.estatisticas()["entradas"] == 1  # só a do lead sem contexto
@@ -0,0 +1,201 @@
+import asyncio
+import datetime
+import random
+
+import fakeredis
+import pytest
+
+import core.sessions as sessions
+import services.scheduler as scheduler
+import services.slot_inventory as inventario
+
+
+def _proximo(dia_semana: int, a_partir: datetime.date) -> datetime.date:
+    return a_partir + datetime.timedelta(days=(dia_semana - a_partir.weekday()) % 7)
+
+
+SEG = _proximo(0, datetime.date.today() + datetime.timedelta(days=7))
+TER = (SEG + datetime.timedelta(days=1)).isoformat()
+QUA = (SEG + datetime.timedelta(days=2)).isoformat()
+SEX = (SEG + datetime.timedelta(days=4)).isoformat()
+SEG = SEG.isoformat()
+AGENDA_TER = ["09:00", "10:00", "14:00"]
+
+
+@pytest.fixture()
+def redis(monkeypatch):
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True, max_connections=1000)
+    monkeypatch.setattr(sessions, "redis_client", client)
+    monkeypatch.setattr(scheduler, "slots", {TER: AGENDA_TER})
+
+    async def pacote_ok(lead_id: str) -> bool:
+        return True
+
+    monkeypatch.setattr(scheduler, "validar_pacote_obrigatorio", pacote_ok)
+    return client
+
+
+def test_sem_dupla_reserva_com_agendamentos_concorrentes(redis):
+    """
+    300 leads disputando os 3 horários do dia ao mesmo tempo: exatamente
+    3 reservas preliminares, uma por horário, cada uma de um lead diferente;
+    os demais recebem sugestões em outros horários.
+    """
+    pedidos = [(f"lead-{n}", random.choice(AGENDA_TER)) for n in range(300)]
+
+    async def _run():
+        resultados = await asyncio.gather(
+            *(scheduler.processar_agendamento(lead, TER, horario, distancia_km=0) for lead, horario in pedidos)
+        )
+        return resultados, await inventario.estado_dia(TER, scheduler.agenda_do_dia)
+
+    resultados, estado = asyncio.run(_run())
+    preliminares = [r for r in resultados if r["status"] == "preliminar"]
+    assert len(preliminares) == len(AGENDA_TER)
+    assert sorted(r["horario"] for r in preliminares) == AGENDA_TER
+    assert len(set(estado["reservados"].values())) == len(AGENDA_TER)
+    assert estado["livres"] == []
+    sugeridos = {(s["data"], s["horario"]) for r in resultados for s in r.get("sugestoes", [])}
+    assert not sugeridos & {(TER, h) for h in AGENDA_TER}
+
+
+def test_reserva_preliminar_expira_sem_pagamento(redis, monkeypatch):
+    agora = [1_000.0]
+    monkeypatch.setattr(inventario, "_agora", lambda: agora[0])
+    agenda = scheduler.agenda_do_dia
+
+    async def _run():
+        assert await inventario.reservar(TER, "10:00", "ana", agenda, ttl=600) == 1_600.0
+        assert await inventario.reservar(TER, "10:00", "bia", agenda, ttl=600) is None
+        agora[0] += 601
+        assert await inventario.disponivel(TER, "10:00", agenda)
+        assert await inventario.reservar(TER, "10:00", "bia", agenda, ttl=600)
+        return await inventario.confirmar(TER, "10:00", "ana", agenda)
+
+    assert asyncio.run(_run()) is False
+
+
+def test_confirmar_e_cancelar(redis, monkeypatch):
+    agora = [0.0]
+    monkeypatch.setattr(inventario, "_agora", lambda: agora[0])
+
+    async def _run():
+        await scheduler.reservar_slot(TER, "09:00", "ana")
+        await scheduler.reservar_slot(TER, "10:00", "bia")
+        assert await scheduler.confirmar_reserva("ana", TER, "09:00")
+        assert await scheduler.confirmar_reserva("ana", TER, "09:00")  # idempotente
+        assert not await scheduler.cancelar_reserva("ana", TER, "10:00")  # não é dela
+        assert await scheduler.cancelar_reserva("bia", TER, "10:00")
+        agora[0] += inventario.SLOT_HOLD_TTL * 2  # confirmada não expira
+        return await inventario.estado_dia(TER, scheduler.agenda_do_dia)
+
+    estado = asyncio.run(_run())
+    assert estado == {"livres": ["10:00", "14:00"], "reservados": {}, "confirmados": {"09:00": "ana"}}
+
+
+def test_dia_lotado_sugere_proximos_dias(redis):
+    async def _run():
+        for n, horario in enumerate(AGENDA_TER):
+            await scheduler.reservar_slot(TER, horario, f"lead-{n}")
+        return await scheduler.processar_agendamento("bia", TER, "10:00", distancia_km=0)
+
+    resultado = asyncio.run(_run())
+    assert resultado["status"] == "sugestao"
+    horarios_sexta = scheduler.AGENDA_SEMANAL[4]
+    assert resultado["sugestoes"] == [
+        {"data": SEX, "horario": h, "modalidade": "presencial"} for h in horarios_sexta[:scheduler.AGENDA_SUGESTOES]
+    ]
+    assert f"{SEX} às {horarios_sexta[0]}" in resultado["mensagem"]
+
+
+def test_busca_por_modalidade_e_horario(redis):
+    async def _run():
+        presenciais = await scheduler.proximos_slots(SEG, quantidade=8, modalidade="presencial")
+        depois = await scheduler.proximos_slots(TER, "09:00", quantidade=2)
+        return presenciais, depois
+
+    presenciais, depois = asyncio.run(_run())
+    assert {datetime.date.fromisoformat(s["data"]).weekday() for s in presenciais} == {4}
+    assert len({s["data"] for s in presenciais}) == 2  # 6 horários por sexta
+    assert depois == [{"data": TER, "horario": "10:00"}, {"data": TER, "horario": "14:00"}]
+
+
+def test_dia_sem_atendimento_ja_traz_sugestoes(redis):
+    resultado = asyncio.run(scheduler.processar_agendamento("ana", QUA, "10:00", distancia_km=500))
+    assert resultado["status"] == "dia_invalido"
+    assert "segundas, terças e sextas" in resultado["mensagem"]
+    assert resultado["sugestoes"][0] == {"data": SEX, "horario": "09:00", "modalidade": "online"}
+
+
+def test_data_passada_e_horario_normalizado(redis):
+    async def _run():
+        passada = await scheduler.processar_agendamento("ana", "2020-01-06", "10:00", distancia_km=0)
+        normalizado = await scheduler.processar_agendamento("ana", TER, "9:00", distancia_km=0)
+        invalido = await scheduler.processar_agendamento("ana", TER, "25:00", distancia_km=0)
+        return passada, normalizado, invalido
+
+    passada, normalizado, invalido = asyncio.run(_run())
+    assert passada["status"] == "data_passada" and passada["sugestoes"]
+    assert normalizado["status"] == "preliminar" and normalizado["horario"] == "09:00"
+    assert invalido["status"] == "data_invalida"
+
+
+def test_horarios_de_hoje_que_ja_passaram_nao_sao_reservados_nem_sugeridos(redis, monkeypatch):
+    agora = datetime.datetime.fromisoformat(f"{TER}T09:30").timestamp()
+    monkeypatch.setattr(inventario, "_agora", lambda: agora)
+
+    async def _run():
+        resultado = await scheduler.processar_agendamento("ana", TER, "09:00", distancia_km=0)
+        return (
+            resultado,
+            await scheduler.reservar_slot(TER, "09:00", "bia"),
+            await scheduler.proximos_slots(TER, quantidade=2),
+        )
+
+    resultado, reserva, proximos = asyncio.run(_run())
+    assert resultado["status"] == "horario_passado"
+    primeira = resultado["sugestoes"][0]
+    assert (primeira["data"], primeira["horario"]) == (TER, "10:00")
+    assert reserva is None
+    assert [p["horario"] for p in proximos if p["data"] == TER] == ["10:00", "14:00"]
+
+
+def test_dia_recarregado_quando_a_agenda_muda(redis):
+    """
+    Exceção de data criada depois do carregamento vale na próxima consulta, inclusive
+    em outro processo (versão guardada no Redis); reservas e confirmados ficam.
+    """
+    agenda = scheduler.agenda_do_dia
+
+    async def _run():
+        await scheduler.reservar_slot(TER, "09:00", "ana")
+        assert await scheduler.confirmar_reserva("ana", TER, "09:00")
+        await scheduler.reservar_slot(TER, "10:00", "bia")
+        scheduler.slots[TER] = ["09:00", "10:00", "11:00"]
+        mesmo_processo = await inventario.estado_dia(TER, agenda)
+        inventario.limpar_cache_agenda()  # outro processo, agenda antiga
+        scheduler.slots[TER] = AGENDA_TER
+        outro_processo = await inventario.estado_dia(TER, agenda)
+        return mesmo_processo, outro_processo
+
+    mesmo_processo, outro_processo = asyncio.run(_run())
+    assert mesmo_processo == {"livres": ["11:00"], "reservados": {"10:00": "bia"}, "confirmados": {"09:00": "ana"}}
+    assert outro_processo["livres"] == ["14:00"]
+
+
+def test_dias_passados_saem_do_redis(redis, monkeypatch):
+    agora = [0.0]
+    monkeypatch.setattr(inventario, "_agora", lambda: agora[0])
+
+    async def _run():
+        await scheduler.reservar_slot(TER, "09:00", "ana")
+        assert await scheduler.confirmar_reserva("ana", TER, "09:00")
+        agora[0] = datetime.datetime.fromisoformat(f"{QUA}T08:00").timestamp()
+        await inventario.estado_dia(QUA, scheduler.agenda_do_dia)
+        return [
+            await redis.hkeys(chave) for chave in ("slots:info", "slots:carregados", "slots:confirmados")
+        ]
+
+    info, carregados, confirmados = asyncio.run(_run())
+    assert not [s for s in info if s.startswith(TER)]
+    assert carregados == [QUA] and confirmados == []
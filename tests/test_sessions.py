@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import fakeredis
+import pytest
+
+import core.sessions as sessions
+
+PHONE = "5541999999999"
+
+
+@pytest.fixture(autouse=True)
+def fake_redis(monkeypatch):
+    """
+    Troca o cliente Redis da sessão por um fakeredis assíncrono isolado.
+    """
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(sessions, "redis_client", client)
+    return client
+
+
+def test_sessao_vazia():
+    session = asyncio.run(sessions.load_session(PHONE))
+    assert session["history"] == []
+    assert "created_at" in session
+
+
+def test_append_e_load(fake_redis):
+    async def _run():
+        await sessions.append_message(PHONE, "user", "oi")
+        await sessions.append_message(PHONE, "assistant", "olá!")
+        return await sessions.load_session(PHONE), await fake_redis.ttl(sessions.get_history_key(PHONE))
+
+    session, ttl = asyncio.run(_run())
+    assert [(m["role"], m["content"]) for m in session["history"]] == [("user", "oi"), ("assistant", "olá!")]
+    assert "created_at" in session
+    assert 0 < ttl <= sessions.SESSION_TTL
+
+
+def test_historico_limitado(monkeypatch):
+    monkeypatch.setattr(sessions, "SESSION_MAX_HISTORY", 5)
+
+    async def _run():
+        for i in range(12):
+            await sessions.append_message(PHONE, "user", f"msg {i}")
+        return await sessions.get_history(PHONE), await sessions.get_history(PHONE, limit=2)
+
+    completo, ultimas = asyncio.run(_run())
+    assert [m["content"] for m in completo] == [f"msg {i}" for i in range(7, 12)]
+    assert [m["content"] for m in ultimas] == ["msg 10", "msg 11"]
+
+
+def test_appends_concorrentes_nao_se_perdem():
+    """
+    Webhooks simultâneos do mesmo número não sobrescrevem o histórico uns dos outros.
+    """
+    async def _run():
+        await asyncio.gather(*(sessions.append_message(PHONE, "user", f"msg {i}") for i in range(50)))
+        return await sessions.get_history(PHONE)
+
+    assert len(asyncio.run(_run())) == 50
+
+
+def test_save_session_grava_metadados_sem_tocar_no_historico():
+    async def _run():
+        await sessions.append_message(PHONE, "user", "2025-07-01 09:00")
+        session = await sessions.load_session(PHONE)
+        session["data"] = "2025-07-01"
+        session["horario"] = "09:00"
+        session["history"] = []  # ignorado pelo save_session
+        await sessions.save_session(PHONE, session)
+        return await sessions.load_session(PHONE)
+
+    session = asyncio.run(_run())
+    assert session["data"] == "2025-07-01"
+    assert session["horario"] == "09:00"
+    assert len(session["history"]) == 1
+
+
+def test_migra_sessao_no_formato_antigo(fake_redis):
+    async def _run():
+        antiga = {"history": [{"role": "user", "content": "oi"}], "created_at": "2025-01-01", "data": "2025-07-01"}
+        await fake_redis.set(sessions.get_legacy_key(PHONE), json.dumps(antiga))
+        await sessions.load_session(PHONE)
+        await sessions.append_message(PHONE, "user", "tudo bem?")
+        return await sessions.load_session(PHONE)
+
+    session = asyncio.run(_run())
+    assert [m["content"] for m in session["history"]] == ["oi", "tudo bem?"]
+    assert session["data"] == "2025-07-01"
+    assert session["created_at"] == "2025-01-01"
+
+
+def test_clear_session(fake_redis):
+    async def _run():
+        await sessions.append_message(PHONE, "user", "oi")
+        await sessions.clear_session(PHONE)
+        return await fake_redis.keys("*")
+
+    assert asyncio.run(_run()) == []
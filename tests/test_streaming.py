@@ -0,0 +1,117 @@
+import asyncio
+import random
+
+import fakeredis
+import httpx
+
+import core.sessions as sessions
+import services.dialog_engine as dialog_engine
+import services.llm as llm
+import utils.zapi as zapi
+from services.streaming import fatiar_em_mensagens, transmitir_resposta
+from tests.fakes.llm import FakeLLM
+
+COPY = (
+    "Olá, Ana! Que bom falar com você. "
+    "Este pacote acompanha cada fase da gestação.\n\n"
+    "Você terá consultas próximas e orientação contínua. Tudo pensado para você.\n\n"
+    "Vamos agendar?"
+)
+
+
+async def tokens(texto, tamanho=3):
+    for i in range(0, len(texto), tamanho):
+        await asyncio.sleep(0)
+        yield texto[i:i + tamanho]
+
+
+def fatiar(texto, **kwargs):
+    async def _run():
+        return [f async for f in fatiar_em_mensagens(tokens(texto), **kwargs)]
+    return asyncio.run(_run())
+
+
+def test_fatia_por_paragrafo_e_frase():
+    assert fatiar(COPY, min_chars=40) == [
+        "Olá, Ana! Que bom falar com você. Este pacote acompanha cada fase da gestação.",
+        "Você terá consultas próximas e orientação contínua.",
+        "Tudo pensado para você.",
+        "Vamos agendar?",
+    ]
+
+
+def test_frases_curtas_sao_agrupadas():
+    assert fatiar("Oi. Tudo bem? Sim.", min_chars=80) == ["Oi. Tudo bem? Sim."]
+
+
+def test_corta_texto_sem_pontuacao_no_limite():
+    fragmentos = fatiar("palavra " * 100, min_chars=10, max_chars=50)
+    assert all(len(f) <= 50 for f in fragmentos)
+    assert " ".join(fragmentos).split() == ["palavra"] * 100
+
+
+def test_envios_em_ordem_mesmo_com_latencia_variavel():
+    enviados = []
+
+    async def enviar(numero, texto):
+        await asyncio.sleep(random.uniform(0, 0.01))
+        enviados.append(texto)
+
+    completo = asyncio.run(transmitir_resposta("5541999999999", tokens(COPY), enviar))
+    assert enviados == completo.split("\n\n") == fatiar(COPY)
+    assert len(enviados) >= 3
+
+
+def test_responder_mensagem_em_streaming(monkeypatch):
+    """
+    Com LLM_STREAMING, os fragmentos saem pela Z-API e a resposta não é reenviada no final.
+    """
+    monkeypatch.setattr(sessions, "redis_client", fakeredis.aioredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(llm, "OllamaLLM", FakeLLM)
+    monkeypatch.setattr(dialog_engine, "LLM_STREAMING", True)
+    llm.limpar_clientes_llm()
+    llm.get_ollama_llm().resposta = COPY
+    enviados = []
+
+    async def enviar_mensagem_zapi(numero, mensagem, delay_typing=None):
+        enviados.append((mensagem, delay_typing))
+
+    monkeypatch.setattr(dialog_engine, "enviar_mensagem_zapi", enviar_mensagem_zapi)
+    monkeypatch.setattr(dialog_engine, "agendar_envio_zapi", lambda *a: enviados.append(a))
+
+    conteudo = asyncio.run(dialog_engine.responder_mensagem("5541999999999", "me fala do pacote", {}))
+    llm.limpar_clientes_llm()
+    assert [m for m, _ in enviados] == fatiar(COPY)
+    assert all(delay == dialog_engine.STREAM_DIGITANDO_S for _, delay in enviados)
+    assert conteudo == "\n\n".join(m for m, _ in enviados)
+
+
+def test_falha_no_envio_de_um_fragmento_nao_interrompe_a_resposta(monkeypatch):
+    """
+    Z-API falha num fragmento: os seguintes saem e a resposta completa vai para o histórico.
+    """
+    client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(sessions, "redis_client", client)
+    monkeypatch.setattr(llm, "OllamaLLM", FakeLLM)
+    monkeypatch.setattr(dialog_engine, "LLM_STREAMING", True)
+    llm.limpar_clientes_llm()
+    llm.get_ollama_llm().resposta = COPY
+    enviados = []
+
+    async def enviar_mensagem_zapi(numero, mensagem, delay_typing=None):
+        if not enviados:
+            enviados.append(None)
+            raise httpx.ConnectError("Z-API fora")
+        enviados.append(mensagem)
+
+    monkeypatch.setattr(dialog_engine, "enviar_mensagem_zapi", enviar_mensagem_zapi)
+
+    async def _run():
+        conteudo = await dialog_engine.responder_mensagem("5541999999999", "me fala do pacote", {})
+        return conteudo, (await sessions.load_session("5541999999999"))["history"]
+
+    conteudo, historico = asyncio.run(_run())
+    llm.limpar_clientes_llm()
+    assert enviados[1:] == fatiar(COPY)[1:]
+    assert conteudo == "\n\n".join(fatiar(COPY))
+    assert historico[-1]["content"] == conteudo
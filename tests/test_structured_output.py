@@ -0,0 +1,69 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import services.llm as llm
+import services.nlp as nlp
+import services.structured_output as so
+from tests.fakes.llm import FakeLLM
+
+CORPUS = os.path.join(os.path.dirname(__file__), "fixtures", "saidas_perfil.jsonl")
+
+
+def carregar_corpus() -> list[dict]:
+    """
+    Saídas gravadas do modelo (gemma) para o terminal de perfil, com o resultado
+    esperado e por onde a interpretação deve passar (direto, reparado ou falha).
+    """
+    with open(CORPUS, encoding="utf-8") as f:
+        return [json.loads(linha) for linha in f if linha.strip()]
+
+
+@pytest.fixture(autouse=True)
+def estatisticas_zeradas():
+    so.limpar_estatisticas_saida_estruturada()
+    yield
+    so.limpar_estatisticas_saida_estruturada()
+
+
+@pytest.mark.parametrize("caso", carregar_corpus(), ids=lambda c: c["saida"][:40])
+def test_corpus_de_saidas_gravadas(caso):
+    if caso["esperado"] is None:
+        with pytest.raises(ValueError):
+            so.interpretar(caso["saida"])
+    else:
+        assert so.interpretar(caso["saida"]).model_dump() == caso["esperado"]
+    assert so.estatisticas_saida_estruturada()[caso["origem"]] == 1
+
+
+def test_taxas_no_corpus():
+    corpus = carregar_corpus()
+    for caso in corpus:
+        so.interpretar_ou_padrao(caso["saida"])
+    stats = so.estatisticas_saida_estruturada()
+    falhas = sum(1 for c in corpus if c["esperado"] is None)
+    assert stats["total"] == len(corpus)
+    assert stats["taxa_falha"] == pytest.approx(falhas / len(corpus))
+    assert stats["direto"] + stats["reparado"] == len(corpus) - falhas
+
+
+def test_padrao_quando_nao_ha_json():
+    perfil = so.interpretar_ou_padrao("não sei")
+    assert perfil["flags"] == {} and perfil["urgencia"] == 0 and perfil["temperatura"] == "morno"
+    assert "erro" in perfil
+
+
+def test_analise_perfil_repara_sem_nova_geracao(monkeypatch):
+    FakeLLM.instancias.clear()
+    monkeypatch.setattr(llm, "OllamaLLM", FakeLLM)
+    llm.limpar_clientes_llm()
+    fake = llm.get_ollama_llm(format="json")
+    fake.resposta = '```json\n{"flags": {"gestante": true}, "urgencia": 70, "temperatura": "quente",}\n```'
+
+    perfil = asyncio.run(nlp.analise_perfil("queria uma orientação"))
+    llm.limpar_clientes_llm()
+    assert perfil == {"flags": {"is_gest": True}, "urgencia": 70, "temperatura": "quente"}
+    assert len(fake.prompts) == 1
+    assert '"is_gest": false' in fake.prompts[0]
@@ -0,0 +1,222 @@
+import asyncio
+import fcntl
+import json
+import os
+
+import pytest
+
+import core.db as db
+import core.write_behind as wb
+import models.lead as lead_repo
+from tests.fakes.supabase import COLUNAS_LEADS, fake_supabase_leads
+
+PHONE = "5541999999999"
+
+
+def _linha(numero: str, **campos) -> dict:
+    return {**{c: None for c in COLUNAS_LEADS}, "numero": numero, **campos}
+
+
+@pytest.fixture()
+def banco(monkeypatch):
+    fake = fake_supabase_leads()
+    db.usar_cliente_supabase(fake)
+    lead_repo.limpar_cache_leads()
+    monkeypatch.setattr(lead_repo, "LEAD_EVENTOS_TABELA", "lead_eventos")
+    yield fake
+    wb._buffer = None
+    db.usar_cliente_supabase(None)
+    lead_repo.limpar_cache_leads()
+
+
+@pytest.fixture()
+def journal(tmp_path):
+    return str(tmp_path / "write_behind.jsonl")
+
+
+def _ops(journal: str, pid=None) -> list[dict]:
+    caminho = wb.journal_do_processo(journal, pid)
+    if not os.path.exists(caminho):
+        return []
+    with open(caminho, encoding="utf-8") as f:
+        return [json.loads(l) for l in f]
+
+
+def test_lead_novo_e_etapas_viram_um_upsert(banco, journal):
+    banco.tabelas["leads"] = [_linha("5541000000000")]
+
+    async def _run():
+        buffer = await wb.iniciar_buffer_escrita(janela=3600, journal=journal)
+        try:
+            lead = await lead_repo.create_lead(PHONE)
+            lead["etapa"] = "aguardando_form"
+            await lead_repo.update_lead(PHONE, lead)
+            lead["etapa"] = "produto"
+            lead["score"] = 80
+            await lead_repo.update_lead(PHONE, lead)
+            await lead_repo.registrar_evento_lead(PHONE, "formulario_enviado")
+            assert banco.requisicoes == [("leads", "select")]  # descoberta das colunas
+            assert (await lead_repo.get_lead(PHONE))["etapa"] == "produto"
+            return await buffer.descarregar()
+        finally:
+            await wb.parar_buffer_escrita()
+
+    assert asyncio.run(_run()) == 2
+    assert sorted(banco.requisicoes[1:]) == [("lead_eventos", "insert"), ("leads", "upsert")]
+    linha = banco.tabelas["leads"][1]
+    assert (linha["etapa"], linha["score"]) == ("produto", 80)
+    assert banco.tabelas["lead_eventos"][0]["tipo"] == "formulario_enviado"
+    assert _ops(journal) == []
+
+
+def test_lote_nao_sobrescreve_lead_que_ja_existia(banco, journal):
+    outro = "5541000000000"
+    banco.tabelas["leads"] = [_linha("5541000000001")]
+
+    async def _run():
+        buffer = await wb.iniciar_buffer_escrita(janela=3600, journal=journal)
+        try:
+            await lead_repo.create_lead(PHONE)
+            await lead_repo.create_lead(outro)
+            await lead_repo.update_lead(PHONE, {"etapa": "produto"})
+            # outro worker grava os dois leads antes da descarga
+            banco.tabelas["leads"] += [_linha(PHONE, nome="Ana", score=90), _linha(outro, nome="Bia", score=40)]
+            await buffer.descarregar()
+            return await lead_repo.get_lead(outro)
+        finally:
+            await wb.parar_buffer_escrita()
+
+    lead_outro = asyncio.run(_run())
+    _, ana, bia = banco.tabelas["leads"]
+    assert (ana["nome"], ana["score"], ana["etapa"]) == ("Ana", 90, "produto")
+    assert (bia["nome"], bia["score"]) == ("Bia", 40)
+    assert lead_outro["nome"] == "Bia"  # o cache recebeu a linha real, não a estrutura padrão
+    assert sorted(op for _, op in banco.requisicoes) == ["select", "select", "update", "upsert"]
+
+
+def test_alteracoes_do_mesmo_lead_viram_um_patch(banco, journal):
+    banco.tabelas["leads"] = [_linha(PHONE, etapa="inicial", score=0)]
+
+    async def _run():
+        buffer = await wb.iniciar_buffer_escrita(janela=3600, journal=journal)
+        try:
+            await lead_repo.get_lead(PHONE)
+            await lead_repo.update_lead(PHONE, {"etapa": "aguardando_form"})
+            await lead_repo.update_lead(PHONE, {"etapa": "produto", "score": 80})
+            await lead_repo.update_lead(PHONE, {"etapa": "finalizado"})
+            await buffer.descarregar()
+        finally:
+            await wb.parar_buffer_escrita()
+
+    asyncio.run(_run())
+    assert [op for _, op in banco.requisicoes] == ["select", "update"]
+    assert banco.tabelas["leads"][0]["etapa"] == "finalizado"
+    assert banco.tabelas["leads"][0]["score"] == 80
+
+
+def test_campanha_insere_leads_em_lote(banco, journal):
+    async def _run():
+        buffer = await wb.iniciar_buffer_escrita(janela=3600, max_pendentes=1000, journal=journal)
+        try:
+            for n in range(50):
+                await lead_repo.create_lead(f"55419{n:08d}")
+            await buffer.descarregar()
+        finally:
+            await wb.parar_buffer_escrita()
+
+    asyncio.run(_run())
+    assert banco.requisicoes == [("leads", "upsert")]
+    assert len(banco.tabelas["leads"]) == 50
+
+
+def test_journal_recupera_escritas_apos_queda(banco, journal):
+    async def _queda():
+        buffer = wb.BufferEscrita(janela=3600, journal=journal)
+        buffer.inserir("leads", "numero", {"numero": PHONE, "etapa": "inicial"})
+        buffer.atualizar("leads", "numero", PHONE, {"etapa": "aguardando_form"})
+        # processo cai aqui: nada foi descarregado e o sistema solta a trava do journal
+        buffer._journal.fechar()
+
+    async def _reinicio():
+        await wb.iniciar_buffer_escrita(janela=3600, journal=journal)
+        await wb.parar_buffer_escrita()
+
+    asyncio.run(_queda())
+    assert banco.requisicoes == [] and len(_ops(journal)) == 2
+    asyncio.run(_reinicio())
+    assert banco.requisicoes == [("leads", "upsert")]
+    assert banco.tabelas["leads"][0]["etapa"] == "aguardando_form"
+    assert _ops(journal) == []
+
+
+def test_falha_transitoria_fica_no_buffer(banco, journal):
+    banco.tabelas["leads"] = [_linha(PHONE, etapa="inicial")]
+
+    async def _run():
+        buffer = await wb.iniciar_buffer_escrita(janela=3600, journal=journal)
+        try:
+            await lead_repo.get_lead(PHONE)
+            await lead_repo.update_lead(PHONE, {"etapa": "produto"})
+            banco.falhas_transitorias = 1
+            await buffer.descarregar()
+            assert buffer.metricas["falhas"] == 1
+            await buffer.sincronizar_journal()
+            assert [op["dados"]["etapa"] for op in _ops(journal)] == ["produto"]
+            await lead_repo.update_lead(PHONE, {"score": 70})
+            await buffer.descarregar()
+        finally:
+            await wb.parar_buffer_escrita()
+
+    asyncio.run(_run())
+    assert [op for _, op in banco.requisicoes] == ["select", "update", "update"]
+    assert banco.tabelas["leads"][0]["etapa"] == "produto"
+    assert banco.tabelas["leads"][0]["score"] == 70
+    assert _ops(journal) == []
+
+
+def test_tabela_vazia_aprende_colunas_com_o_lote(banco, journal):
+    async def _run():
+        await wb.iniciar_buffer_escrita(janela=3600, journal=journal)
+        try:
+            await lead_repo.create_lead(PHONE)
+            await lead_repo.update_lead(PHONE, {"etapa": "aguardando_form"})
+        finally:
+            await wb.parar_buffer_escrita()
+
+    asyncio.run(_run())
+    assert [op for _, op in banco.requisicoes] == ["select", "upsert", "update"]
+    assert banco.tabelas["leads"][0]["etapa"] == "aguardando_form"
+
+
+def test_erro_de_esquema_nao_e_repetido(banco, journal):
+    async def _run():
+        buffer = wb.BufferEscrita(janela=3600, journal=journal)
+        buffer.atualizar("leads", "numero", PHONE, {"coluna_inexistente": 1})
+        await buffer.descarregar()
+        await buffer.sincronizar_journal()
+        assert _ops(journal) == []
+        await buffer.parar()
+        return buffer.quantidade()
+
+    assert asyncio.run(_run()) == 0
+
+
+def test_cada_processo_tem_seu_journal_e_so_os_orfaos_sao_reaplicados(banco, journal):
+    def _gravar(pid: int, numero: str):
+        with open(wb.journal_do_processo(journal, pid), "w", encoding="utf-8") as f:
+            op = {"op": "inserir", "tabela": "leads", "coluna": "numero", "dados": {"numero": numero}}
+            f.write(json.dumps(op) + "\n")
+
+    async def _reinicio():
+        buffer = await wb.iniciar_buffer_escrita(janela=3600, journal=journal)
+        assert buffer.journal == wb.journal_do_processo(journal)
+        await wb.parar_buffer_escrita()
+
+    _gravar(1, PHONE)                # worker que caiu
+    _gravar(2, "5541000000000")      # worker ainda rodando (mantém a trava)
+    with open(wb.journal_do_processo(journal, 2)) as vivo:
+        fcntl.flock(vivo, fcntl.LOCK_EX)
+        asyncio.run(_reinicio())
+    assert [l["numero"] for l in banco.tabelas["leads"]] == [PHONE]
+    assert _ops(journal, 1) == [] and len(_ops(journal, 2)) == 1
+    assert _ops(journal) == []  # parada limpa: o journal deste processo é apagado
@@ -0,0 +1,154 @@
+import asyncio
+
+import httpx
+import pytest
+
+import utils.zapi as zapi
+from tests.fakes.zapi import FakeZapi
+
+
+@pytest.fixture()
+def fake_zapi(monkeypatch):
+    """
+    Aponta o sender para o servidor Z-API falso, com backoff zerado.
+    """
+    fake = FakeZapi()
+    monkeypatch.setattr(zapi, "MOCK_ZAPI", False)
+    monkeypatch.setattr(zapi, "ZAPI_API_URL", "http://fake-zapi")
+    monkeypatch.setattr(zapi, "ZAPI_INSTANCE", "inst1")
+    monkeypatch.setattr(zapi, "ZAPI_TOKEN", "tok")
+    monkeypatch.setattr(zapi, "ZAPI_BACKOFF_BASE", 0)
+    zapi.configurar_transporte(fake.transport())
+    yield fake
+    zapi.configurar_transporte(None)
+
+
+def run(coro):
+    async def _run():
+        try:
+            return await coro
+        finally:
+            await zapi.fechar_cliente_zapi()
+    return asyncio.run(_run())
+
+
+def test_envio_simples(fake_zapi):
+    """
+    Mensagem chega ao servidor falso com telefone e texto.
+    """
+    resp = run(zapi.enviar_mensagem_zapi("5541999999999", "Olá!"))
+    assert resp["zaapId"] == "fake-1"
+    assert fake_zapi.mensagens == [{"instancia": "inst1", "phone": "5541999999999", "message": "Olá!"}]
+
+
+def test_repete_em_erro_do_servidor(fake_zapi):
+    """
+    Servidor indisponível (503) é repetido até o limite de tentativas.
+    """
+    fake_zapi.falhas = 2
+    run(zapi.enviar_mensagem_zapi("5541999999999", "Olá!"))
+    assert fake_zapi.requisicoes == 3
+    assert len(fake_zapi.mensagens) == 1
+
+
+def test_desiste_apos_limite_de_tentativas(fake_zapi):
+    fake_zapi.falhas = 10
+    with pytest.raises(RuntimeError):
+        run(zapi.enviar_mensagem_zapi("5541999999999", "Olá!"))
+    assert fake_zapi.requisicoes == zapi.ZAPI_MAX_TENTATIVAS
+
+
+def test_erro_do_cliente_nao_repete(fake_zapi):
+    fake_zapi.falhas = 1
+    fake_zapi.status_falha = 400
+    with pytest.raises(RuntimeError):
+        run(zapi.enviar_mensagem_zapi("5541999999999", "Olá!"))
+    assert fake_zapi.requisicoes == 1
+
+
+def test_erro_500_nao_repete(fake_zapi):
+    """
+    Em 500 a Z-API recebeu a requisição: repetir poderia duplicar a mensagem.
+    """
+    fake_zapi.falhas = 1
+    fake_zapi.status_falha = 500
+    with pytest.raises(RuntimeError):
+        run(zapi.enviar_mensagem_zapi("5541999999999", "Olá!"))
+    assert fake_zapi.requisicoes == 1
+
+
+@pytest.mark.parametrize("corpo, esperado", [("", {}), ("ok", {"texto": "ok"})])
+def test_resposta_sem_json_nao_falha_o_envio(fake_zapi, corpo, esperado):
+    zapi.configurar_transporte(httpx.MockTransport(lambda request: httpx.Response(200, text=corpo)))
+    assert run(zapi.enviar_mensagem_zapi("5541999999999", "Olá!")) == esperado
+
+
+def test_429_espera_o_retry_after(fake_zapi, monkeypatch):
+    fake_zapi.falhas = 1
+    fake_zapi.status_falha = 429
+    fake_zapi.retry_after = "2"
+    esperas = []
+    dormir = asyncio.sleep
+
+    async def sleep(segundos, *args, **kwargs):
+        esperas.append(segundos)
+        await dormir(0)
+
+    monkeypatch.setattr(asyncio, "sleep", sleep)
+    run(zapi.enviar_mensagem_zapi("5541999999999", "Olá!"))
+    assert fake_zapi.requisicoes == 2 and 2 in esperas
+
+
+def test_retry_after_longo_demais_desiste_na_hora(fake_zapi):
+    fake_zapi.falhas = 1
+    fake_zapi.status_falha = 429
+    fake_zapi.retry_after = str(int(zapi.ZAPI_RETRY_AFTER_MAX) + 1)
+    with pytest.raises(RuntimeError, match="Retry-After"):
+        run(zapi.enviar_mensagem_zapi("5541999999999", "Olá!"))
+    assert fake_zapi.requisicoes == 1
+
+
+@pytest.mark.parametrize("erro, tentativas", [(httpx.ConnectError, 2), (httpx.ReadTimeout, 1)])
+def test_so_repete_falhas_de_conexao(fake_zapi, erro, tentativas):
+    """
+    Sem conexão, a mensagem certamente não saiu; num timeout de leitura pode ter
+    saído, e repetir mandaria duplicada.
+    """
+    requisicoes = []
+
+    def responder(request):
+        requisicoes.append(request)
+        if len(requisicoes) == 1:
+            raise erro("falha simulada", request=request)
+        return httpx.Response(200, json={"zaapId": "ok"})
+
+    zapi.configurar_transporte(httpx.MockTransport(responder))
+    if tentativas == 1:
+        with pytest.raises(RuntimeError):
+            run(zapi.enviar_mensagem_zapi("5541999999999", "Olá!"))
+    else:
+        assert run(zapi.enviar_mensagem_zapi("5541999999999", "Olá!")) == {"zaapId": "ok"}
+    assert len(requisicoes) == tentativas
+
+
+def test_limite_de_concorrencia_por_instancia(fake_zapi, monkeypatch):
+    """
+    Nunca há mais envios simultâneos por instância que ZAPI_MAX_CONCORRENCIA.
+    """
+    monkeypatch.setattr(zapi, "ZAPI_MAX_CONCORRENCIA", 2)
+    fake_zapi.latencia = 0.01
+
+    async def disparar():
+        for i in range(10):
+            zapi.agendar_envio_zapi(f"55419999900{i:02d}", f"msg {i}")
+        await zapi.aguardar_envios_pendentes()
+
+    run(disparar())
+    assert len(fake_zapi.mensagens) == 10
+    assert fake_zapi.pico_em_voo["inst1"] == 2
+
+
+def test_mock_nao_faz_requisicao(fake_zapi, monkeypatch):
+    monkeypatch.setattr(zapi, "MOCK_ZAPI", True)
+    assert run(zapi.enviar_mensagem_zapi("5541999999999", "Olá!")) == {"mock": True}
+    assert fake_zapi.requisicoes == 0
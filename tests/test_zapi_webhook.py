@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+
+import fakeredis
+import pytest
+from fastapi.testclient import TestClient
+
+import routers.zapi_webhook as zapi_webhook
+import services.dedup as dedup
+from main import app
+from models.input import MensagemRecebida, parse_evento_zapi
+
+CALLBACKS = os.path.join(os.path.dirname(__file__), "fixtures", "zapi_callbacks.jsonl")
+with open(CALLBACKS, encoding="utf-8") as f:
+    CASOS = [json.loads(linha) for linha in f]
+
+PAYLOAD = {
+    "messageId": "3EB0C767D71D",
+    "phone": "5541999999999",
+    "momment": 1_700_000_000_000,
+    "text": {"message": "Quero agendar"},
+}
+
+
+@pytest.fixture()
+def webhook(monkeypatch):
+    """
+    Webhook síncrono com dedup no Redis falso e um handler que só registra as chamadas.
+    """
+    deduplicador = dedup.DeduplicadorMensagens(dedup.DedupRedis(fakeredis.aioredis.FakeRedis(decode_responses=True)))
+    monkeypatch.setattr(dedup, "_deduplicador", deduplicador)
+    monkeypatch.setattr(zapi_webhook, "FILA_ATIVA", False)
+    chamadas = []
+
+    async def responder(numero, texto, payload):
+        chamadas.append((numero, texto))
+        if texto == "quebra" and len(chamadas) == 1:
+            raise RuntimeError("falha simulada")
+        return "resposta"
+
+    monkeypatch.setattr(zapi_webhook, "responder_mensagem", responder)
+    return TestClient(app, raise_server_exceptions=False), chamadas, deduplicador
+
+
+def _entrada(payload: dict):
+    return parse_evento_zapi(json.dumps(payload)).entrada()
+
+
+@pytest.mark.parametrize("caso", CASOS, ids=lambda c: c["payload"].get("messageId") or c["payload"].get("type", "sem_tipo"))
+def test_callbacks_gravados(caso):
+    evento = parse_evento_zapi(json.dumps(caso["payload"]).encode())
+    esperado = caso["esperado"]
+    if "ignorado" in esperado:
+        assert evento.descarte() == esperado["ignorado"] and evento.entrada() is None
+    else:
+        entrada = evento.entrada()
+        assert (entrada.numero, entrada.texto) == (esperado["numero"], esperado["texto"])
+
+
+def test_corpo_invalido_e_descartes_nao_tocam_redis_nem_llm(webhook):
+    client, chamadas, deduplicador = webhook
+    assert client.post("/zapi/webhook", content=b"{nao e json").json() == {"ok": False, "motivo": "Payload inválido"}
+    assert client.post("/zapi/webhook", json={**PAYLOAD, "momment": "ontem"}).json()["ok"] is False
+    ignorados = [c for c in CASOS if "ignorado" in c["esperado"]]
+    for caso in ignorados:
+        assert client.post("/zapi/webhook", json=caso["payload"]).json() == {
+            "ok": True, "ignorado": caso["esperado"]["ignorado"],
+        }
+    assert chamadas == [] and deduplicador.metricas["recebidas"] == 0
+
+
+def test_chave_usa_id_do_provedor_ou_hash_com_momento():
+    novo_formato = {"messages": [{"id": "wamid.1", "from": "5541", "text": {"body": "oi"}}]}
+    assert dedup.chave_mensagem(_entrada(PAYLOAD)) == "id:3EB0C767D71D"
+    assert dedup.chave_mensagem(_entrada(novo_formato)) == "id:wamid.1"
+
+    sem_id = {k: v for k, v in PAYLOAD.items() if k != "messageId"}
+    assert dedup.chave_mensagem(_entrada(sem_id)) == dedup.chave_mensagem(_entrada(dict(sem_id)))
+    assert dedup.chave_mensagem(_entrada(sem_id)) != dedup.chave_mensagem(_entrada({**sem_id, "momment": 1_700_000_000_001}))
+    assert dedup.chave_mensagem(_entrada({"phone": "5541", "text": {"message": "ok"}})) is None
+    assert isinstance(parse_evento_zapi(json.dumps(PAYLOAD)), MensagemRecebida)
+
+
+def test_reenvio_nao_e_processado_de_novo(webhook):
+    client, chamadas, deduplicador = webhook
+    primeira = client.post("/zapi/webhook", json=PAYLOAD).json()
+    repetida = client.post("/zapi/webhook", json=PAYLOAD).json()
+    outra = client.post("/zapi/webhook", json={**PAYLOAD, "messageId": "3EB0C767D71E"}).json()
+
+    assert primeira == {"ok": True, "mensagem_enviada": "resposta"}
+    assert repetida == {"ok": True, "duplicada": True}
+    assert outra["ok"] and len(chamadas) == 2
+    metricas = client.get("/zapi/dedup").json()
+    assert (metricas["recebidas"], metricas["duplicadas"]) == (3, 1)
+
+
+def test_falha_no_processamento_libera_o_reenvio(webhook):
+    client, chamadas, _ = webhook
+    payload = {**PAYLOAD, "text": {"message": "quebra"}}
+    assert client.post("/zapi/webhook", json=payload).status_code == 500
+    assert client.post("/zapi/webhook", json=payload).json()["mensagem_enviada"] == "resposta"
+    assert len(chamadas) == 2
+
+
+def test_redis_fora_nao_perde_mensagens(webhook, monkeypatch):
+    client, chamadas, deduplicador = webhook
+
+    class RedisFora:
+        async def set(self, *args, **kwargs):
+            raise ConnectionError("redis fora")
+
+    monkeypatch.setattr(deduplicador.backend, "redis", RedisFora())
+    for _ in range(2):
+        assert client.post("/zapi/webhook", json=PAYLOAD).json()["mensagem_enviada"] == "resposta"
+    assert len(chamadas) == 2 and deduplicador.metricas["falhas"] == 2
+
+
+def test_backend_memoria_expira_pela_janela_e_limita_tamanho():
+    agora = [0.0]
+    memoria = dedup.DedupMemoria(janela=60, maximo=3, relogio=lambda: agora[0])
+
+    async def _run():
+        assert await memoria.marcar("a")
+        assert not await memoria.marcar("a")
+        agora[0] = 61
+        assert await memoria.marcar("a")  # janela vencida: a entrega é nova
+        for chave in "bcd":
+            await memoria.marcar(chave)
+        assert await memoria.marcar("e") and len(memoria) <= 4
+        return await memoria.marcar("a")  # a mais antiga saiu pelo limite
+
+    assert asyncio.run(_run()) is True
@@ -1,9 +1,204 @@
 # utils/logger.py
 
-from datetime import datetime
+import atexit
+import contextvars
 import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional
+
+# ————— Configuração —————
+LOG_NIVEL = os.getenv("LOG_NIVEL", "INFO").upper()
+# Regras por tipo de evento: "trecho do título=valor", separadas por vírgula; vale a primeira que casar.
+#   LOG_NIVEIS="MOCK Mensagem enviada=DEBUG,Idas ao Supabase=DEBUG"
+#   LOG_AMOSTRAGEM="Mensagem recebida=0.1"  (fração registrada; avisos e erros nunca são amostrados)
+LOG_NIVEIS = os.getenv("LOG_NIVEIS", "")
+LOG_AMOSTRAGEM = os.getenv("LOG_AMOSTRAGEM", "")
+LOG_MASCARAR_PII = os.getenv("LOG_MASCARAR_PII", "1") == "1"
+# Registros aguardando a escrita; com a fila cheia, novos registros são descartados (e contados)
+LOG_FILA_MAX = int(os.getenv("LOG_FILA_MAX", "10000"))
+
+# Saída: uma linha JSON compacta por evento
+#   {"ts": "...", "nivel": "INFO", "evento": "📤 Mensagem enviada Z-API", "correlacao": "...", "dados": {...}}
+# log_event só monta o registro e o coloca na fila (sem bloquear: fila cheia → descarta
+# e conta); serialização, máscara e escrita acontecem na thread do QueueListener,
+# fora do caminho da requisição.
+
+_stats = {"descartados": 0, "amostrados": 0}
+_correlacao: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("correlacao", default=None)
+
+# Telefones (10 a 15 dígitos seguidos): mantém DDI/DDD e os 4 últimos dígitos
+_TELEFONE = re.compile(r"(?<!\d)(\d{4})(\d{2,7})(\d{4})(?!\d)")
+
+
+def nova_correlacao(valor: Optional[str] = None) -> str:
+    """
+    Define o ID de correlação do contexto atual (requisição, mensagem da fila...).
+    Tarefas criadas a partir daqui (envio em segundo plano etc.) herdam o ID.
+    """
+    correlacao = valor or uuid.uuid4().hex[:16]
+    _correlacao.set(correlacao)
+    return correlacao
+
+
+def correlacao_atual() -> Optional[str]:
+    return _correlacao.get()
+
+
+def mascarar(valor):
+    """
+    Mascara telefones em textos (recursivo em dicts e listas): 5541999991234 → 5541*****1234.
+    """
+    if isinstance(valor, str):
+        return _TELEFONE.sub(lambda m: m.group(1) + "*" * len(m.group(2)) + m.group(3), valor)
+    if isinstance(valor, dict):
+        return {k: mascarar(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [mascarar(v) for v in valor]
+    return valor
+
+
+def _regras(config: str) -> list[tuple[str, str]]:
+    regras = []
+    for item in filter(None, (p.strip() for p in config.split(","))):
+        trecho, _, valor = item.rpartition("=")
+        regras.append((trecho.strip(), valor.strip()))
+    return regras
+
+
+_REGRAS_NIVEL = _regras(LOG_NIVEIS)
+_REGRAS_AMOSTRAGEM = _regras(LOG_AMOSTRAGEM)
+
+
+@lru_cache(maxsize=1024)
+def _nivel_do_evento(titulo: str) -> int:
+    for trecho, nivel in _REGRAS_NIVEL:
+        if trecho in titulo:
+            return logging.getLevelName(nivel.upper())
+    if "❌" in titulo:
+        return logging.ERROR
+    if "⚠️" in titulo:
+        return logging.WARNING
+    return logging.INFO
+
+
+@lru_cache(maxsize=1024)
+def _taxa_do_evento(titulo: str) -> float:
+    for trecho, taxa in _REGRAS_AMOSTRAGEM:
+        if trecho in titulo:
+            return float(taxa)
+    return 1.0
+
+
+class FormatadorJson(logging.Formatter):
+    def __init__(self, mascarar_pii: bool = LOG_MASCARAR_PII):
+        super().__init__()
+        self.mascarar_pii = mascarar_pii
+
+    def format(self, record: logging.LogRecord) -> str:
+        dados = getattr(record, "dados", None)
+        if self.mascarar_pii:
+            dados = mascarar(dados)
+        linha = {
+            "ts": datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "evento": record.msg,
+            "correlacao": getattr(record, "correlacao", None),
+            "dados": dados,
+        }
+        try:
+            return json.dumps(linha, ensure_ascii=False, separators=(",", ":"), default=str)
+        except (TypeError, ValueError, RuntimeError):
+            # Ex.: estrutura alterada por outra thread durante a serialização
+            linha["dados"] = repr(dados)
+            return json.dumps(linha, ensure_ascii=False, separators=(",", ":"))
+
+
+class _Registro:
+    """
+    Registro mínimo enfileirado por log_event. Montar um logging.LogRecord completo
+    (caminho do módulo, thread, processo...) custa mais que o resto do log_event;
+    os handlers do QueueListener só precisam destes campos.
+    """
+
+    __slots__ = ("created", "levelno", "levelname", "msg", "dados", "correlacao")
+    args = None
+    exc_info = None
+    exc_text = None
+    stack_info = None
+
+    def __init__(self, levelno: int, msg: str, dados, correlacao: Optional[str]):
+        self.created = time.time()
+        self.levelno = levelno
+        self.levelname = logging.getLevelName(levelno)
+        self.msg = msg
+        self.dados = dados
+        self.correlacao = correlacao
+
+    def getMessage(self) -> str:
+        return self.msg
+
+
+_fila: queue.Queue = queue.Queue(LOG_FILA_MAX)
+_saida = logging.StreamHandler(sys.stdout)
+_saida.setFormatter(FormatadorJson())
+_listener = logging.handlers.QueueListener(_fila, _saida)
+_listener.start()
+_nivel_minimo = logging.getLevelName(LOG_NIVEL)
+
+
+def log_event(titulo: str, conteudo=None, nivel: Optional[str] = None):
+    """
+    Registra um evento. O nível vem de `nivel`, das regras de LOG_NIVEIS ou do
+    título ("❌" → ERROR, "⚠️" → WARNING, demais → INFO).
+    `conteudo` é copiado no primeiro nível: alterações posteriores no dict não
+    aparecem no log (estruturas aninhadas são serializadas como estiverem).
+    """
+    numero_nivel = logging.getLevelName(nivel.upper()) if nivel else _nivel_do_evento(titulo)
+    if numero_nivel < _nivel_minimo:
+        return
+    if numero_nivel < logging.WARNING:
+        taxa = _taxa_do_evento(titulo)
+        if taxa < 1.0 and random.random() >= taxa:
+            _stats["amostrados"] += 1
+            return
+    dados = dict(conteudo) if isinstance(conteudo, dict) else conteudo
+    try:
+        _fila.put_nowait(_Registro(numero_nivel, titulo, dados, _correlacao.get()))
+    except queue.Full:
+        _stats["descartados"] += 1
+
+
+def estatisticas_logger() -> dict:
+    """
+    Registros aguardando escrita e os descartados (fila cheia) ou amostrados.
+    """
+    return {"fila": _fila.qsize(), **_stats}
+
+
+def descarregar_logs():
+    """
+    Aguarda a escrita de tudo o que já foi enfileirado (testes e shutdown).
+    """
+    if _listener._thread is not None:
+        _fila.join()
+
+
+def parar_logger():
+    """
+    Escreve o que restar na fila e encerra a thread de escrita.
+    """
+    if _listener._thread is not None:
+        _listener.stop()
+
 
-def log_event(titulo: str, conteudo: dict):
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"\n🔹 [{timestamp}] {titulo}")
-    print(json.dumps(conteudo, indent=2, ensure_ascii=False))
+atexit.register(parar_logger)
@@ -0,0 +1,252 @@
+# utils/metrics.py
+
+import asyncio
+import inspect
+import os
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Optional
+
+# ————— Configuração —————
+# METRICAS=0 desliga a coleta: `medir` devolve um bloco vazio e `cronometrar` devolve
+# a própria função decorada (nenhum custo por chamada)
+METRICAS_ATIVAS = os.getenv("METRICAS", "1") == "1"
+
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BUCKETS_TOKENS_S = (1, 2, 5, 10, 20, 35, 50, 75, 100, 150, 250)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Métricas no formato texto do Prometheus, sem dependências: o processo é um só event
+# loop, então as séries são dicts simples (valores dos rótulos → contadores).
+
+
+def _rotulos(nomes: tuple[str, ...], valores: tuple, extra: str = "") -> str:
+    pares = [
+        f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), "")}"'
+        for n, v in zip(nomes, valores)
+    ]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+def _numero(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nome: str, ajuda: str, rotulos: tuple[str, ...] = (), buckets: tuple = BUCKETS_SEGUNDOS):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self.buckets = tuple(buckets)
+        self.series: dict[tuple, list] = {}  # rótulos → [contagem por bucket..., acima do último, soma]
+
+    def observar(self, valor: float, *rotulos):
+        serie = self.series.get(rotulos)
+        if serie is None:
+            serie = self.series[rotulos] = [0] * (len(self.buckets) + 1) + [0.0]
+        serie[bisect_left(self.buckets, valor)] += 1
+        serie[-1] += valor
+
+    def contagem(self, *rotulos) -> int:
+        serie = self.series.get(rotulos)
+        return sum(serie[:-1]) if serie else 0
+
+    def exportar(self) -> list[str]:
+        linhas = []
+        for rotulos, serie in sorted(self.series.items()):
+            acumulado = 0
+            for limite, n in zip(self.buckets + (float("inf"),), serie[:-1]):
+                acumulado += n
+                le = f'le="{_numero(float(limite))}"'
+                linhas.append(f"{self.nome}_bucket{_rotulos(self.rotulos, rotulos, le)} {acumulado}")
+            linhas.append(f"{self.nome}_sum{_rotulos(self.rotulos, rotulos)} {_numero(serie[-1])}")
+            linhas.append(f"{self.nome}_count{_rotulos(self.rotulos, rotulos)} {acumulado}")
+        return linhas
+
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nome: str, ajuda: str, rotulos: tuple[str, ...] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self.series: dict[tuple, float] = {}
+
+    def incrementar(self, *rotulos, valor: float = 1):
+        self.series[rotulos] = self.series.get(rotulos, 0) + valor
+
+    def exportar(self) -> list[str]:
+        return [f"{self.nome}{_rotulos(self.rotulos, r)} {_numero(v)}" for r, v in sorted(self.series.items())]
+
+
+class Coletado:
+    """
+    Valor lido na hora da coleta (profundidade de fila, contadores de outros módulos).
+    `coletar` devolve um número, None (sem valor agora) ou {valor do rótulo: número};
+    pode ser assíncrona.
+    """
+
+    def __init__(self, nome: str, ajuda: str, coletar: Callable, tipo: str = "gauge", rotulo: str = ""):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.coletar = coletar
+        self.tipo = tipo
+        self.rotulos = (rotulo,) if rotulo else ()
+
+    async def exportar(self) -> list[str]:
+        valor = self.coletar()
+        if inspect.isawaitable(valor):
+            valor = await valor
+        if valor is None:
+            return []
+        if isinstance(valor, dict):
+            return [f"{self.nome}{_rotulos(self.rotulos, (k,))} {_numero(v)}" for k, v in sorted(valor.items())]
+        return [f"{self.nome} {_numero(valor)}"]
+
+
+_registro: dict[str, object] = {}
+
+
+def _registrar(metrica):
+    return _registro.setdefault(metrica.nome, metrica)
+
+
+def histograma(nome: str, ajuda: str, rotulos: tuple[str, ...] = (), buckets: tuple = BUCKETS_SEGUNDOS) -> Histograma:
+    return _registrar(Histograma(nome, ajuda, rotulos, buckets))
+
+
+def contador(nome: str, ajuda: str, rotulos: tuple[str, ...] = ()) -> Contador:
+    return _registrar(Contador(nome, ajuda, rotulos))
+
+
+def coletado(nome: str, ajuda: str, coletar: Callable, tipo: str = "gauge", rotulo: str = "") -> Coletado:
+    """
+    Registra (ou substitui) um valor lido na coleta.
+    """
+    _registro[nome] = Coletado(nome, ajuda, coletar, tipo, rotulo)
+    return _registro[nome]
+
+
+async def exportar_metricas() -> str:
+    """
+    Todas as métricas no formato texto do Prometheus (GET /metrics).
+    """
+    linhas = []
+    for metrica in list(_registro.values()):
+        try:
+            amostras = metrica.exportar()
+            if inspect.isawaitable(amostras):
+                amostras = await amostras
+        except Exception:
+            continue  # um coletor com problema não derruba a coleta das demais
+        linhas.append(f"# HELP {metrica.nome} {metrica.ajuda}")
+        linhas.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+        linhas.extend(amostras)
+    return "\n".join(linhas) + "\n"
+
+
+def limpar_metricas():
+    """
+    Zera as séries de histogramas e contadores (testes).
+    """
+    for metrica in _registro.values():
+        if isinstance(metrica, (Histograma, Contador)):
+            metrica.series.clear()
+
+
+# ————— Etapas do atendimento —————
+ETAPAS = histograma(
+    "nora_etapa_segundos", "Duração das etapas do atendimento (webhook, redis, supabase, llm, zapi...)",
+    ("etapa", "operacao"),
+)
+ERROS = contador("nora_etapa_erros_total", "Exceções por etapa do atendimento", ("etapa", "operacao"))
+LLM_TOKENS = contador(
+    "nora_llm_tokens_total",
+    "Tokens gerados pelo LLM (trechos do stream; ~4 caracteres por token nas respostas completas)",
+    ("modo",),
+)
+LLM_TOKENS_S = histograma("nora_llm_tokens_por_segundo", "Velocidade de cada geração do LLM", ("modo",), BUCKETS_TOKENS_S)
+
+
+class _Medicao:
+    __slots__ = ("etapa", "operacao", "inicio")
+
+    def __init__(self, etapa: str, operacao: str):
+        self.etapa = etapa
+        self.operacao = operacao
+
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, exc, tb):
+        ETAPAS.observar(time.perf_counter() - self.inicio, self.etapa, self.operacao)
+        if tipo is not None and issubclass(tipo, Exception):
+            ERROS.incrementar(self.etapa, self.operacao)
+        return False
+
+
+class _MedicaoNula:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, exc, tb):
+        return False
+
+
+_NULA = _MedicaoNula()
+
+
+def medir(etapa: str, operacao: str = ""):
+    """
+    Bloco cronometrado (funciona também com await dentro):
+        with medir("supabase", "select"):
+            resposta = await consulta.execute()
+    """
+    if not METRICAS_ATIVAS:
+        return _NULA
+    return _Medicao(etapa, operacao)
+
+
+def cronometrar(etapa: str, operacao: Optional[str] = None):
+    """
+    Decorador para funções síncronas ou assíncronas; a operação padrão é o nome da função.
+    """
+    def decorador(funcao):
+        if not METRICAS_ATIVAS:
+            return funcao
+        nome = operacao or funcao.__name__
+        if asyncio.iscoroutinefunction(funcao):
+            @wraps(funcao)
+            async def envolvida(*args, **kwargs):
+                with _Medicao(etapa, nome):
+                    return await funcao(*args, **kwargs)
+        else:
+            @wraps(funcao)
+            def envolvida(*args, **kwargs):
+                with _Medicao(etapa, nome):
+                    return funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+
+def registrar_geracao(modo: str, tokens: int, segundos: float):
+    """
+    Tokens de uma geração do LLM e sua velocidade (tokens/s).
+    """
+    if not METRICAS_ATIVAS or tokens <= 0:
+        return
+    LLM_TOKENS.incrementar(modo, valor=tokens)
+    if segundos > 0:
+        LLM_TOKENS_S.observar(tokens / segundos, modo)
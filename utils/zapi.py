@@ -1,2 +1,216 @@
-async def enviar_mensagem_zapi(numero: str, mensagem: str):
-    print(f"\n📤 [MOCK Z-API] Mensagem para {numero}:\n{mensagem}\n")
+# utils/zapi.py
+
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+
+from utils.logger import log_event
+from utils.metrics import cronometrar
+
+# ————— Configuração Z-API —————
+ZAPI_INSTANCE = os.getenv("ZAPI_INSTANCE", "")
+ZAPI_TOKEN = os.getenv("ZAPI_TOKEN", "")
+ZAPI_CLIENT_TOKEN = os.getenv("ZAPI_CLIENT_TOKEN", "")
+ZAPI_API_URL = os.getenv("ZAPI_API_URL", "https://api.z-api.io")
+MOCK_ZAPI = os.getenv("MOCK_ZAPI", "1") == "1"
+
+# ————— Pool HTTP e política de envio —————
+ZAPI_TIMEOUT = float(os.getenv("ZAPI_TIMEOUT", "10"))
+ZAPI_MAX_CONEXOES = int(os.getenv("ZAPI_MAX_CONEXOES", "20"))
+ZAPI_MAX_CONCORRENCIA = int(os.getenv("ZAPI_MAX_CONCORRENCIA", "5"))  # envios simultâneos por instância
+ZAPI_MAX_TENTATIVAS = int(os.getenv("ZAPI_MAX_TENTATIVAS", "3"))
+ZAPI_BACKOFF_BASE = float(os.getenv("ZAPI_BACKOFF_BASE", "0.5"))  # segundos
+# Maior Retry-After (429) que vale esperar; acima disso desiste na hora
+ZAPI_RETRY_AFTER_MAX = float(os.getenv("ZAPI_RETRY_AFTER_MAX", "30"))  # segundos
+
+# Status HTTP que valem nova tentativa: limite de taxa e servidor indisponível (gateway/sobrecarga).
+# 500 não entra: a Z-API recebeu a requisição e a mensagem pode ter saído mesmo assim.
+STATUS_REPETIVEIS = {429, 502, 503, 504}
+# Falhas de rede em que a requisição com certeza não chegou à Z-API. Timeout de
+# leitura e conexão caída no meio não entram: a mensagem pode já ter sido entregue
+# e repetir mandaria duplicada para o lead.
+ERROS_REPETIVEIS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_cliente: Optional[httpx.AsyncClient] = None
+_cliente_loop: Optional[asyncio.AbstractEventLoop] = None
+_transporte: Optional[httpx.AsyncBaseTransport] = None
+_semaforos: dict[str, asyncio.Semaphore] = {}
+_envios_pendentes: set[asyncio.Task] = set()
+
+
+def get_send_url(instancia: str, token: str) -> str:
+    """
+    Monta a URL de envio de mensagens de uma instância Z-API.
+    """
+    return f"{ZAPI_API_URL}/instances/{instancia}/token/{token}/send-messages"
+
+
+def configurar_transporte(transporte: Optional[httpx.AsyncBaseTransport]):
+    """
+    Define um transporte HTTP alternativo (ex.: servidor Z-API falso nos testes).
+    O cliente atual é descartado e recriado no próximo envio.
+    """
+    global _transporte, _cliente, _cliente_loop
+    _transporte = transporte
+    _cliente = None
+    _cliente_loop = None
+
+
+def get_cliente_zapi() -> httpx.AsyncClient:
+    """
+    Retorna o cliente HTTP compartilhado (keep-alive + HTTP/2) do loop atual.
+    """
+    global _cliente, _cliente_loop
+    loop = asyncio.get_running_loop()
+    if _cliente is None or _cliente_loop is not loop or _cliente.is_closed:
+        headers = {"Client-Token": ZAPI_CLIENT_TOKEN} if ZAPI_CLIENT_TOKEN else {}
+        _cliente = httpx.AsyncClient(
+            http2=_transporte is None,
+            transport=_transporte,
+            timeout=ZAPI_TIMEOUT,
+            headers=headers,
+            limits=httpx.Limits(
+                max_connections=ZAPI_MAX_CONEXOES,
+                max_keepalive_connections=ZAPI_MAX_CONEXOES,
+            ),
+        )
+        _cliente_loop = loop
+        _semaforos.clear()
+    return _cliente
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    """
+    Segundos pedidos pelo cabeçalho Retry-After (número ou data HTTP), ou None.
+    """
+    valor = resp.headers.get("Retry-After")
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        data = parsedate_to_datetime(valor)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, data.timestamp() - time.time())
+
+
+def _get_semaforo(instancia: str) -> asyncio.Semaphore:
+    if instancia not in _semaforos:
+        _semaforos[instancia] = asyncio.Semaphore(ZAPI_MAX_CONCORRENCIA)
+    return _semaforos[instancia]
+
+
+@cronometrar("zapi", "envio")
+async def enviar_mensagem_zapi(
+    numero: str,
+    mensagem: str,
+    instancia: Optional[str] = None,
+    token: Optional[str] = None,
+    delay_typing: Optional[int] = None,
+) -> dict:
+    """
+    Envia uma mensagem de texto pela Z-API.
+    - delay_typing: segundos exibindo "digitando..." antes da mensagem (1 a 15)
+    - Reaproveita o pool de conexões compartilhado
+    - Respeita o limite de envios simultâneos por instância
+    - Repete com backoff exponencial em 429, 502, 503, 504 e falhas de conexão (nunca
+      depois que a requisição pode ter chegado: 500 e timeout de leitura não são repetidos)
+    - Em 429, espera o Retry-After (até ZAPI_RETRY_AFTER_MAX)
+    - Com MOCK_ZAPI=1 apenas registra o envio
+    """
+    body = {"phone": numero, "message": mensagem}
+    if delay_typing:
+        body["delayTyping"] = max(1, min(15, delay_typing))
+
+    if MOCK_ZAPI:
+        log_event("📤 MOCK Mensagem enviada Z-API", {"body": body})
+        return {"mock": True}
+
+    instancia = instancia or ZAPI_INSTANCE
+    token = token or ZAPI_TOKEN
+    cliente = get_cliente_zapi()
+    url = get_send_url(instancia, token)
+
+    ultimo_erro: Exception | None = None
+    for tentativa in range(1, ZAPI_MAX_TENTATIVAS + 1):
+        pedida = None
+        try:
+            async with _get_semaforo(instancia):
+                resp = await cliente.post(url, json=body)
+            if resp.status_code not in STATUS_REPETIVEIS:
+                resp.raise_for_status()
+                try:
+                    resposta = resp.json()
+                except ValueError:
+                    # Envio aceito com corpo vazio ou fora do JSON
+                    resposta = {"texto": resp.text} if resp.text else {}
+                log_event("📤 Mensagem enviada Z-API", {"body": body, "response": resposta})
+                return resposta
+            ultimo_erro = RuntimeError(f"Z-API respondeu {resp.status_code}")
+            if resp.status_code == 429:
+                pedida = _retry_after(resp)
+        except ERROS_REPETIVEIS as e:
+            ultimo_erro = e
+        except httpx.TransportError as e:
+            raise RuntimeError(f"[ERRO] Envio Z-API para {numero} interrompido (não repetido): {e!r}") from e
+        except httpx.HTTPStatusError as e:
+            # 4xx que não sejam 429 não se resolvem repetindo; 500 pode já ter enviado
+            raise RuntimeError(f"[ERRO] Z-API recusou o envio para {numero}: {e}") from e
+
+        if tentativa < ZAPI_MAX_TENTATIVAS:
+            if pedida is not None and pedida > ZAPI_RETRY_AFTER_MAX:
+                raise RuntimeError(
+                    f"[ERRO] Z-API limitou os envios para {numero} por {pedida:.0f}s (Retry-After): {ultimo_erro}"
+                )
+            espera = ZAPI_BACKOFF_BASE * (2 ** (tentativa - 1))
+            espera += random.uniform(0, espera / 2)
+            await asyncio.sleep(max(espera, pedida or 0))
+
+    raise RuntimeError(
+        f"[ERRO] Falha ao enviar Z-API para {numero} após {ZAPI_MAX_TENTATIVAS} tentativas: {ultimo_erro}"
+    )
+
+
+async def _enviar_em_segundo_plano(numero: str, mensagem: str):
+    try:
+        await enviar_mensagem_zapi(numero, mensagem)
+    except Exception as e:
+        log_event("❌ Erro ao enviar Z-API", {"error": str(e), "body": {"phone": numero, "message": mensagem}})
+
+
+def agendar_envio_zapi(numero: str, mensagem: str) -> asyncio.Task:
+    """
+    Dispara o envio em segundo plano, sem bloquear o processamento de entrada.
+    """
+    task = asyncio.create_task(_enviar_em_segundo_plano(numero, mensagem))
+    _envios_pendentes.add(task)
+    task.add_done_callback(_envios_pendentes.discard)
+    return task
+
+
+async def aguardar_envios_pendentes():
+    """
+    Aguarda os envios ainda em andamento (usado no shutdown e nos testes).
+    """
+    if _envios_pendentes:
+        await asyncio.gather(*list(_envios_pendentes), return_exceptions=True)
+
+
+async def fechar_cliente_zapi():
+    """
+    Encerra o pool de conexões compartilhado.
+    """
+    global _cliente, _cliente_loop
+    if _cliente is not None and not _cliente.is_closed:
+        await _cliente.aclose()
+    _cliente = None
+    _cliente_loop = None
+    _semaforos.clear()